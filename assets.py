@@ -0,0 +1,241 @@
+"""Сборка CSS и JS страницы в статические файлы с хэшем содержимого в имени.
+
+Раньше ``/`` отдавал ``html_content`` целиком: стили и скрипт игры (~4000
+строк) приходили заново при каждом открытии Mini App. При старте
+``build_assets`` выносит встроенные ``<style>`` и ``<script>`` в файлы
+``app.<hash>.css`` / ``app.<hash>.js`` в каталоге статики и оставляет в HTML
+ссылки на них. Имя меняется вместе с содержимым, поэтому такие файлы
+отдаются с ``Cache-Control: immutable`` и при повторных открытиях берутся из
+кэша webview без запроса; сама страница перепроверяется по ETag.
+
+Собранные файлы, переданные в ``AssetStaticFiles`` как ``CompressedBody``,
+отдаются из памяти заранее сжатыми (brotli/gzip по Accept-Encoding).
+
+Остальная статика обслуживается через ``StaticFileCache``: хэш содержимого
+(он же сильный ETag) считается один раз на версию файла, небольшие файлы
+держатся в памяти. Ссылки на картинки в странице получают ``?v=<хэш>`` -
+такие запросы кэшируются навсегда, а запросы без версии перепроверяются по
+ETag и получают 304.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from fastapi.responses import FileResponse, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers, QueryParams
+
+from compression import CompressedBody
+
+logger = logging.getLogger(__name__)
+
+# Встроенные блоки без атрибутов (внешние <script src=...> не трогаем)
+INLINE_STYLE = re.compile(r"<style>(.*?)</style>", re.S)
+INLINE_SCRIPT = re.compile(r"<script>(.*?)</script>", re.S)
+
+# Имена собранных файлов: app.<12 hex>.css / app.<12 hex>.js
+ASSET_PREFIX = "app"
+FINGERPRINTED_NAME = re.compile(r"^[\w-]+\.[0-9a-f]{12}\.\w+$")
+
+# Ссылки на картинки из статики в HTML, CSS и JS страницы
+STATIC_IMAGE_REFERENCE = re.compile(r"/static/([\w/-]+\.(?:png|jpe?g|gif|webp|avif|svg|ico))\b(?!\?)")
+
+# Год - максимум, который имеет смысл указывать в max-age
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Файлы без версии в имени или URL могут измениться: браузер перепроверяет их по ETag
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+class StaticEntry:
+    """Хэш, заголовки и (для небольших файлов) содержимое одной версии файла"""
+
+    __slots__ = ("version", "digest", "etag", "last_modified", "media_type", "content")
+
+    def __init__(self, version: Tuple[int, int], digest: str, last_modified: str,
+                 media_type: str, content: Optional[bytes]):
+        self.version = version
+        self.digest = digest
+        self.etag = f'"{digest}"'
+        self.last_modified = last_modified
+        self.media_type = media_type
+        self.content = content
+
+
+class StaticFileCache:
+    """Хэши содержимого файлов статики и содержимое небольших файлов в памяти"""
+
+    def __init__(self, max_file_size: int = 512 * 1024, max_total_size: int = 32 * 1024 * 1024):
+        self.max_file_size = max_file_size
+        self.max_total_size = max_total_size
+        self.total_size = 0
+        self._entries: Dict[str, StaticEntry] = {}
+
+    def entry(self, full_path: str, stat_result: os.stat_result) -> StaticEntry:
+        """Запись для файла; хэш пересчитывается, только если файл изменился"""
+        version = (stat_result.st_mtime_ns, stat_result.st_size)
+        entry = self._entries.get(full_path)
+        if entry is not None and entry.version == version:
+            return entry
+
+        with open(full_path, "rb") as file:
+            content = file.read()
+        digest = hashlib.blake2b(content, digest_size=6).hexdigest()
+
+        if entry is not None and entry.content is not None:
+            self.total_size -= len(entry.content)
+        keep = len(content) <= self.max_file_size and self.total_size + len(content) <= self.max_total_size
+        if keep:
+            self.total_size += len(content)
+
+        entry = StaticEntry(
+            version,
+            digest,
+            formatdate(stat_result.st_mtime, usegmt=True),
+            mimetypes.guess_type(full_path)[0] or "application/octet-stream",
+            content if keep else None,
+        )
+        self._entries[full_path] = entry
+        return entry
+
+    def warm(self, directory: Path) -> None:
+        """Считает хэши всех файлов каталога заранее, чтобы не читать их во время запросов"""
+        for path in directory.rglob("*"):
+            if path.is_file():
+                self.entry(str(path.resolve()), path.stat())
+        logger.info(f"Static cache warmed: {len(self._entries)} files, {self.total_size} bytes in memory")
+
+    def versioned_url(self, directory: Path, name: str, url_prefix: str = "/static") -> Optional[str]:
+        """URL файла с версией содержимого (?v=<хэш>); None, если файла нет"""
+        path = (directory / name).resolve()
+        if not path.is_file():
+            return None
+        return f"{url_prefix}/{name}?v={self.entry(str(path), path.stat()).digest}"
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            "files": len(self._entries),
+            "in_memory": sum(1 for entry in self._entries.values() if entry.content is not None),
+            "bytes_in_memory": self.total_size,
+        }
+
+
+def is_not_modified(request_headers: Headers, entry: StaticEntry) -> bool:
+    """Условный запрос: If-None-Match важнее If-Modified-Since"""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in candidates or entry.etag in candidates
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(entry.last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def fingerprint(content: bytes) -> str:
+    """Короткий хэш содержимого для имени файла"""
+    return hashlib.blake2b(content, digest_size=6).hexdigest()
+
+
+def write_asset(directory: Path, extension: str, content: bytes) -> str:
+    """Записывает ресурс под именем с хэшем (если такого еще нет) и возвращает имя"""
+    name = f"{ASSET_PREFIX}.{fingerprint(content)}.{extension}"
+    path = directory / name
+    if not path.exists():
+        # Пишем во временный файл и переименовываем: параллельно стартующие
+        # воркеры не увидят недописанный файл
+        tmp_path = directory / f".{name}.{os.getpid()}.tmp"
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, path)
+    return name
+
+
+def remove_stale_assets(directory: Path, keep: List[str]) -> None:
+    """Удаляет собранные файлы прошлых версий страницы"""
+    for extension in ("css", "js"):
+        for path in directory.glob(f"{ASSET_PREFIX}.*.{extension}"):
+            if path.name not in keep and FINGERPRINTED_NAME.match(path.name):
+                path.unlink(missing_ok=True)
+
+
+def build_assets(html: str, directory: Path, url_prefix: str = "/static",
+                 file_cache: Optional[StaticFileCache] = None) -> Tuple[str, Dict[str, bytes]]:
+    """Выносит встроенные стили и скрипты в файлы; возвращает HTML-оболочку и содержимое файлов по именам"""
+    directory.mkdir(parents=True, exist_ok=True)
+    assets: Dict[str, bytes] = {}
+
+    # Ссылки на картинки получают версию до подсчета хэшей CSS и JS: новая
+    # картинка меняет и имена файлов страницы
+    if file_cache is not None:
+        html = STATIC_IMAGE_REFERENCE.sub(
+            lambda match: file_cache.versioned_url(directory, match.group(1), url_prefix) or match.group(0), html
+        )
+
+    def extract(extension: str, text: str) -> str:
+        content = text.encode("utf-8")
+        name = write_asset(directory, extension, content)
+        assets[name] = content
+        return name
+
+    def extract_style(match: re.Match) -> str:
+        return f'<link rel="stylesheet" href="{url_prefix}/{extract("css", match.group(1))}">'
+
+    def extract_script(match: re.Match) -> str:
+        return f'<script src="{url_prefix}/{extract("js", match.group(1))}"></script>'
+
+    shell = INLINE_SCRIPT.sub(extract_script, INLINE_STYLE.sub(extract_style, html))
+    remove_stale_assets(directory, list(assets))
+    logger.info(f"Built {len(assets)} page assets: {', '.join(assets)} (shell {len(shell.encode('utf-8'))} bytes)")
+    return shell, assets
+
+
+class AssetStaticFiles(StaticFiles):
+    """StaticFiles с сильными ETag, политикой Cache-Control и небольшими файлами в памяти"""
+
+    def __init__(self, *args, precompressed: Optional[Mapping[str, CompressedBody]] = None,
+                 file_cache: Optional[StaticFileCache] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Словарь может заполняться после монтирования (сборка идет позже)
+        self.precompressed = precompressed if precompressed is not None else {}
+        self.file_cache = file_cache if file_cache is not None else StaticFileCache()
+
+    async def get_response(self, path: str, scope):
+        body = self.precompressed.get(path)
+        if body is None or scope["method"] not in ("GET", "HEAD"):
+            return await super().get_response(path, scope)
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        return body.response(Headers(scope=scope).get("accept-encoding"), media_type, {"Cache-Control": IMMUTABLE_CACHE_CONTROL})
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        entry = self.file_cache.entry(str(full_path), stat_result)
+        request_headers = Headers(scope=scope)
+
+        # Вечный кэш - только если версия в имени или в URL совпадает с содержимым
+        versioned = (
+            FINGERPRINTED_NAME.match(os.path.basename(full_path))
+            or QueryParams(scope["query_string"]).get("v") == entry.digest
+        )
+        headers = {
+            "ETag": entry.etag,
+            "Last-Modified": entry.last_modified,
+            "Cache-Control": IMMUTABLE_CACHE_CONTROL if versioned else REVALIDATE_CACHE_CONTROL,
+            "Accept-Ranges": "bytes",
+        }
+
+        if status_code == 200 and is_not_modified(request_headers, entry):
+            return Response(status_code=304, headers=headers)
+
+        # Диапазоны и большие файлы отдает FileResponse с диска (он же обрабатывает Range и If-Range)
+        if entry.content is not None and "range" not in request_headers:
+            return Response(content=entry.content, status_code=status_code, media_type=entry.media_type, headers=headers)
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        response.headers.update(headers)
+        return response
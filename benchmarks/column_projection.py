@@ -0,0 +1,174 @@
+"""Сколько байт и времени экономит чтение только нужных колонок users.
+
+Скрипт создает тестовых пользователей с правдоподобно заполненными
+JSON-полями (улучшения, достижения, история ежедневного бонуса) и читает их
+наборами колонок из stores/base.py: вся запись (как ``select *``), горячие
+колонки, холодные JSON-поля и наборы отдельных сценариев. Для каждого
+набора выводятся средний размер строки в JSON и задержка p50/p95 одного
+чтения, а также экономия относительно чтения всей записи.
+
+По умолчанию используется временный файл SQLite:
+
+    python benchmarks/column_projection.py --users 200 --reads 2000
+
+Против Supabase (тестовые строки удаляются после замера; строка ``select *``
+показывает и старые колонки, которые приложение больше не читает, например
+users.referrals):
+
+    python benchmarks/column_projection.py --backend supabase --url http://127.0.0.1:54321 --key <service_role key>
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from stores import (  # noqa: E402
+    DAILY_BONUS_COLUMNS,
+    LEADERBOARD_COLUMNS,
+    PROFILE_COLUMNS,
+    REFERRAL_COUNT_COLUMNS,
+    SESSION_COLUMNS,
+    USER_COLD_COLUMNS,
+    USER_COLUMNS,
+    USER_HOT_COLUMNS,
+    SQLiteStore,
+    SupabaseStore,
+    UserStore,
+)
+
+# Наборы колонок в порядке вывода; None - "select *" (только для Supabase)
+PROJECTIONS = [
+    ("select *", None),
+    ("all columns", USER_COLUMNS),
+    ("session", SESSION_COLUMNS),
+    ("hot columns", USER_HOT_COLUMNS),
+    ("cold JSON columns", ("user_id",) + USER_COLD_COLUMNS),
+    ("profile (lazy)", ("user_id",) + PROFILE_COLUMNS),
+    ("daily bonus", DAILY_BONUS_COLUMNS),
+    ("referral count", REFERRAL_COUNT_COLUMNS),
+    ("leaderboard row", LEADERBOARD_COLUMNS),
+]
+
+
+def make_user_row(user_id: str, rng: random.Random) -> Dict[str, Any]:
+    """Игрок с несколькими месяцами прогресса"""
+    days = rng.randint(30, 365)
+    start = date(2025, 1, 1)
+    return {
+        "user_id": user_id,
+        "first_name": f"User{rng.randint(1, 10 ** 6)}",
+        "last_name": "",
+        "username": f"user_{rng.randint(1, 10 ** 6)}",
+        "photo_url": f"https://t.me/i/userpic/320/{uuid.uuid4().hex}.jpg",
+        "score": rng.randint(0, 10 ** 7),
+        "total_clicks": rng.randint(0, 10 ** 6),
+        "level": 1,
+        "wallet_address": "",
+        "wallet_task_completed": False,
+        "channel_task_completed": True,
+        "energy": rng.randint(0, 250),
+        "last_energy_update": "2026-01-01T00:00:00+00:00",
+        "last_referral_task_completion": None,
+        "upgrades": [f"upgrade{i}" for i in range(1, rng.randint(5, 30))],
+        "ads_watched": rng.randint(0, 500),
+        "achievements": [f"achievement_{i}" for i in range(rng.randint(5, 40))],
+        "daily_bonus": {
+            "last_claim": "2026-01-01T00:00:00+00:00",
+            "streak": rng.randint(1, 7),
+            "claimed_days": [(start + timedelta(days=i)).isoformat() for i in range(days)],
+        },
+        "language": "ru",
+        "last_passive_income_update": "2026-01-01T00:00:00+00:00",
+        "last_ad_time": "2026-01-01T00:00:00+00:00",
+    }
+
+
+async def read_row(store: UserStore, user_id: str, columns: Optional[Sequence[str]]) -> Optional[Dict[str, Any]]:
+    if columns is None:
+        response = await store.client.table("users").select("*").eq("user_id", user_id).execute()
+        return response.data[0] if response.data else None
+    return await store.get_user(user_id, columns)
+
+
+async def measure(store: UserStore, user_ids: List[str], columns: Optional[Sequence[str]], reads: int) -> Dict[str, float]:
+    sizes = []
+    latencies = []
+    for i in range(reads):
+        started = time.perf_counter()
+        row = await read_row(store, user_ids[i % len(user_ids)], columns)
+        latencies.append((time.perf_counter() - started) * 1000)
+        sizes.append(len(json.dumps(row, ensure_ascii=False).encode()))
+    latencies.sort()
+    return {
+        "bytes": statistics.mean(sizes),
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[int(len(latencies) * 0.95)],
+    }
+
+
+async def run(store: UserStore, users: int, reads: int, seed: int) -> None:
+    rng = random.Random(seed)
+    prefix = f"bench-{uuid.uuid4().hex[:8]}-"
+    rows = [make_user_row(f"{prefix}{i}", rng) for i in range(users)]
+    user_ids = [row["user_id"] for row in rows]
+    await store.upsert_users(rows)
+
+    try:
+        results = []
+        for name, columns in PROJECTIONS:
+            if columns is None and not isinstance(store, SupabaseStore):
+                continue
+            results.append((name, columns, await measure(store, user_ids, columns, reads)))
+    finally:
+        for user_id in user_ids:
+            await store.delete_user(user_id)
+
+    baseline = next(result for name, columns, result in results if columns == USER_COLUMNS)
+    print(f"{store.name}: {users} users, {reads} sequential reads per projection")
+    print(f"{'projection':<24}{'columns':>8}{'bytes':>10}{'p50 ms':>10}{'p95 ms':>10}{'bytes saved':>13}{'p50 saved':>11}")
+    for name, columns, result in results:
+        count = "*" if columns is None else str(len(columns))
+        saved_bytes = 1 - result["bytes"] / baseline["bytes"]
+        saved_p50 = 1 - result["p50"] / baseline["p50"] if baseline["p50"] else 0.0
+        print(
+            f"{name:<24}{count:>8}{result['bytes']:>10.0f}{result['p50']:>10.3f}{result['p95']:>10.3f}"
+            f"{saved_bytes:>12.0%}{saved_p50:>11.0%}"
+        )
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    if args.backend == "supabase":
+        store = SupabaseStore.from_url(args.url, args.key)
+    else:
+        directory = tempfile.mkdtemp(prefix="column-projection-")
+        store = SQLiteStore(os.path.join(directory, "bench.db"))
+    try:
+        await run(store, args.users, args.reads, args.seed)
+    finally:
+        await store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=("sqlite", "supabase"), default="sqlite")
+    parser.add_argument("--url", default=os.environ.get("SUPABASE_URL", "http://127.0.0.1:54321"))
+    parser.add_argument("--key", default=os.environ.get("SUPABASE_KEY", ""))
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--reads", type=int, default=2000, help="чтений на каждый набор колонок")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
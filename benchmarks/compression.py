@@ -0,0 +1,96 @@
+"""Байты на проводе и CPU на запрос для сжатия ответов.
+
+Скрипт поднимает приложение в процессе (хранилище в памяти), заводит
+``--users`` игроков и запрашивает страницу, собранные CSS/JS, /config, /top
+и /user с разными Accept-Encoding. Для каждой пары выводятся размер тела на
+проводе, экономия относительно несжатого ответа и процессорное время на
+запрос (вместе с обработкой самого запроса).
+
+Отдельная таблица показывает, сколько CPU стоило бы сжимать те же тела на
+каждый запрос, а не один раз при старте: это и есть экономия от заранее
+подготовленных вариантов.
+
+    python benchmarks/compression.py --users 200 --requests 200
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+from compression import brotli  # noqa: E402
+
+ACCEPT_ENCODINGS = [("identity", "identity"), ("gzip", "gzip, deflate"), ("br", "br, gzip, deflate")]
+
+
+def fetch_raw(client: TestClient, url: str, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+    """Тело ответа в том виде, в каком оно ушло по сети"""
+    with client.stream("GET", url, headers={"Accept-Encoding": accept_encoding}) as response:
+        return b"".join(response.iter_raw()), response.headers.get("content-encoding")
+
+
+def cpu_per_call(func: Callable[[], object], calls: int) -> float:
+    """Процессорное время на вызов, мкс"""
+    started = time.process_time()
+    for _ in range(calls):
+        func()
+    return (time.process_time() - started) / calls * 1e6
+
+
+def run(users: int, requests: int) -> None:
+    with TestClient(main.app) as client:
+        for i in range(users):
+            client.post("/user", json={"id": f"bench{i}", "first_name": f"Player{i}", "username": f"player_{i}",
+                                       "score": i * 1337, "upgrades": ["upgrade1", "upgrade4"]})
+        client.get("/top")
+
+        urls = ["/", *(f"/static/{name}" for name in main.page_assets), "/config", "/top", "/user/bench7"]
+        print(f"brotli: {'available' if brotli is not None else 'not installed (gzip only)'}")
+        print(f"{'url':<32}{'encoding':>10}{'sent as':>9}{'bytes':>10}{'saved':>8}{'cpu us/req':>12}")
+        identity_bodies: Dict[str, bytes] = {}
+        for url in urls:
+            for name, accept_encoding in ACCEPT_ENCODINGS:
+                body, sent_as = fetch_raw(client, url, accept_encoding)
+                if name == "identity":
+                    identity_bodies[url] = body
+                saved = 1 - len(body) / len(identity_bodies[url])
+                cpu = cpu_per_call(lambda: fetch_raw(client, url, accept_encoding), requests)
+                print(f"{url:<32}{name:>10}{sent_as or '-':>9}{len(body):>10}{saved:>8.0%}{cpu:>12.0f}")
+
+    print()
+    print("cost of compressing the same bodies on every request instead of once:")
+    codecs: List[Tuple[str, Callable[[bytes], bytes]]] = [
+        ("gzip-6", lambda body: gzip.compress(body, compresslevel=6)),
+        ("gzip-9", lambda body: gzip.compress(body, compresslevel=9)),
+    ]
+    if brotli is not None:
+        codecs += [
+            ("br-5", lambda body: brotli.compress(body, quality=5)),
+            ("br-11", lambda body: brotli.compress(body, quality=11)),
+        ]
+    print(f"{'url':<32}{'codec':>10}{'bytes':>10}{'cpu us/req':>12}")
+    for url, body in identity_bodies.items():
+        for name, compress in codecs:
+            calls = max(1, requests // 10) if name == "br-11" else requests
+            cpu = cpu_per_call(lambda: compress(body), calls)
+            print(f"{url:<32}{name:>10}{len(compress(body)):>10}{cpu:>12.0f}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="игроков в рейтинге")
+    parser.add_argument("--requests", type=int, default=200, help="запросов на каждую пару url/кодировка")
+    args = parser.parse_args()
+    run(args.users, args.requests)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,162 @@
+"""Время сериализации ответов: JSONResponse (json.dumps) против orjson.
+
+Скрипт собирает реалистичные данные без сервера и хранилища: ``--users``
+игроков с кириллическими именами, разным числом улучшений и достижений и
+историей ежедневного бонуса. Для каждого вида ответа - /user, строка и
+страница топа, подтверждение тапов по WebSocket - выводится время
+сериализации в микросекундах и ускорение относительно прежнего пути
+(``JSONResponse`` / ``json.dumps``):
+
+- stdlib: прежняя сборка словаря и ``JSONResponse(content=...)`` или
+  ``json.dumps`` с настройками Starlette;
+- orjson: тот же словарь через ``FastJSONResponse`` или ``json_codec.dumps``;
+- encoder: словарь собирается заранее подготовленным ``RecordEncoder``
+  (для /user и топа) и кодируется orjson - путь, которым идет приложение.
+
+    python benchmarks/json_encoding.py --users 1000 --repeat 5
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from operator import attrgetter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from fastapi.responses import JSONResponse  # noqa: E402
+
+import main  # noqa: E402 - настраивает UserState таблицами уровней и улучшений приложения
+from json_codec import FastJSONResponse, dumps, orjson  # noqa: E402
+from user_state import RESPONSE_ENCODER, RESPONSE_FIELDS, UserState  # noqa: E402
+
+# Настройки json.dumps в JSONResponse.render
+STDLIB_OPTIONS = {"ensure_ascii": False, "allow_nan": False, "indent": None, "separators": (",", ":")}
+
+FIRST_NAMES = ["Алексей", "Мария", "Dmitry", "Анна", "Иван", "Olga", "Сергей", "Екатерина", "Tom", "Никита"]
+UPGRADE_IDS = [f"upgrade{i}" for i in range(1, 11)]
+ACHIEVEMENTS = ["first_click", "clicks_100", "clicks_1000", "score_1000", "score_100000", "level_5", "referral_1"]
+# Прежний UserState.to_response: ключи и attrgetter по RESPONSE_FIELDS
+_response_keys = tuple(key for key, _ in RESPONSE_FIELDS)
+_response_values = attrgetter(*(attr for _, attr in RESPONSE_FIELDS))
+
+
+def previous_to_response(state: UserState) -> Dict[str, Any]:
+    return dict(zip(_response_keys, _response_values(state)))
+
+
+def previous_format_top_users(top_users: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Прежний format_top_users"""
+    response_users = []
+    for user in top_users:
+        response_users.append({
+            "id": user["user_id"],
+            "first_name": user["first_name"],
+            "last_name": user["last_name"],
+            "username": user["username"],
+            "photo_url": user["photo_url"],
+            "score": user["score"],
+            "level": user["level"]
+        })
+    return response_users
+
+
+def make_row(rng: random.Random, index: int) -> Dict[str, Any]:
+    """Строка users, похожая на настоящую"""
+    days = [f"2026-09-{day:02d}" for day in range(1, rng.randint(1, 28))]
+    return {
+        "user_id": str(100000000 + index * 7919),
+        "first_name": rng.choice(FIRST_NAMES),
+        "last_name": rng.choice(["", "Иванов", "Smith", "Кузнецова"]),
+        "username": f"player_{index}",
+        "photo_url": f"https://t.me/i/userpic/320/{index:08x}.jpg",
+        "score": rng.randint(0, 50_000_000),
+        "total_clicks": rng.randint(0, 1_000_000),
+        "wallet_address": rng.choice(["", "UQBvW8Z5huBkMJYdnfAEM5JqTNkuWX3diqYENkWsIL0XggGG"]),
+        "upgrades": rng.sample(UPGRADE_IDS, rng.randint(0, len(UPGRADE_IDS))),
+        "achievements": rng.sample(ACHIEVEMENTS, rng.randint(0, len(ACHIEVEMENTS))),
+        "daily_bonus": {"last_claim": "2026-10-16T08:12:45.120+00:00", "streak": len(days), "claimed_days": days},
+        "language": rng.choice(["ru", "en"]),
+        "referral_count": rng.randint(0, 40),
+    }
+
+
+def time_per_call(func: Callable[[Any], object], items: Sequence[Any], repeat: int) -> float:
+    """Лучшее из repeat прогонов по всем items, мкс на вызов"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for item in items:
+            func(item)
+        best = min(best, time.perf_counter() - started)
+    return best / len(items) * 1e6
+
+
+def run(users: int, top_size: int, repeat: int, seed: int) -> None:
+    rng = random.Random(seed)
+    rows = [make_row(rng, i) for i in range(users)]
+    states = [UserState.from_row(row) for row in rows]
+    top_rows = sorted(rows, key=lambda row: row["score"], reverse=True)
+    for row in top_rows:
+        row["level"] = main.LEVEL_TABLE.index(row["score"])
+    top_pages = [top_rows[i:i + top_size] for i in range(0, max(1, len(top_rows) - top_size + 1), max(1, top_size // 4))]
+    acks = [{"status": "success", "seq": i, "applied": 12, "duplicate": False, "click_bonus": 3, "passive_income": 5,
+             "score": state.score, "total_clicks": state.total_clicks, "energy": state.energy,
+             "last_energy_update": state.last_energy_update, "last_passive_income_update": state.last_passive_income_update,
+             "level": state.level, "type": "taps_ack", "id": i} for i, state in enumerate(states)]
+
+    user_encoder, top_encoder = RESPONSE_ENCODER, main.TOP_USER_ENCODER
+
+    cases: List[Tuple[str, int, Dict[str, Callable[[Any], object]], Sequence[Any]]] = [
+        ("GET /user", len(dumps({"user": states[0].to_response()})), {
+            "stdlib": lambda state: JSONResponse(content={"user": previous_to_response(state)}),
+            "orjson": lambda state: FastJSONResponse(content={"user": previous_to_response(state)}),
+            "encoder": lambda state: FastJSONResponse(content={"user": user_encoder.to_dict(state)}),
+        }, states),
+        ("user body only", len(dumps(states[0].to_response())), {
+            "stdlib": lambda state: json.dumps(previous_to_response(state), **STDLIB_OPTIONS).encode("utf-8"),
+            "orjson": lambda state: dumps(previous_to_response(state)),
+            "encoder": user_encoder.encode,
+        }, states),
+        ("top row", len(dumps(top_encoder.to_dict(top_rows[0]))), {
+            "stdlib": lambda row: json.dumps(previous_format_top_users([row])[0], **STDLIB_OPTIONS).encode("utf-8"),
+            "orjson": lambda row: dumps(previous_format_top_users([row])[0]),
+            "encoder": top_encoder.encode,
+        }, top_rows),
+        (f"GET /top ({top_size})", len(dumps({"users": top_encoder.to_list(top_pages[0])})), {
+            "stdlib": lambda page: json.dumps({"users": previous_format_top_users(page)}, **STDLIB_OPTIONS).encode("utf-8"),
+            "orjson": lambda page: dumps({"users": previous_format_top_users(page)}),
+            "encoder": lambda page: dumps({"users": top_encoder.to_list(page)}),
+        }, top_pages),
+        ("ws taps_ack", len(dumps(acks[0])), {
+            "stdlib": lambda ack: json.dumps(ack, ensure_ascii=False),
+            "orjson": lambda ack: dumps(ack).decode("utf-8"),
+        }, acks),
+    ]
+
+    print(f"orjson: {orjson.__version__ if orjson is not None else 'not installed (stdlib fallback)'}")
+    print(f"{users} users, top pages of {top_size}, best of {repeat} runs")
+    print(f"{'payload':<20}{'bytes':>8}{'stdlib us':>11}{'orjson us':>11}{'encoder us':>12}{'speedup':>9}")
+    for name, size, variants, items in cases:
+        times = {variant: time_per_call(func, items, repeat) for variant, func in variants.items()}
+        best = min(times["orjson"], times.get("encoder", float("inf")))
+        encoder = f"{times['encoder']:>12.2f}" if "encoder" in times else f"{'-':>12}"
+        print(f"{name:<20}{size:>8}{times['stdlib']:>11.2f}{times['orjson']:>11.2f}{encoder}{times['stdlib'] / best:>8.1f}x")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="игроков в выборке")
+    parser.add_argument("--top-size", type=int, default=100, help="игроков на странице топа")
+    parser.add_argument("--repeat", type=int, default=5, help="прогонов, берется лучший")
+    parser.add_argument("--seed", type=int, default=1, help="зерно генератора данных")
+    args = parser.parse_args()
+    run(args.users, args.top_size, args.repeat, args.seed)
+
+
+if __name__ == "__main__":
+    main_cli()
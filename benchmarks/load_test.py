@@ -0,0 +1,260 @@
+"""Нагрузочный тест API: задержки (p50/p95/p99) под конкурентной нагрузкой.
+
+Тест состоит из двух частей:
+
+* ``stub`` - заглушка PostgREST API Supabase с искусственной задержкой,
+  чтобы измерять поведение сервера без сети и реальной базы;
+* ``run`` - генератор нагрузки, который держит ``--concurrency`` параллельных
+  клиентов и выполняет смесь запросов ``GET /user/{id}``, ``POST /user`` и ``GET /top``.
+
+Пример сравнения "до/после":
+
+    python benchmarks/load_test.py stub --port 54321 --latency 0.05
+    SUPABASE_URL=http://127.0.0.1:54321 SUPABASE_KEY=test uvicorn main:app --port 8000
+    python benchmarks/load_test.py run --url http://127.0.0.1:8000 --concurrency 200 --requests 4000
+
+Запустите сервер на коммите до перехода на асинхронный клиент и после него.
+При синхронных вызовах Supabase каждый запрос блокирует цикл событий, и p99
+растет пропорционально числу конкурентных клиентов; с асинхронным клиентом
+p99 остается близким к задержке самой базы.
+
+Без заглушки сервер можно запустить на локальном хранилище, чтобы отделить
+накладные расходы приложения от задержки базы:
+
+    STORAGE_BACKEND=memory uvicorn main:app --port 8000
+    STORAGE_BACKEND=sqlite SQLITE_PATH=/tmp/load.db uvicorn main:app --port 8000
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from typing import Any, Dict, List
+from urllib.parse import parse_qs
+
+import httpx
+import uvicorn
+
+
+def make_user_row(user_id: str) -> Dict:
+    """Генерирует правдоподобную запись пользователя"""
+    seed = sum(ord(c) for c in user_id)
+    return {
+        "user_id": user_id,
+        "first_name": f"User{user_id}",
+        "last_name": "",
+        "username": f"user_{user_id}",
+        "photo_url": "",
+        "score": seed * 37,
+        "total_clicks": seed * 11,
+        "level": 0,
+        "wallet_address": "",
+        "wallet_task_completed": False,
+        "channel_task_completed": False,
+        "referrals": [str(seed + i) for i in range(seed % 5)],
+        "referral_count": seed % 5,
+        "energy": 250,
+        "last_energy_update": "2026-01-01T00:00:00+00:00",
+        "last_referral_task_completion": None,
+        "upgrades": ["upgrade1", "upgrade4"],
+        "ads_watched": seed % 10,
+        "achievements": ["first_click"],
+        "daily_bonus": {"last_claim": None, "streak": 0, "claimed_days": []},
+        "language": "ru",
+        "last_passive_income_update": "2026-01-01T00:00:00+00:00",
+        "last_ad_time": "2026-01-01T00:00:00+00:00",
+    }
+
+
+def stub_rpc(name: str, params: Dict) -> Any:
+    """Правдоподобный ответ хранимой функции (без атомарности, только для нагрузки)"""
+    user_id = params.get("p_user_id", "")
+    row = make_user_row(user_id)
+    if name == "increment_score":
+        return {"score": row["score"] + params.get("p_delta", 0)}
+    if name == "append_referral":
+        return {"referral_count": row["referral_count"] + 1, "added": True}
+    if name == "recount_referrals":
+        return len(params.get("p_user_ids", []))
+    if name == "append_achievement":
+        achievements = row["achievements"] + [params.get("p_achievement_id")]
+        return {"achievements": achievements, "added": True, "score": row["score"] + params.get("p_reward", 0)}
+    if name == "purchase_upgrade":
+        upgrades = row["upgrades"] + [params.get("p_upgrade_id")]
+        return {"purchased": True, "score": row["score"] - params.get("p_cost", 0), "upgrades": upgrades}
+    if name == "claim_task_reward":
+        return {
+            "claimed": True,
+            "score": row["score"] + params.get("p_reward", 0),
+            "wallet_task_completed": row["wallet_task_completed"],
+            "channel_task_completed": True,
+            "last_referral_task_completion": row["last_referral_task_completion"],
+        }
+    if name == "record_ad_view":
+        return {"ads_watched": row["ads_watched"] + 1, "last_ad_time": "2026-01-01T00:00:00+00:00"}
+    if name == "claim_ad_reward":
+        claimed = row["ads_watched"] >= params.get("p_required", 0)
+        ads_watched = row["ads_watched"] - params.get("p_required", 0) if claimed else row["ads_watched"]
+        score = row["score"] + params.get("p_reward", 0) if claimed else row["score"]
+        return {"claimed": claimed, "ads_watched": ads_watched, "score": score}
+    if name == "claim_daily_bonus":
+        reward = params.get("p_rewards", [0])[0]
+        daily_bonus = {"last_claim": "2026-01-01T00:00:00+00:00", "streak": 1, "claimed_days": ["2026-01-01"]}
+        return {"status": "success", "reward": reward, "streak": 1, "daily_bonus": daily_bonus, "score": row["score"] + reward}
+    return {}
+
+
+def make_stub_app(latency: float, jitter: float, total_users: int):
+    """ASGI-заглушка PostgREST с задержкой ответа"""
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        body = b""
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+        await asyncio.sleep(latency + random.uniform(0, jitter))
+
+        method = scope["method"]
+        params = parse_qs(scope["query_string"].decode())
+        table = scope["path"].rsplit("/", 1)[-1]
+
+        if scope["path"].startswith("/rest/v1/rpc/"):
+            payload = json.dumps(stub_rpc(table, json.loads(body or b"{}"))).encode()
+        elif method == "GET" and table == "referrals":
+            referrer_id = params.get("referrer_id", ["eq."])[0][3:]
+            offset = int(params.get("offset", ["0"])[0])
+            limit = int(params.get("limit", ["100"])[0])
+            referrals = make_user_row(referrer_id)["referrals"][offset:offset + limit]
+            rows = [{"referred_id": r, "created_at": "2026-01-01T00:00:00+00:00"} for r in referrals]
+            payload = json.dumps(rows).encode()
+        elif method == "GET" and table == "users":
+            user_filter = params.get("user_id", [""])[0]
+            if user_filter.startswith("eq."):
+                rows = [make_user_row(user_filter[3:])]
+            elif user_filter.startswith("gt."):
+                # Постраничный обход по user_id (строковое сравнение, как в базе)
+                limit = int(params.get("limit", ["100"])[0])
+                user_ids = sorted(uid for uid in map(str, range(total_users)) if uid > user_filter[3:])
+                rows = [make_user_row(uid) for uid in user_ids[:limit]]
+            else:
+                offset = int(params.get("offset", ["0"])[0])
+                limit = int(params.get("limit", ["100"])[0])
+                rows = [make_user_row(str(i)) for i in range(offset, min(offset + limit, total_users))]
+            # Отдаем только запрошенные колонки, как PostgREST
+            select = params.get("select", ["*"])[0]
+            if select != "*":
+                columns = [column.strip() for column in select.split(",")]
+                rows = [{column: row.get(column) for column in columns} for row in rows]
+            payload = json.dumps(rows).encode()
+        elif method in ("POST", "PATCH"):
+            data = json.loads(body or b"[]")
+            payload = json.dumps(data if isinstance(data, list) else [data]).encode()
+        else:
+            payload = b"[]"
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json")],
+        })
+        await send({"type": "http.response.body", "body": payload})
+
+    return app
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def run_load(url: str, concurrency: int, total: int, users: int) -> None:
+    latencies: Dict[str, List[float]] = {"GET /user": [], "POST /user": [], "GET /top": []}
+    errors = 0
+    counter = iter(range(total))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+
+        async def worker():
+            nonlocal errors
+            for _ in counter:
+                user_id = str(random.randint(1, users))
+                roll = random.random()
+                started = time.perf_counter()
+                try:
+                    if roll < 0.6:
+                        name = "POST /user"
+                        row = make_user_row(user_id)
+                        row["id"] = row.pop("user_id")
+                        response = await client.post("/user", json=row)
+                    elif roll < 0.9:
+                        name = "GET /user"
+                        response = await client.get(f"/user/{user_id}")
+                    else:
+                        name = "GET /top"
+                        response = await client.get("/top")
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies[name].append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    all_latencies = [value for values in latencies.values() for value in values]
+    print(f"requests: {total}, concurrency: {concurrency}, errors: {errors}")
+    print(f"throughput: {total / elapsed:.1f} req/s")
+    print(f"{'endpoint':<12} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, values in list(latencies.items()) + [("all", all_latencies)]:
+        if not values:
+            continue
+        print(
+            f"{name:<12} {len(values):>6} {statistics.median(values):>9.1f} "
+            f"{percentile(values, 95):>9.1f} {percentile(values, 99):>9.1f} {max(values):>9.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    stub = subparsers.add_parser("stub", help="запустить заглушку Supabase")
+    stub.add_argument("--port", type=int, default=54321)
+    stub.add_argument("--latency", type=float, default=0.05, help="задержка ответа базы, сек")
+    stub.add_argument("--jitter", type=float, default=0.01, help="случайная добавка к задержке, сек")
+    stub.add_argument("--users", type=int, default=1000, help="число строк в таблице users")
+
+    run = subparsers.add_parser("run", help="запустить нагрузку на сервер")
+    run.add_argument("--url", default="http://127.0.0.1:8000")
+    run.add_argument("--concurrency", type=int, default=100)
+    run.add_argument("--requests", type=int, default=2000)
+    run.add_argument("--users", type=int, default=1000, help="число различных user_id")
+
+    args = parser.parse_args()
+    if args.command == "stub":
+        uvicorn.run(make_stub_app(args.latency, args.jitter, args.users), host="127.0.0.1", port=args.port, log_level="warning")
+    else:
+        asyncio.run(run_load(args.url, args.concurrency, args.requests, args.users))
+
+
+if __name__ == "__main__":
+    main()
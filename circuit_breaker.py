@@ -0,0 +1,143 @@
+"""Защита хранилища от лавины запросов во время сбоя.
+
+``CircuitBreaker`` следит за долей неудачных запросов в скользящем окне и при
+превышении порога "размыкает цепь": запросы сразу получают
+``CircuitOpenError``, не дожидаясь таймаутов и не нагружая базу. Через
+``recovery_timeout`` секунд цепь переходит в полуоткрытое состояние и
+пропускает несколько пробных запросов; если они успешны, цепь замыкается.
+
+``RetryBudget`` - общий на весь процесс бюджет повторов (token bucket):
+каждый запрос добавляет ``ratio`` токена, каждый повтор тратит один. Пока
+база отвечает, повторы почти не ограничены; при массовых ошибках их доля
+не превышает ``ratio`` от числа запросов, и повторы не умножают нагрузку.
+"""
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Цепь разомкнута: хранилище считается недоступным"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Storage circuit is open, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Размыкатель цепи с полуоткрытым состоянием для пробных запросов"""
+
+    def __init__(self, failure_ratio: float = 0.5, window: int = 20, min_calls: int = 10,
+                 recovery_timeout: float = 10.0, half_open_max_calls: int = 1,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_ratio = failure_ratio
+        self.min_calls = min_calls
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+
+        # Исходы последних запросов: True - ошибка
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probes_started_at = 0.0
+
+        self.stats = {"rejected": 0, "opened": 0, "closed": 0}
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+            self._probes = 0
+            self._probes_started_at = self._clock()
+        return self._state
+
+    def before_call(self) -> None:
+        """Пропускает запрос или бросает CircuitOpenError"""
+        state = self.state
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN:
+            # Пробный запрос мог быть отменен и не сообщить результат: не ждем его вечно
+            if self._clock() - self._probes_started_at >= self.recovery_timeout:
+                self._probes = 0
+                self._probes_started_at = self._clock()
+            if self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return
+        self.stats["rejected"] += 1
+        retry_after = max(self.recovery_timeout - (self._clock() - self._opened_at), 0.0)
+        raise CircuitOpenError(retry_after)
+
+    def record_success(self) -> None:
+        if self._state == HALF_OPEN:
+            self._close()
+            return
+        self._outcomes.append(False)
+
+    def record_failure(self) -> None:
+        if self._state == HALF_OPEN:
+            # Пробный запрос не прошел: снова ждем recovery_timeout
+            self._open()
+            return
+        if self._state == OPEN:
+            return
+        self._outcomes.append(True)
+        if len(self._outcomes) >= self.min_calls and sum(self._outcomes) / len(self._outcomes) >= self.failure_ratio:
+            self._open()
+
+    def _open(self) -> None:
+        self._state = OPEN
+        self._opened_at = self._clock()
+        self._outcomes.clear()
+        self.stats["opened"] += 1
+
+    def _close(self) -> None:
+        self._state = CLOSED
+        self._outcomes.clear()
+        self.stats["closed"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "recent_failures": sum(self._outcomes), "recent_calls": len(self._outcomes), **self.stats}
+
+
+class RetryBudget:
+    """Общий бюджет повторов: не больше ratio повторов на запрос плюс min_per_second"""
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0, capacity: float = 10.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated_at = clock()
+
+        self.stats = {"retries": 0, "exhausted": 0}
+
+    def _refill(self, amount: float = 0.0) -> None:
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + amount + (now - self._updated_at) * self.min_per_second)
+        self._updated_at = now
+
+    def record_request(self) -> None:
+        self._refill(self.ratio)
+
+    def try_spend(self) -> bool:
+        """Забирает токен на повтор; False, если бюджет исчерпан"""
+        self._refill()
+        if self._tokens < 1:
+            self.stats["exhausted"] += 1
+            return False
+        self._tokens -= 1
+        self.stats["retries"] += 1
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        self._refill()
+        return {"tokens": round(self._tokens, 2), "capacity": self.capacity, **self.stats}
@@ -0,0 +1,160 @@
+"""Сжатие ответов по Accept-Encoding.
+
+Неизменные тела (HTML-оболочка, собранные CSS/JS, /config, снимок /top)
+сжимаются один раз - при старте или при смене содержимого - в brotli и gzip,
+а запрос только выбирает готовый вариант. Такой ответ всегда несет
+``Vary: Accept-Encoding``, а у каждого варианта свой ETag, чтобы кэши не
+подменяли одно тело другим.
+Динамический JSON крупнее порога сжимает на лету ``GZipMiddleware``; ответы,
+кодировка которых уже выбрана (с ``Vary: Accept-Encoding``), он пропускает как есть.
+
+brotli - необязательная зависимость: без нее отдается только gzip.
+"""
+import gzip
+from contextvars import ContextVar
+from typing import Dict, Mapping, Optional, Sequence, Tuple
+
+from fastapi.responses import Response
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware as StarletteGZipMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Меньше этого размера сжатие не окупается (заголовки и CPU дороже экономии);
+# тот же порог используется для сжатия на лету
+MIN_COMPRESS_SIZE = 512
+
+# Порядок предпочтения при равном q в Accept-Encoding
+PREFERRED_ENCODINGS = ("br", "gzip")
+
+
+def parse_accept_header(header: Optional[str]) -> Dict[str, float]:
+    """Значения Accept или Accept-Encoding с их весами q"""
+    weights: Dict[str, float] = {}
+    for item in (header or "").split(","):
+        encoding, _, params = item.strip().partition(";")
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[encoding] = weight
+    return weights
+
+
+def choose_encoding(header: Optional[str], available: Sequence[str]) -> Optional[str]:
+    """Лучшая из доступных кодировок, которую принимает клиент (None - без сжатия)"""
+    weights = parse_accept_header(header)
+    best, best_weight = None, 0.0
+    for encoding in available:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    """ETag варианта тела: "<хэш>-br", "<хэш>-gzip"; у несжатого - исходный"""
+    if encoding is None or not etag.endswith('"'):
+        return etag
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Слабое сравнение If-None-Match с ETag ответа"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag.removeprefix("W/") for tag in candidates)
+
+
+class CompressedBody:
+    """Тело ответа с заранее сжатыми вариантами"""
+
+    __slots__ = ("body", "variants")
+
+    def __init__(self, body: bytes, brotli_quality: int = 11, gzip_level: int = 9):
+        self.body = body
+        self.variants: Dict[str, bytes] = {}
+        if len(body) < MIN_COMPRESS_SIZE:
+            return
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=brotli_quality)
+        self.variants["gzip"] = gzip.compress(body, compresslevel=gzip_level, mtime=0)
+        # Вариант, который не меньше исходного тела, не нужен
+        for encoding, variant in list(self.variants.items()):
+            if len(variant) >= len(body):
+                del self.variants[encoding]
+
+    def select(self, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+        """Тело и кодировка для клиента с данным Accept-Encoding"""
+        encoding = choose_encoding(accept_encoding, [e for e in PREFERRED_ENCODINGS if e in self.variants])
+        if encoding is None:
+            return self.body, None
+        return self.variants[encoding], encoding
+
+    def response(self, accept_encoding: Optional[str], media_type: str,
+                 headers: Optional[Mapping[str, str]] = None, status_code: int = 200,
+                 if_none_match: Optional[str] = None) -> Response:
+        """Ответ с вариантом для клиента; 304, если If-None-Match совпал с ETag варианта"""
+        content, encoding = self.select(accept_encoding)
+        headers = dict(headers or {})
+        # Выбор варианта зависит от Accept-Encoding, даже если отдается несжатое тело
+        headers["Vary"] = "Accept-Encoding"
+        if "ETag" in headers:
+            headers["ETag"] = encoded_etag(headers["ETag"], encoding)
+            if etag_matches(if_none_match, headers["ETag"]):
+                return Response(status_code=304, headers=headers)
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+        return Response(content=content, status_code=status_code, media_type=media_type, headers=headers)
+
+
+# Исходный send запроса: через него GZipMiddleware отправляет ответы, минуя сжатие
+_passthrough_send: ContextVar[Send] = ContextVar("passthrough_send")
+
+
+class GZipMiddleware(StarletteGZipMiddleware):
+    """GZipMiddleware, который не трогает ответы с уже выбранной кодировкой.
+
+    Ответ ``CompressedBody`` несет ``Vary: Accept-Encoding`` и ETag своего
+    варианта; повторное сжатие несжатого варианта отдало бы с этим ETag другое
+    тело, а к Vary добавилось бы второе Accept-Encoding.
+    """
+
+    def __init__(self, app: ASGIApp, *args, **kwargs):
+        super().__init__(self._route, *args, **kwargs)
+        self._app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self._app(scope, receive, send)
+            return
+        token = _passthrough_send.set(send)
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            _passthrough_send.reset(token)
+
+    async def _route(self, scope: Scope, receive: Receive, send: Send) -> None:
+        passthrough_send = _passthrough_send.get()
+        negotiated = False
+
+        async def route(message: Message) -> None:
+            nonlocal negotiated
+            if message["type"] == "http.response.start":
+                vary = Headers(raw=message["headers"]).get("vary", "")
+                negotiated = "accept-encoding" in vary.lower()
+            await (passthrough_send if negotiated else send)(message)
+
+        await self._app(scope, receive, route)
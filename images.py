@@ -0,0 +1,58 @@
+"""Миниатюры из static/thumbs (см. tools/build_thumbnails.py) с выбором формата по Accept.
+
+Каждая картинка в манифесте есть в нескольких форматах; клиенту отдается
+первый из ``PREFERRED_FORMATS``, который он явно перечислил в Accept
+(AVIF, затем WebP), иначе - запасной PNG. Подстановочные ``image/*`` и
+``*/*`` новые форматы не выбирают: их шлют и браузеры, которые AVIF не
+умеют. Без манифеста модуль ничего не отдает, и клиент показывает исходные
+картинки.
+"""
+import json
+import logging
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from compression import parse_accept_header
+
+logger = logging.getLogger(__name__)
+
+PREFERRED_FORMATS = ("image/avif", "image/webp")
+FALLBACK_FORMAT = "image/png"
+
+
+class ThumbnailManifest:
+    """Варианты миниатюр по имени и описание спрайтов для клиента"""
+
+    def __init__(self, static_dir: Path):
+        self.static_dir = static_dir
+        self.version = ""
+        self.sprites: Dict[str, Dict[str, Any]] = {}
+        self.images: Dict[str, Dict[str, str]] = {}
+
+        path = static_dir / "thumbs" / "manifest.json"
+        if not path.exists():
+            logger.warning(f"Thumbnail manifest not found at {path}, serving original images")
+            return
+        manifest = json.loads(path.read_text())
+        self.version = manifest["version"]
+        self.sprites = manifest["sprites"]
+        self.images = manifest["images"]
+        logger.info(f"Loaded {len(self.images)} thumbnails (version {self.version})")
+
+    def sprite_config(self, name: str) -> Optional[Dict[str, Any]]:
+        """Спрайт для /config: порядок плиток, размеры и версия для URL"""
+        sprite = self.sprites.get(name)
+        if sprite is None:
+            return None
+        return {**sprite, "url": f"/img/{name}-{{size}}?v={self.version}"}
+
+    def select(self, name: str, accept: Optional[str]) -> Optional[Path]:
+        """Файл лучшего формата, который принимает клиент; None - нет такой картинки"""
+        variants = self.images.get(name)
+        if variants is None:
+            return None
+        weights = parse_accept_header(accept)
+        for media_type in PREFERRED_FORMATS:
+            if weights.get(media_type, 0) > 0 and media_type in variants:
+                return self.static_dir / variants[media_type]
+        return self.static_dir / variants[FALLBACK_FORMAT]
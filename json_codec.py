@@ -0,0 +1,86 @@
+"""Быстрая сериализация JSON для ответов и сообщений WebSocket.
+
+``JSONResponse`` из Starlette кодирует через ``json.dumps`` и затем еще раз
+через ``str.encode``. ``orjson`` сразу пишет UTF-8 байты и на ответах
+приложения (/user, /top, подтверждения по WebSocket) в 2-6 раз быстрее;
+замеры - benchmarks/json_encoding.py.
+
+Для ответов постоянной формы (пользователь, строка рейтинга) ``RecordEncoder``
+один раз компилирует функцию с литералом словаря: ключи - константы, значения
+читаются прямо из атрибутов или ключей записи. На строке топа это вдвое
+быстрее ``dict(zip(keys, getter(record)))``.
+
+orjson - необязательная зависимость: без него используется ``json`` с теми же
+настройками, что и в ``JSONResponse`` (компактно, без \\u-экранирования).
+"""
+import json
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    # Нестроковые ключи (например, числовые id) json.dumps приводит к строкам - orjson так же
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(value: Any) -> bytes:
+        """Компактный JSON в UTF-8"""
+        return orjson.dumps(value, option=_ORJSON_OPTIONS)
+
+    loads = orjson.loads
+else:
+    _encoder = json.JSONEncoder(ensure_ascii=False, allow_nan=False, separators=(",", ":"))
+
+    def dumps(value: Any) -> bytes:
+        """Компактный JSON в UTF-8"""
+        return _encoder.encode(value).encode("utf-8")
+
+    loads = json.loads
+
+
+def dumps_text(value: Any) -> str:
+    """JSON строкой - для текстовых сообщений WebSocket"""
+    return dumps(value).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse, который кодирует через orjson (если он установлен)"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class RecordEncoder:
+    """Ответ постоянной формы: функция сборки словаря компилируется один раз"""
+
+    __slots__ = ("keys", "to_dict", "to_list")
+
+    def __init__(self, fields: Sequence[Tuple[str, str]], items: bool = False):
+        # fields - (ключ в JSON, атрибут источника или ключ словаря при items=True)
+        self.keys = tuple(key for key, _ in fields)
+        values = []
+        for _, source in fields:
+            if items:
+                values.append(f"record[{source!r}]")
+            elif source.isidentifier():
+                values.append(f"record.{source}")
+            else:
+                raise ValueError(f"Invalid attribute name: {source!r}")
+
+        # Литерал словаря с постоянными ключами, как в collections.namedtuple
+        display = "{" + ", ".join(f"{key!r}: {value}" for key, value in zip(self.keys, values)) + "}"
+        namespace: Dict[str, Any] = {}
+        exec(
+            f"def to_dict(record):\n    return {display}\n\n"
+            f"def to_list(records):\n    return [{display} for record in records]\n",
+            namespace,
+        )
+        self.to_dict: Callable[[Any], Dict[str, Any]] = namespace["to_dict"]
+        self.to_list: Callable[[Iterable[Any]], List[Dict[str, Any]]] = namespace["to_list"]
+
+    def encode(self, record: Any) -> bytes:
+        return dumps(self.to_dict(record))
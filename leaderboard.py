@@ -0,0 +1,201 @@
+"""Рейтинг игроков в памяти процесса.
+
+Игроки упорядочены по убыванию очков в индексируемом списке с пропусками
+(skip list с ширинами ссылок): вставка, удаление, поиск места игрока и
+выборка по номеру места выполняются за O(log n). Топ отдается из памяти
+без запросов к базе; при старте индекс заполняется из таблицы ``users``.
+"""
+import random
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Поля профиля, которые нужны для отображения рейтинга
+PROFILE_FIELDS = ("first_name", "last_name", "username", "photo_url", "level")
+
+# Число уровней списка с пропусками (эффективно до ~16 млн записей)
+MAX_LEVELS = 24
+
+RankKey = Tuple[int, str]
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key: Optional[RankKey], levels: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * levels
+        self.width: List[int] = [1] * levels
+
+
+class RankedIndex:
+    """Индексируемый список с пропусками: упорядоченное множество с доступом по номеру"""
+
+    def __init__(self):
+        self._head = _Node(None, MAX_LEVELS)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @staticmethod
+    def _random_levels() -> int:
+        levels = 1
+        while levels < MAX_LEVELS and random.random() < 0.5:
+            levels += 1
+        return levels
+
+    def insert(self, key: RankKey) -> None:
+        chain: List[_Node] = [self._head] * MAX_LEVELS
+        steps_at_level = [0] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = self._random_levels()
+        new_node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            prev_node = chain[level]
+            new_node.next[level] = prev_node.next[level]
+            prev_node.next[level] = new_node
+            new_node.width[level] = prev_node.width[level] - steps
+            prev_node.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, MAX_LEVELS):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key: RankKey) -> None:
+        chain: List[_Node] = [self._head] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+
+        for level in range(len(target.next)):
+            prev_node = chain[level]
+            prev_node.width[level] += target.width[level] - 1
+            prev_node.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def index_of(self, key: RankKey) -> int:
+        """Номер ключа в порядке сортировки (с нуля)"""
+        node = self._head
+        position = 0
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        target = node.next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        return position
+
+    def slice(self, start: int, stop: int) -> Iterator[RankKey]:
+        """Ключи с номерами [start, stop)"""
+        start = max(start, 0)
+        stop = min(stop, self._size)
+        if start >= stop:
+            return
+
+        node = self._head
+        remaining = start + 1
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+
+        for _ in range(stop - start):
+            yield node.key
+            node = node.next[0]
+
+
+class Leaderboard:
+    """Рейтинг игроков по очкам с профилями для отображения"""
+
+    def __init__(self):
+        self._index = RankedIndex()
+        self._scores: Dict[str, int] = {}
+        self._profiles: Dict[str, Dict[str, Any]] = {}
+        # Увеличивается при каждом изменении рейтинга
+        self.version = 0
+        # True, когда индекс полностью заполнен из базы
+        self.ready = False
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def update(self, user_id: str, fields: Dict[str, Any]) -> bool:
+        """Применяет изменения очков и профиля игрока; возвращает True, если рейтинг изменился"""
+        user_id = str(user_id)
+        changed = False
+
+        if "score" in fields:
+            score = int(fields["score"] or 0)
+            old_score = self._scores.get(user_id)
+            if old_score != score:
+                if old_score is not None:
+                    self._index.remove((-old_score, user_id))
+                self._index.insert((-score, user_id))
+                self._scores[user_id] = score
+                changed = True
+
+        if user_id in self._scores:
+            profile = self._profiles.setdefault(user_id, {})
+            for field in PROFILE_FIELDS:
+                if field in fields and profile.get(field) != fields[field]:
+                    profile[field] = fields[field]
+                    changed = True
+
+        if changed:
+            self.version += 1
+        return changed
+
+    def load(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """Заполняет индекс строками из базы, не затирая более свежие изменения"""
+        for row in rows:
+            user_id = str(row["user_id"])
+            if user_id not in self._scores:
+                self.update(user_id, row)
+
+    def _row(self, user_id: str) -> Dict[str, Any]:
+        profile = self._profiles.get(user_id, {})
+        row = {"user_id": user_id}
+        for field in PROFILE_FIELDS:
+            row[field] = profile.get(field, "")
+        row["score"] = self._scores[user_id]
+        return row
+
+    def top(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Первые ``limit`` игроков в формате строк таблицы users"""
+        return [self._row(user_id) for _, user_id in self._index.slice(0, limit)]
+
+    def get_score(self, user_id: str) -> Optional[int]:
+        return self._scores.get(str(user_id))
+
+    def rank(self, user_id: str) -> Optional[int]:
+        """Место игрока в рейтинге (с единицы) или None, если игрока нет"""
+        score = self._scores.get(str(user_id))
+        if score is None:
+            return None
+        return self._index.index_of((-score, str(user_id))) + 1
+
+    def around(self, user_id: str, radius: int) -> List[Dict[str, Any]]:
+        """Игрок и до ``radius`` соседей выше и ниже него, с номерами мест"""
+        rank = self.rank(user_id)
+        if rank is None:
+            return []
+        start = max(rank - 1 - radius, 0)
+        return [
+            {**self._row(neighbour_id), "rank": start + offset + 1}
+            for offset, (_, neighbour_id) in enumerate(self._index.slice(start, rank + radius))
+        ]
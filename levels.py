@@ -0,0 +1,34 @@
+"""Таблица уровней: пороги очков в отсортированном массиве.
+
+Уровень - это индекс в таблице (0 - первый уровень), а не локализованное
+название: в базе хранится маленькое целое, названия на нужном языке
+подставляет клиент из ``/config``. Индекс ищется двоичным поиском по
+порогам, а ``bounds`` возвращает диапазон очков текущего уровня, чтобы
+вызывающий код пересчитывал уровень только при выходе за этот диапазон.
+"""
+from bisect import bisect_right
+from typing import Any, Dict, List, Mapping, Sequence, Tuple
+
+
+class LevelTable:
+    """Пороги уровней и их названия"""
+
+    def __init__(self, levels: Sequence[Mapping[str, Any]]):
+        levels = sorted(levels, key=lambda level: level["score"])
+        self.thresholds: List[int] = [level["score"] for level in levels]
+        self.names: List[str] = [level["name"] for level in levels]
+        self.names_en: List[str] = [level.get("name_en", level["name"]) for level in levels]
+
+    def index(self, score: int) -> int:
+        """Индекс уровня для очков (очки ниже первого порога - первый уровень)"""
+        return max(bisect_right(self.thresholds, score) - 1, 0)
+
+    def bounds(self, index: int) -> Tuple[float, float]:
+        """Диапазон очков уровня [floor, ceiling); у крайних уровней граница бесконечна"""
+        floor = self.thresholds[index] if index > 0 else float("-inf")
+        ceiling = self.thresholds[index + 1] if index + 1 < len(self.thresholds) else float("inf")
+        return floor, ceiling
+
+    def to_config(self) -> Dict[str, List[Any]]:
+        """Таблица для клиента"""
+        return {"thresholds": self.thresholds, "names": self.names, "names_en": self.names_en}
@@ -1,19 +1,40 @@
 from pathlib import Path
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse, Response
-from fastapi.staticfiles import StaticFiles
-from typing import Dict, Any, List, Optional
-import json
+from fastapi import FastAPI, Request, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, HTMLResponse, Response
+from typing import Dict, Any, List, Optional, Sequence, Union
+import asyncio
+import hashlib
 import os
 import time
-from datetime import datetime, timedelta, timezone
-import requests
+from datetime import timedelta
 import uvicorn
-from supabase import create_client, Client
 from dotenv import load_dotenv
 import logging
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from tenacity import AsyncRetrying, RetryCallState, stop_after_attempt, wait_exponential_jitter
 import re
+from storage import chunk_rows
+from stores import (
+    LEADERBOARD_COLUMNS,
+    PROFILE_COLUMNS,
+    REFERRAL_COUNT_COLUMNS,
+    SESSION_COLUMNS,
+    DataError,
+    UserStore,
+    create_store,
+)
+from write_buffer import WriteBehindBuffer, WriteBufferFull
+from user_cache import UserCache
+from realtime import ConnectionManager
+from leaderboard import Leaderboard
+from user_state import UserState
+from upgrades import UpgradeTable
+from levels import LevelTable
+from single_flight import SingleFlight, KeyedLocks
+from circuit_breaker import CircuitBreaker, CircuitOpenError, RetryBudget
+from assets import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL, AssetStaticFiles, StaticFileCache, build_assets
+from images import ThumbnailManifest
+from compression import MIN_COMPRESS_SIZE, CompressedBody, GZipMiddleware
+from json_codec import FastJSONResponse, RecordEncoder, dumps, dumps_text, loads
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -22,7 +43,12 @@ logger = logging.getLogger(__name__)
 # Загрузка переменных окружения
 load_dotenv()
 
-app = FastAPI()
+# Ответы-словари без явного класса ответа тоже кодируются через orjson
+app = FastAPI(default_response_class=FastJSONResponse)
+
+# JSON крупнее порога сжимается на лету; заранее сжатые ответы (CompressedBody) проходят как есть
+JSON_COMPRESS_MIN_SIZE = int(os.getenv("JSON_COMPRESS_MIN_SIZE", str(MIN_COMPRESS_SIZE)))
+app.add_middleware(GZipMiddleware, minimum_size=JSON_COMPRESS_MIN_SIZE, compresslevel=6)
 
 # Определяем базовую директорию
 BASE_DIR = Path(__file__).resolve().parent
@@ -33,31 +59,20 @@ if not STATIC_DIR.exists():
     STATIC_DIR.mkdir(parents=True, exist_ok=True)
     logger.info(f"Created static directory at {STATIC_DIR}")
 
-# Проверка наличия необходимых переменных окружения
-supabase_url = os.environ.get("SUPABASE_URL")
-supabase_key = os.environ.get("SUPABASE_KEY")
-
-if not supabase_url or not supabase_key:
-    logger.error("Supabase URL and key must be set in environment variables")
-    # В случае отсутствия переменных окружения, используем тестовые значения (только для разработки)
-    supabase_url = "https://your-supabase-url.supabase.co"
-    supabase_key = "your-supabase-key"
-    logger.warning("Using default Supabase values. This should only happen in development!")
-
 # Определение уровней
 LEVELS = [
-    {"score": 0, "name": "Новичок"},
-    {"score": 100, "name": "Любитель"},
-    {"score": 500, "name": "Профи"},
-    {"score": 2000, "name": "Мастер"},
-    {"score": 5000, "name": "Эксперт по Фембоям"},
-    {"score": 10000, "name": "Фембой"},
-    {"score": 50000, "name": "Фурри-Фембой"},
-    {"score": 200000, "name": "Феликс"},
-    {"score": 500000, "name": "Астольфо"},
-    {"score": 1000000, "name": "Владелец фембоев"},
-    {"score": 5000000, "name": "Император фембоев"},
-    {"score": 10000000, "name": "Бог фембоев"}
+    {"score": 0, "name": "Новичок", "name_en": "Newbie"},
+    {"score": 100, "name": "Любитель", "name_en": "Amateur"},
+    {"score": 500, "name": "Профи", "name_en": "Pro"},
+    {"score": 2000, "name": "Мастер", "name_en": "Master"},
+    {"score": 5000, "name": "Эксперт по Фембоям", "name_en": "Femboy Expert"},
+    {"score": 10000, "name": "Фембой", "name_en": "Femboy"},
+    {"score": 50000, "name": "Фурри-Фембой", "name_en": "Furry Femboy"},
+    {"score": 200000, "name": "Феликс", "name_en": "Felix"},
+    {"score": 500000, "name": "Астольфо", "name_en": "Astolfo"},
+    {"score": 1000000, "name": "Владелец фембоев", "name_en": "Femboy Owner"},
+    {"score": 5000000, "name": "Император фембоев", "name_en": "Emperor of Femboys"},
+    {"score": 10000000, "name": "Бог фембоев", "name_en": "God of Femboys"}
 ]
 
 # Определение улучшений (сбалансированная стоимость)
@@ -162,218 +177,339 @@ DAILY_BONUSES = [
     {"day": 7, "reward": 1000}
 ]
 
-# Функция для определения уровня по очкам
-def get_level_by_score(score: int) -> str:
-    for i in range(len(LEVELS) - 1, -1, -1):
-        if score >= LEVELS[i]["score"]:
-            return LEVELS[i]["name"]
-    return LEVELS[0]["name"]
+# Пороги уровней для двоичного поиска; уровень игрока - индекс в этой таблице
+LEVEL_TABLE = LevelTable(LEVELS)
 
-# Инициализация Supabase клиента (один раз для всего приложения)
+# Каталог улучшений, скомпилированный при старте: id -> бит маски, суммы эффектов по маскам
+UPGRADE_TABLE = UpgradeTable(UPGRADES)
+
+# Инициализация хранилища (один раз для всего приложения): Supabase, SQLite или память,
+# см. STORAGE_BACKEND в stores/__init__.py
 try:
-    supabase: Client = create_client(supabase_url, supabase_key)
-    logger.info("Supabase client initialized successfully")
+    store: UserStore = create_store()
+    logger.info(f"Storage backend initialized: {store.name}")
 except Exception as e:
-    logger.error(f"Failed to initialize Supabase client: {str(e)}")
+    logger.error(f"Failed to initialize storage backend: {str(e)}")
     # Не прерываем работу приложения, а просто логируем ошибку
-    # Это позволит приложению работать, даже если Supabase недоступен
-    supabase = None
+    # Это позволит приложению работать, даже если хранилище недоступно
+    store = None
 
 # Максимальное количество энергии
 MAX_ENERGY = 250
 
-# Декоратор для повторных попыток при ошибках соединения
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_exponential(multiplier=1, min=1, max=10),
-    retry=retry_if_exception_type(Exception)
+# Правила, по которым UserState считает энергию, уровень и эффекты улучшений
+UserState.configure(
+    max_energy=MAX_ENERGY,
+    level_table=LEVEL_TABLE,
+    upgrade_table=UPGRADE_TABLE,
+)
+
+# Ошибка в самих данных запроса: повтор не поможет
+def is_data_error(error: Exception) -> bool:
+    return isinstance(error, DataError)
+
+# Размыкатель цепи: при сбое хранилища запросы сразу получают ошибку вместо таймаутов
+storage_breaker = CircuitBreaker(
+    failure_ratio=float(os.environ.get("STORAGE_BREAKER_FAILURE_RATIO", 0.5)),
+    window=int(os.environ.get("STORAGE_BREAKER_WINDOW", 20)),
+    min_calls=int(os.environ.get("STORAGE_BREAKER_MIN_CALLS", 10)),
+    recovery_timeout=float(os.environ.get("STORAGE_BREAKER_RECOVERY_SECONDS", 10)),
 )
-def execute_supabase_query(func):
-    """Выполняет запрос к Supabase с повторными попытками при ошибках"""
-    if supabase is None:
-        logger.error("Supabase client is not initialized")
-        raise Exception("Supabase client is not initialized")
+
+# Общий бюджет повторов: при массовых ошибках повторы не умножают нагрузку на базу
+retry_budget = RetryBudget(
+    ratio=float(os.environ.get("STORAGE_RETRY_BUDGET_RATIO", 0.1)),
+    min_per_second=float(os.environ.get("STORAGE_RETRY_BUDGET_MIN_PER_SECOND", 1)),
+)
+STORAGE_RETRY_ATTEMPTS = int(os.environ.get("STORAGE_RETRY_ATTEMPTS", 3))
+# Дольше этого Retry-After из ответа хранилища запрос не ждет, а сразу возвращает ошибку
+STORAGE_RETRY_AFTER_MAX = float(os.environ.get("STORAGE_RETRY_AFTER_MAX_SECONDS", 5))
+storage_backoff = wait_exponential_jitter(initial=0.1, max=1)
+
+# Повторяем только временные ошибки и только пока есть бюджет.
+# Токен берется, только если повтор действительно будет: последняя попытка
+# и запросы без повторов (неидемпотентные) бюджет не тратят
+def should_retry(retry_state: RetryCallState, max_attempts: int) -> bool:
+    error = retry_state.outcome.exception()
+    if error is None or is_data_error(error) or isinstance(error, CircuitOpenError):
+        return False
+    if retry_state.attempt_number >= max_attempts:
+        return False
+    if (getattr(error, "retry_after", None) or 0) > STORAGE_RETRY_AFTER_MAX:
+        return False
+    return retry_budget.try_spend()
+
+# Пауза перед повтором: Retry-After из ответа хранилища (408, 429, 503), иначе экспоненциальная с джиттером
+def storage_retry_wait(retry_state: RetryCallState) -> float:
+    retry_after = getattr(retry_state.outcome.exception(), "retry_after", None)
+    if retry_after is not None:
+        return retry_after
+    return storage_backoff(retry_state)
+
+async def execute_storage_query(func, idempotent: bool = True):
+    """Выполняет запрос к хранилищу через размыкатель цепи; идемпотентные запросы повторяются при временных ошибках"""
+    if store is None:
+        logger.error("Storage is not initialized")
+        raise Exception("Storage is not initialized")
+    
+    retry_budget.record_request()
+    max_attempts = STORAGE_RETRY_ATTEMPTS if idempotent else 1
+    
+    async for attempt in AsyncRetrying(
+        stop=stop_after_attempt(max_attempts),
+        wait=storage_retry_wait,
+        retry=lambda retry_state: should_retry(retry_state, max_attempts),
+        reraise=True,
+    ):
+        with attempt:
+            storage_breaker.before_call()
+            try:
+                result = await func()
+            except Exception as e:
+                if is_data_error(e):
+                    # База ответила, значит она доступна
+                    storage_breaker.record_success()
+                    logger.warning(f"Storage query rejected: {str(e)}")
+                else:
+                    storage_breaker.record_failure()
+                    logger.warning(f"Storage query failed: {str(e)}")
+                raise
+            storage_breaker.record_success()
+            return result
+
+# Ответ при разомкнутой цепи или заполненном буфере записи: клиент может повторить запрос после Retry-After
+def storage_unavailable_response(error: Union[CircuitOpenError, WriteBufferFull]) -> FastJSONResponse:
+    return FastJSONResponse(
+        content={"status": "error", "message": "Storage is temporarily unavailable"},
+        status_code=503,
+        headers={"Retry-After": str(int(error.retry_after) + 1)}
+    )
+
+# Отказы игровых действий по правилам игры (ответ 400, а не 500)
+GAME_ACTION_REFUSALS = {
+    "Unknown achievement", "Achievement conditions not met",
+    "Unknown task", "Task conditions not met",
+    "Unknown upgrade", "Upgrade already purchased", "Not enough coins",
+}
+
+# Код ответа для результата игрового действия (достижение, задание, покупка)
+def game_action_status(result: Dict[str, Any]) -> int:
+    if result["status"] == "success":
+        return 200
+    if result["message"] == "User not found":
+        return 404
+    return 400 if result["message"] in GAME_ACTION_REFUSALS else 500
+
+# Ограничения пакетной записи пользователей: строк и байт JSON в одном запросе
+# и число одновременно отправляемых пакетов
+BULK_CHUNK_ROWS = int(os.environ.get("BULK_UPSERT_CHUNK_ROWS", 500))
+BULK_CHUNK_BYTES = int(os.environ.get("BULK_UPSERT_CHUNK_BYTES", 1_000_000))
+BULK_PARALLELISM = int(os.environ.get("BULK_UPSERT_PARALLELISM", 4))
+
+# Пакетный upsert строк users; возвращает строки, которые не удалось записать
+async def upsert_users_bulk(rows: List[Dict[str, Any]], parallelism: int = BULK_PARALLELISM) -> List[Dict[str, Any]]:
+    failures: List[Dict[str, Any]] = []
+    semaphore = asyncio.Semaphore(max(parallelism, 1))
+    
+    async def submit(chunk: List[Dict[str, Any]]) -> None:
+        async def query():
+            return await store.upsert_users(chunk)
+        
+        try:
+            async with semaphore:
+                await execute_storage_query(query)
+        except Exception as e:
+            # База отклоняет пакет целиком: делим его пополам, чтобы найти строки с ошибкой
+            if is_data_error(e) and len(chunk) > 1:
+                middle = len(chunk) // 2
+                await asyncio.gather(submit(chunk[:middle]), submit(chunk[middle:]))
+                return
+            failures.extend(
+                {"user_id": row.get("user_id"), "message": str(e), "retryable": not is_data_error(e)}
+                for row in chunk
+            )
+    
+    # Пакет содержит строки только с одним набором колонок (chunk_rows), поэтому
+    # строки с одинаковым набором идут подряд
+    rows = sorted(rows, key=lambda row: tuple(sorted(row)))
+    await asyncio.gather(*(submit(chunk) for chunk in chunk_rows(rows, BULK_CHUNK_ROWS, BULK_CHUNK_BYTES)))
+    return failures
+
+# Запись сброса буфера отложенной записи; возвращает user_id строк, которые нужно повторить
+async def upsert_users_batch(rows: List[Dict[str, Any]]) -> List[str]:
+    failures = await upsert_users_bulk(rows)
+    
+    retry_ids = []
+    for failure in failures:
+        if failure["retryable"]:
+            retry_ids.append(failure["user_id"])
+        else:
+            # Строку с ошибкой в данных не повторяем, иначе она будет отклоняться бесконечно
+            logger.error(f"Dropping buffered write for user {failure['user_id']}: {failure['message']}")
+            user_cache.invalidate(failure["user_id"])
+            
+    logger.info(f"Flushed {len(rows) - len(failures)}/{len(rows)} buffered users to DB")
+    return retry_ids
+
+# Буфер отложенной записи: сохранения после каждого клика объединяются в памяти
+# и записываются в базу пакетами раз в WRITE_BUFFER_FLUSH_MS (0 - писать сразу)
+write_buffer = WriteBehindBuffer(
+    upsert_users_batch,
+    flush_interval=int(os.environ.get("WRITE_BUFFER_FLUSH_MS", 1000)) / 1000,
+    max_batch=int(os.environ.get("WRITE_BUFFER_MAX_BATCH", 500)),
+    max_pending=int(os.environ.get("WRITE_BUFFER_MAX_PENDING", 5000)),
+)
+
+# Кэш записей пользователей (LRU + TTL); USER_CACHE_SIZE=0 отключает кэш
+user_cache = UserCache(
+    max_size=int(os.environ.get("USER_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("USER_CACHE_TTL", 300)),
+)
+
+# Одновременные загрузки одного пользователя объединяются в один запрос к базе,
+# а чтение-изменение-запись одного пользователя выполняются по очереди
+user_loads = SingleFlight()
+user_locks = KeyedLocks()
+
+# Рейтинг игроков в памяти: /top отвечает без запросов к базе
+leaderboard = Leaderboard()
+LEADERBOARD_PAGE_SIZE = 1000
+
+# Заполнение рейтинга из базы при старте (постранично, в фоне)
+async def rebuild_leaderboard() -> None:
+    if store is None:
+        logger.error("Storage is not initialized")
+        return
     
     try:
-        return func()
+        logger.info("Rebuilding leaderboard from DB")
+        last_user_id = ""
+        
+        while True:
+            async def query(last_user_id=last_user_id):
+                return await store.list_users(last_user_id, LEADERBOARD_PAGE_SIZE)
+            
+            rows = await execute_storage_query(query)
+            leaderboard.load(rows)
+            
+            if len(rows) < LEADERBOARD_PAGE_SIZE:
+                break
+            last_user_id = str(rows[-1]["user_id"])
+        
+        leaderboard.ready = True
+        logger.info(f"Leaderboard rebuilt with {len(leaderboard)} users")
     except Exception as e:
-        logger.warning(f"Supabase query failed: {str(e)}, retrying...")
-        raise
+        logger.error(f"Error rebuilding leaderboard: {e}")
+
+# Дочитывает колонки, которых нет в строке из кэша: холодные JSON-поля
+# (достижения, ежедневный бонус) читаются только там, где они нужны
+async def fetch_missing_columns(user_id: str, user_data: Dict[str, Any], columns: Sequence[str]) -> Dict[str, Any]:
+    missing = [column for column in columns if column not in user_data]
+    if not missing:
+        return user_data
+    
+    async def query():
+        return await store.get_user(user_id, ("user_id", *missing))
+    
+    row = await execute_storage_query(query)
+    if not row:
+        return user_data
+    user_cache.update(user_id, row)
+    return {**user_data, **row}
 
-# Функция для загрузки данных пользователя
-def load_user(user_id: str) -> Optional[Dict[str, Any]]:
-    if supabase is None:
-        logger.error("Supabase client is not initialized")
+# Функция для загрузки данных пользователя.
+# Игровым запросам (клики, сохранения) хватает SESSION_COLUMNS; полный профиль
+# с холодными колонками (with_profile) нужен только ответам /user
+async def load_user(user_id: str, with_profile: bool = False) -> Optional[UserState]:
+    if store is None:
+        logger.error("Storage is not initialized")
         return None
         
     try:
         logger.info(f"Loading user with ID: {user_id}")
+        columns = SESSION_COLUMNS + PROFILE_COLUMNS if with_profile else SESSION_COLUMNS
         
-        def query():
-            return supabase.table("users").select("*").eq("user_id", user_id).execute()
+        # Сначала ищем пользователя в кэше
+        user_data = user_cache.get(user_id)
         
-        response = execute_supabase_query(query)
-        
-        if response.data and len(response.data) > 0:
-            user_data = response.data[0]
-            logger.info(f"User found: {user_data.get('first_name', 'Unknown')}")
-            
-            # Убедимся, что все поля присутствуют и имеют правильный тип
-            if not isinstance(user_data.get('referrals'), list):
-                user_data['referrals'] = []
+        if user_data is not None:
+            user_data = await fetch_missing_columns(user_id, user_data, columns)
+        else:
+            async def fetch():
+                async def query():
+                    return await store.get_user(user_id, columns)
                 
-            if not isinstance(user_data.get('upgrades'), list):
-                user_data['upgrades'] = []
-            
-            # Добавляем поле для счетчика рекламы, если его нет
-            if 'ads_watched' not in user_data:
-                user_data['ads_watched'] = 0
-                logger.info("Added default ads_watched value to user data")
-            
-            # Добавляем поле для задания подписки на канал, если его нет
-            if 'channel_task_completed' not in user_data:
-                user_data['channel_task_completed'] = False
-                logger.info("Added default channel_task_completed value to user data")
-            
-            # Добавляем поля для достижений
-            if 'achievements' not in user_data:
-                user_data['achievements'] = []
-                logger.info("Added default achievements value to user data")
-            
-            # Добавляем поля для ежедневных бонусов
-            if 'daily_bonus' not in user_data:
-                user_data['daily_bonus'] = {
-                    'last_claim': None,
-                    'streak': 0,
-                    'claimed_days': []
-                }
-                logger.info("Added default daily_bonus value to user data")
-            
-            # Добавляем поля для скинов
-            if 'skins' not in user_data:
-                user_data['skins'] = []
-                logger.info("Added default skins value to user data")
-            
-            if 'active_skin' not in user_data:
-                user_data['active_skin'] = 'default'
-                logger.info("Added default active_skin value to user data")
-            
-            # Добавляем поля для автокликеров
-            if 'auto_clickers' not in user_data:
-                user_data['auto_clickers'] = 0
-                logger.info("Added default auto_clickers value to user data")
-            
-            # Добавляем поле для языка
-            if 'language' not in user_data:
-                user_data['language'] = 'ru'
-                logger.info("Added default language value to user data")
+                row = await execute_storage_query(query)
+                if row:
+                    user_cache.add(user_id, row)
+                return row
             
-            # Добавляем поле для последнего обновления пассивного дохода
-            if 'last_passive_income_update' not in user_data:
-                user_data['last_passive_income_update'] = datetime.now(timezone.utc).isoformat()
-                logger.info("Added default last_passive_income_update value to user data")
-            
-            # Добавляем поле для последнего просмотра рекламы
-            if 'last_ad_time' not in user_data:
-                user_data['last_ad_time'] = datetime.now(timezone.utc).isoformat()
-                logger.info("Added default last_ad_time value to user data")
-            
-            # Добавляем поле для активных бустов (только в памяти, не в БД)
-            if 'active_boosts' not in user_data:
-                user_data['active_boosts'] = []
-                logger.info("Added default active_boosts value to user data")
+            try:
+                # Загрузки с разными наборами колонок объединяются отдельно
+                row = await user_loads.do(f"{user_id}:profile" if with_profile else user_id, fetch)
+            except Exception as e:
+                # Хранилище недоступно: отдаем последнюю известную запись из кэша, если она есть
+                row = None if is_data_error(e) else user_cache.get_stale(user_id)
+                if row is None:
+                    raise
+                logger.warning(f"Storage unavailable ({e}), serving stale cached user {user_id}")
+            # Строка общая для всех ожидавших загрузки, поэтому работаем с копией
+            user_data = dict(row) if row else None
+        
+        # Накладываем изменения из буфера, которые еще не записаны в базу
+        pending = write_buffer.get_pending(user_id)
+        if pending:
+            user_data = {**(user_data or {}), **pending}
+        
+        if user_data:
+            logger.info(f"User found: {user_data.get('first_name', 'Unknown')}")
             
-            # Обновляем уровень на основе очков
-            user_data['level'] = get_level_by_score(user_data.get('score', 0))
+            # Недостающие поля получают значения по умолчанию, время переводится в миллисекунды
+            user = UserState.from_row(user_data)
             
-            # Восстанавливаем энергию на основе времени последнего обновления
-            last_energy_update = user_data.get('last_energy_update')
-            current_time = datetime.now(timezone.utc)
+            # Энергия и пассивный доход считаются по якорям на текущий момент
+            user.settle()
             
-            if not last_energy_update:
-                # Если время последнего обновления отсутствует, устанавливаем текущее время и максимальную энергию
-                user_data['energy'] = MAX_ENERGY
-                user_data['last_energy_update'] = current_time.isoformat()
-            else:
-                try:
-                    # Парсим дату с учетом возможного часового пояса
-                    if isinstance(last_energy_update, str):
-                        # Убираем 'Z' если есть и парсим как UTC
-                        if last_energy_update.endswith('Z'):
-                            last_update_time = datetime.fromisoformat(last_energy_update.replace('Z', '+00:00'))
-                        else:
-                            last_update_time = datetime.fromisoformat(last_energy_update)
-                    else:
-                        last_update_time = last_energy_update
-                    
-                    # Убедимся, что last_update_time имеет timezone
-                    if last_update_time.tzinfo is None:
-                        last_update_time = last_update_time.replace(tzinfo=timezone.utc)
-                    
-                    time_diff_seconds = (current_time - last_update_time).total_seconds()
-                    
-                    # Восстанавливаем энергию (1 единица в секунду)
-                    current_energy = user_data.get('energy', MAX_ENERGY)
-                    restored_energy = min(MAX_ENERGY, current_energy + int(time_diff_seconds))
-                    
-                    # Обновляем энергию и время последнего обновления
-                    user_data['energy'] = restored_energy
-                    user_data['last_energy_update'] = current_time.isoformat()
-                except Exception as e:
-                    logger.error(f"Error restoring energy: {e}")
-                    # В случае ошибки, устанавливаем энергию в максимальное значение и текущее время
-                    user_data['energy'] = MAX_ENERGY
-                    user_data['last_energy_update'] = current_time.isoformat()
-            
-            # Восстанавливаем пассивный доход за время отсутствия
-            last_passive_income_update = user_data.get('last_passive_income_update')
-            if last_passive_income_update:
-                try:
-                    # Парсим дату с учетом возможного часового пояса
-                    if isinstance(last_passive_income_update, str):
-                        # Убираем 'Z' если есть и парсим как UTC
-                        if last_passive_income_update.endswith('Z'):
-                            last_update_time = datetime.fromisoformat(last_passive_income_update.replace('Z', '+00:00'))
-                        else:
-                            last_update_time = datetime.fromisoformat(last_passive_income_update)
-                    else:
-                        last_update_time = last_passive_income_update
-                    
-                    # Убедимся, что last_update_time имеет timezone
-                    if last_update_time.tzinfo is None:
-                        last_update_time = last_update_time.replace(tzinfo=timezone.utc)
-                    
-                    time_diff_seconds = (current_time - last_update_time).total_seconds()
-                    
-                    # Пассивный доход начисляется каждые 5 секунд
-                    passive_income_periods = int(time_diff_seconds / 5)
-                    
-                    if passive_income_periods > 0:
-                        # Рассчитываем пассивный доход
-                        passive_income = 0
-                        for upgrade_id in user_data.get('upgrades', []):
-                            upgrade = next((u for u in UPGRADES if u["id"] == upgrade_id), None)
-                            if upgrade and upgrade["effect"].get("passiveIncome"):
-                                passive_income += upgrade["effect"]["passiveIncome"]
-                        
-                        # Начисляем пассивный доход
-                        total_passive_income = passive_income * passive_income_periods
-                        user_data['score'] = user_data.get('score', 0) + total_passive_income
-                        
-                        # Обновляем время последнего начисления пассивного дохода
-                        user_data['last_passive_income_update'] = current_time.isoformat()
-                        
-                        logger.info(f"Restored passive income: {total_passive_income} coins for {passive_income_periods} periods")
-                except Exception as e:
-                    logger.error(f"Error restoring passive income: {e}")
-            
-            return user_data
+            return user
         else:
             logger.info(f"User not found with ID {user_id}")
             return None
+    except CircuitOpenError:
+        # Недоступное хранилище не должно выглядеть как отсутствующий пользователь
+        raise
     except Exception as e:
         logger.error(f"Error loading user: {e}")
+        # Временный сбой тоже: GET /user ответит 500, а не 404, и клиент не создаст
+        # пустой профиль поверх существующего
+        if not is_data_error(e):
+            raise
+        return None
+
+# Чтение отдельных полей пользователя: из кэша, а при промахе - только нужные колонки.
+# Неполная строка в кэш не попадает; колонки, которых нет в записи кэша, дочитываются
+async def load_user_fields(user_id: str, columns: Sequence[str]) -> Optional[Dict[str, Any]]:
+    if store is None:
+        logger.error("Storage is not initialized")
+        return None
+    
+    user_data = user_cache.get(user_id)
+    
+    if user_data is not None:
+        user_data = await fetch_missing_columns(user_id, user_data, columns)
+    else:
+        async def query():
+            return await store.get_user(user_id, columns)
+        
+        user_data = await execute_storage_query(query)
+    
+    # Накладываем изменения из буфера, которые еще не записаны в базу
+    pending = write_buffer.get_pending(user_id)
+    if pending:
+        user_data = {**(user_data or {}), **pending}
+    
+    if not user_data:
         return None
+    return {column: user_data.get(column) for column in columns}
 
 # Функция для преобразования camelCase в snake_case
 def camel_to_snake(name):
@@ -393,82 +529,267 @@ def convert_keys_to_snake_case(data):
     else:
         return data
 
-def save_user(user_data: Dict[str, Any]) -> bool:
-    if supabase is None:
-        logger.error("Supabase client is not initialized")
+# Строка таблицы users из данных клиента: все записываемые колонки или только переданные
+def build_user_row(user_data: Dict[str, Any], columns: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    # Используем только те поля, которые существуют в базе данных
+    return UserState.from_row(user_data).to_row(columns)
+
+async def save_user(user_data: Dict[str, Any]) -> bool:
+    if store is None:
+        logger.error("Storage is not initialized")
         return False
         
     try:
         logger.info(f"Saving user: {user_data.get('first_name', 'Unknown')}")
         
-        # Подготовка данных для вставки/обновления
-        # Используем только те поля, которые существуют в базе данных
-        db_data = {
-            "user_id": str(user_data.get('id', '')),
-            "first_name": user_data.get('first_name', ''),
-            "last_name": user_data.get('last_name', ''),
-            "username": user_data.get('username', ''),
-            "photo_url": user_data.get('photo_url', ''),
-            "score": int(user_data.get('score', 0)),
-            "total_clicks": int(user_data.get('total_clicks', 0)),
-            "level": get_level_by_score(int(user_data.get('score', 0))),
-            "wallet_address": user_data.get('wallet_address', ''),
-            "wallet_task_completed": bool(user_data.get('wallet_task_completed', False)),
-            "channel_task_completed": bool(user_data.get('channel_task_completed', False)),
-            "referrals": user_data.get('referrals', []),
-            "energy": int(user_data.get('energy', MAX_ENERGY)),
-            "last_energy_update": user_data.get('last_energy_update', datetime.now(timezone.utc).isoformat()),
-            "last_referral_task_completion": user_data.get('last_referral_task_completion'),
-            "upgrades": user_data.get('upgrades', []),
-            "ads_watched": int(user_data.get('ads_watched', 0)),
-            "achievements": user_data.get('achievements', []),
-            "daily_bonus": user_data.get('daily_bonus', {
-                'last_claim': None,
-                'streak': 0,
-                'claimed_days': []
-            }),
-            "language": user_data.get('language', 'ru'),
-            "last_passive_income_update": user_data.get('last_passive_income_update', datetime.now(timezone.utc).isoformat()),
-            "last_ad_time": user_data.get('last_ad_time', datetime.now(timezone.utc).isoformat())
-        }
+        # Клиент задает только свои поля профиля; счетчики новой строки
+        # получают значения по умолчанию таблицы, у существующей не меняются
+        db_data = build_user_row(user_data, CLIENT_USER_COLUMNS)
         
-        # Логируем ключевые поля перед сохранением
-        logger.info(f"Before save to DB:")
-        logger.info(f"  wallet_task_completed: {db_data['wallet_task_completed']} (type: {type(db_data['wallet_task_completed'])})")
-        logger.info(f"  channel_task_completed: {db_data['channel_task_completed']} (type: {type(db_data['channel_task_completed'])})")
+        if not db_data["user_id"]:
+            logger.error("Cannot save user without id")
+            return False
         
-        def query():
-            # Используем upsert для атомарной вставки или обновления
-            return supabase.table("users").upsert(
-                db_data, 
-                on_conflict="user_id"
-            ).execute()
+        user_id = db_data["user_id"]
+        
+        # Сохранения одного пользователя не пересекаются с другими его записями
+        async with user_locks.lock(user_id):
+            # Откладываем только обновление пользователя из кэша (строка уже есть в базе):
+            # буфер объединит его с другими сохранениями. Создание пишется сразу, чтобы
+            # при недоступном хранилище клиент получил ошибку, а не строку, которая
+            # будет записана неизвестно когда
+            if write_buffer.enabled and user_cache.get(user_id) is not None:
+                await write_buffer.put(db_data)
+                logger.info(f"User {user_id} queued for write-behind flush")
+            else:
+                # Более старые отложенные изменения не должны затереть эту запись
+                await write_buffer.flush_key(user_id)
+                
+                async def query():
+                    # Используем upsert для атомарной вставки или обновления
+                    return await store.upsert_users([db_data])
+                
+                await execute_storage_query(query)
+            
+            # Кэш меняется только после принятой записи и только поверх существующей
+            # записи: в строке нет referral_count и счетчиков, и без них новая запись
+            # выдала бы значения по умолчанию вместо данных из хранилища
+            user_cache.update(user_id, db_data)
+            leaderboard.update(user_id, db_data)
+            
+        logger.info(f"Save operation completed for user {user_id}")
+        return True
+    except (CircuitOpenError, WriteBufferFull):
+        # Хранилище недоступно: эндпоинт ответит 503 с Retry-After
+        raise
+    except Exception as e:
+        logger.error(f"Error saving user: {e}")
+        user_cache.invalidate(str(user_data.get('id', user_data.get('user_id', ''))))
+        return False
         
-        response = execute_supabase_query(query)
+# Функция для пакетного сохранения пользователей (исправления, миграции)
+async def save_users_bulk(records: List[Dict[str, Any]], parallelism: int = BULK_PARALLELISM) -> Dict[str, Any]:
+    if store is None:
+        logger.error("Storage is not initialized")
+        return {"status": "error", "message": "Storage is not initialized"}
+    
+    try:
+        logger.info(f"Bulk saving {len(records)} users")
+        
+        failed: List[Dict[str, Any]] = []
+        rows: Dict[str, Dict[str, Any]] = {}
+        for record in records:
+            row = build_user_row(record)
+            if not row["user_id"]:
+                failed.append({"user_id": None, "message": "Cannot save user without id", "retryable": False})
+                continue
+            # Для повторяющихся user_id побеждает последняя запись
+            rows[row["user_id"]] = row
+        
+        # Сначала записываем буфер, чтобы более старые отложенные изменения не затерли пакет
+        await write_buffer.flush()
+        
+        failed.extend(await upsert_users_bulk(list(rows.values()), parallelism))
+        
+        failed_ids = {failure["user_id"] for failure in failed}
+        for user_id, row in rows.items():
+            if user_id in failed_ids:
+                user_cache.invalidate(user_id)
+            else:
+                # Строка без referral_count: обновляем только запись, которая уже есть в кэше
+                user_cache.update(user_id, row)
+                leaderboard.update(user_id, row)
+        
+        saved = len(rows.keys() - failed_ids)
+        logger.info(f"Bulk saved {saved}/{len(records)} users, {len(failed)} failed")
         
-        logger.info(f"Save operation completed with data: {response.data}")
-        return response.data is not None
+        if not failed:
+            status = "success"
+        elif saved:
+            status = "partial"
+        else:
+            status = "error"
+        return {"status": status, "saved": saved, "failed": failed}
     except Exception as e:
-        logger.error(f"Error saving user: {e}")
+        logger.error(f"Error bulk saving users: {e}")
+        return {"status": "error", "message": str(e)}
+
+# Запись отдельных колонок пользователя через буфер отложенной записи и кэш.
+# Кэш меняется только после принятой записи: отклоненная (WriteBufferFull,
+# ошибка хранилища) не должна остаться в кэше как сохраненная
+async def write_user_fields(user_id: str, db_changes: Dict[str, Any]) -> None:
+    if write_buffer.enabled:
+        await write_buffer.put({"user_id": user_id, **db_changes})
+    else:
+        # Обновляем только переданные колонки
+        async def query():
+            return await store.update_user(user_id, db_changes)
+        
+        await execute_storage_query(query)
+    
+    user_cache.update(user_id, db_changes)
+    leaderboard.update(user_id, db_changes)
+
+# Поля таблицы users, которые клиент может менять частичным сохранением, и их типы.
+# Очки, клики, улучшения, отметки заданий и счетчики ведет сервер: клики - пакетами,
+# награды и покупки - атомарными запросами хранилища, которые проверяют условие
+# и начисляют или списывают очки. Значение от клиента позволило бы обойти проверку
+PATCHABLE_USER_FIELDS = {
+    "first_name": str,
+    "last_name": str,
+    "username": str,
+    "photo_url": str,
+    "wallet_address": str,
+    "language": str
+}
+
+# Колонки, которые записывает полное сохранение пользователя (POST /user)
+CLIENT_USER_COLUMNS = ("user_id", *PATCHABLE_USER_FIELDS)
+
+# Значение подходит полю: bool в JSON - не число, даже если поле целое
+def is_valid_field_value(value: Any, field_type) -> bool:
+    if isinstance(value, bool) and field_type is int:
         return False
+    return isinstance(value, field_type)
+
+# Функция для частичного сохранения пользователя (только измененные поля)
+async def patch_user(user_id: str, changes: Dict[str, Any]) -> Dict[str, Any]:
+    if store is None:
+        logger.error("Storage is not initialized")
+        return {"status": "error", "message": "Storage is not initialized"}
+    
+    try:
+        logger.info(f"Patching user {user_id}: {list(changes.keys())}")
+        
+        # Оставляем только известные поля; значение неверного типа отклоняет весь запрос
+        db_changes = {}
+        for key, value in changes.items():
+            field_type = PATCHABLE_USER_FIELDS.get(key)
+            if field_type is None:
+                continue
+            if not is_valid_field_value(value, field_type):
+                logger.info(f"Rejected patch for user {user_id}: invalid {key} ({type(value).__name__})")
+                return {"status": "error", "message": "Invalid data", "field": key}
+            db_changes[key] = value
+        
+        async with user_locks.lock(user_id):
+            # Проверяем, что пользователь существует (обычно из кэша, без запроса к базе)
+            user = await load_user(user_id)
+            if not user:
+                return {"status": "error", "message": "User not found"}
+            
+            if not db_changes:
+                return {"status": "success", "updated": []}
+            
+            await write_user_fields(user_id, db_changes)
         
+        return {"status": "success", "updated": list(db_changes.keys())}
+    except Exception as e:
+        logger.error(f"Error patching user: {e}")
+        user_cache.invalidate(user_id)
+        return {"status": "error", "message": str(e)}
+
+# Ограничения для пакетов кликов
+MAX_TAPS_PER_SECOND = 20
+MAX_TAP_WINDOW_MS = 10000
+
+# Поля, которые меняет пакет кликов (вместе с якорями энергии и дохода)
+TAP_COLUMNS = ("score", "total_clicks", "energy", "last_energy_update", "last_passive_income_update", "level")
+
+# Последний примененный пакет кликов пользователя: {"session": сессия клиента, "seq": номер пакета}.
+# Повторы приходят в течение секунд после сбоя сети, поэтому хватает ограниченного
+# LRU с временем жизни; после вытеснения следующий пакет просто применяется
+tap_sequences = UserCache(
+    max_size=int(os.environ.get("TAP_SEQUENCES_SIZE", 10000)),
+    ttl=float(os.environ.get("TAP_SEQUENCES_TTL", 600)),
+)
+
+# Функция для применения пакета кликов (сервер сам считает очки и энергию)
+async def apply_taps(user_id: str, taps: int, window_ms: int, seq: int, session: str) -> Dict[str, Any]:
+    try:
+        async with user_locks.lock(user_id):
+            user = await load_user(user_id)
+            
+            if not user:
+                return {"status": "error", "message": "User not found"}
+            
+            # Повторно присланный пакет (например, после сетевой ошибки) не применяем
+            last = tap_sequences.get(user_id) or {"session": None, "seq": -1}
+            duplicate = last["session"] == session and seq <= last["seq"]
+            applied = 0
+            
+            if not duplicate:
+                # Не даем применить больше кликов, чем физически возможно за окно и чем есть энергии
+                window_ms = min(max(window_ms, 1000), MAX_TAP_WINDOW_MS)
+                max_taps = MAX_TAPS_PER_SECOND * window_ms // 1000
+                applied = max(0, min(taps, max_taps, user.energy))
+            
+                if applied > 0:
+                    # Бусты живут только на клиенте и сервером не выдаются, поэтому на очки не влияют
+                    user.score += (1 + user.click_bonus) * applied
+                    user.total_clicks += applied
+                    user.energy -= applied
+                    
+                    # Очки и энергия пишутся вместе со своими якорями
+                    await write_user_fields(user_id, user.to_row(TAP_COLUMNS))
+            
+                tap_sequences.put(user_id, {"session": session, "seq": seq}, merge=False)
+                
+            logger.info(f"Applied {applied}/{taps} taps for user {user_id} (seq {seq})")
+            return {
+                "status": "success",
+                "seq": seq,
+                "applied": applied,
+                "duplicate": duplicate,
+                "click_bonus": user.click_bonus,
+                "passive_income": user.passive_income,
+                **user.to_row(TAP_COLUMNS)
+            }
+    except Exception as e:
+        logger.error(f"Error applying taps: {e}")
+        return {"status": "error", "message": str(e)}
+
 # Функция для получения топа пользователей
-def get_top_users(limit: int = 100) -> List[Dict[str, Any]]:
-    if supabase is None:
-        logger.error("Supabase client is not initialized")
+async def get_top_users(limit: int = 100) -> List[Dict[str, Any]]:
+    # Когда рейтинг загружен, отвечаем из памяти
+    if leaderboard.ready:
+        return leaderboard.top(limit)
+    
+    if store is None:
+        logger.error("Storage is not initialized")
         return []
         
     try:
         logger.info(f"Getting top {limit} users")
         
-        def query():
-            return supabase.table("users").select("user_id, first_name, last_name, username, photo_url, score, level").order("score", desc=True).limit(limit).execute()
+        async def query():
+            return await store.top_users(limit)
         
-        response = execute_supabase_query(query)
+        top_users = await execute_storage_query(query)
         
-        if response.data:
-            logger.info(f"Found {len(response.data)} users")
-            return response.data
+        if top_users:
+            logger.info(f"Found {len(top_users)} users")
+            return top_users
         else:
             logger.info("No users found")
             return []
@@ -476,203 +797,452 @@ def get_top_users(limit: int = 100) -> List[Dict[str, Any]]:
         logger.error(f"Error getting top users: {e}")
         return []
 
+# Очки после атомарного изменения в хранилище вместе с уровнем для кэша и рейтинга.
+# Колонку level в базе обновит ближайший пакет кликов (TAP_COLUMNS)
+def score_fields(score: int) -> Dict[str, int]:
+    return {"score": score, "level": LEVEL_TABLE.index(score)}
+
+# Функция для начисления очков на сервере (одним атомарным запросом)
+async def increment_score(user_id: str, delta: int) -> Optional[int]:
+    if store is None:
+        logger.error("Storage is not initialized")
+        return None
+    
+    try:
+        async with user_locks.lock(user_id):
+            await write_buffer.flush_key(user_id)
+            
+            # Без повторных попыток: повтор после таймаута начислил бы очки дважды
+            async def query():
+                return await store.increment_score(user_id, delta)
+            
+            result = await execute_storage_query(query, idempotent=False)
+            
+            if result is None:
+                logger.info(f"User not found: {user_id}")
+                return None
+            
+            score = result["score"]
+            user_cache.update(user_id, score_fields(score))
+            leaderboard.update(user_id, score_fields(score))
+            
+        logger.info(f"Added {delta} points to user {user_id}: {score}")
+        return score
+    except Exception as e:
+        logger.error(f"Error incrementing score: {e}")
+        return None
+
 # Функция для добавления реферала
-def add_referral(referrer_id: str, referred_id: str) -> bool:
-    if supabase is None:
-        logger.error("Supabase client is not initialized")
+async def add_referral(referrer_id: str, referred_id: str) -> bool:
+    if store is None:
+        logger.error("Storage is not initialized")
         return False
         
     try:
         logger.info(f"Adding referral: {referrer_id} -> {referred_id}")
         
-        # Получаем данные реферера
-        def query():
-            return supabase.table("users").select("referrals").eq("user_id", referrer_id).execute()
-        
-        response = execute_supabase_query(query)
-        
-        if not response.data or len(response.data) == 0:
-            logger.info(f"Referrer not found: {referrer_id}")
-            return False
-        
-        referrals = response.data[0].get("referrals", [])
+        async with user_locks.lock(referrer_id):
+            # Сначала записываем отложенные изменения реферера, чтобы буфер не затер результат
+            await write_buffer.flush_key(referrer_id)
+            
+            # Проверка на дубликат и добавление выполняются хранилищем атомарно
+            async def query():
+                return await store.append_referral(referrer_id, referred_id)
+            
+            result = await execute_storage_query(query)
+            
+            if result is None:
+                logger.info(f"Referrer not found: {referrer_id}")
+                return False
+            
+            user_cache.update(referrer_id, {"referral_count": result["referral_count"]})
         
-        # Если реферал уже добавлен, ничего не делаем
-        if referred_id in referrals:
+        if result["added"]:
+            logger.info("Referral added successfully")
+        else:
             logger.info("Referral already exists")
-            return True
-        
-        # Добавляем нового реферала
-        referrals.append(referred_id)
-        
-        # Обновляем данные реферера
-        def update_query():
-            return supabase.table("users").update({"referrals": referrals}).eq("user_id", referrer_id).execute()
-        
-        update_response = execute_supabase_query(update_query)
-        
-        logger.info("Referral added successfully")
-        return update_response.data is not None
+        return True
     except Exception as e:
         logger.error(f"Error adding referral: {e}")
         return False
 
+# Максимальный размер страницы списка рефералов
+MAX_REFERRALS_PAGE = 100
+
+# Функция для получения страницы рефералов (в порядке приглашения)
+async def get_referrals(referrer_id: str, limit: int = 20, offset: int = 0) -> List[Dict[str, Any]]:
+    if store is None:
+        logger.error("Storage is not initialized")
+        return []
+    
+    try:
+        async def query():
+            return await store.list_referrals(referrer_id, limit, offset)
+        
+        return await execute_storage_query(query)
+    except Exception as e:
+        logger.error(f"Error getting referrals: {e}")
+        return []
+
 # Функция для получения достижений
-def get_achievements(user_id: str) -> List[Dict[str, Any]]:
-    if supabase is None:
-        logger.error("Supabase client is not initialized")
+async def get_achievements(user_id: str) -> List[Dict[str, Any]]:
+    if store is None:
+        logger.error("Storage is not initialized")
         return []
         
     try:
         logger.info(f"Getting achievements for user: {user_id}")
         
-        def query():
-            return supabase.table("users").select("achievements").eq("user_id", user_id).execute()
+        async def query():
+            return await store.get_achievements(user_id)
         
-        response = execute_supabase_query(query)
-        
-        if response.data and len(response.data) > 0:
-            return response.data[0].get("achievements", [])
-        else:
-            return []
+        return await execute_storage_query(query) or []
     except Exception as e:
         logger.error(f"Error getting achievements: {e}")
         return []
 
-# Функция для добавления достижения
-def add_achievement(user_id: str, achievement_id: str) -> bool:
-    if supabase is None:
-        logger.error("Supabase client is not initialized")
+# Каталог достижений по id
+ACHIEVEMENTS_BY_ID = {achievement["id"]: achievement for achievement in ACHIEVEMENTS}
+
+# Выполнено ли условие достижения (по состоянию сервера, а не по словам клиента)
+def is_achievement_unlocked(achievement: Dict[str, Any], user: UserState) -> bool:
+    condition = achievement["condition"]
+    if condition["type"] == "clicks":
+        value = user.total_clicks
+    elif condition["type"] == "score":
+        value = user.score
+    elif condition["type"] == "daily_streak":
+        value = user.daily_bonus.get("streak") or 0
+    else:
         return False
+    return value >= condition["value"]
+
+# Функция для добавления достижения (награда начисляется хранилищем вместе с ним)
+async def add_achievement(user_id: str, achievement_id: str) -> Dict[str, Any]:
+    if store is None:
+        logger.error("Storage is not initialized")
+        return {"status": "error", "message": "Storage is not initialized"}
+    
+    achievement = ACHIEVEMENTS_BY_ID.get(achievement_id)
+    if achievement is None:
+        return {"status": "error", "message": "Unknown achievement"}
         
     try:
         logger.info(f"Adding achievement {achievement_id} to user: {user_id}")
         
-        # Получаем текущие достижения пользователя
-        def query():
-            return supabase.table("users").select("achievements").eq("user_id", user_id).execute()
-        
-        response = execute_supabase_query(query)
-        
-        if not response.data or len(response.data) == 0:
-            logger.info(f"User not found: {user_id}")
-            return False
-        
-        achievements = response.data[0].get("achievements", [])
+        async with user_locks.lock(user_id):
+            user = await load_user(user_id, with_profile=True)
+            if not user:
+                return {"status": "error", "message": "User not found"}
+            
+            if not is_achievement_unlocked(achievement, user):
+                logger.info(f"Achievement {achievement_id} conditions not met for user {user_id}")
+                return {"status": "error", "message": "Achievement conditions not met"}
+            
+            # Сначала записываем отложенные изменения пользователя
+            await write_buffer.flush_key(user_id)
+            
+            # Без повторных попыток: после потерянного ответа повтор вернул бы "уже добавлено"
+            async def query():
+                return await store.append_achievement(user_id, achievement_id, achievement["reward"])
+            
+            result = await execute_storage_query(query, idempotent=False)
+            
+            if result is None:
+                logger.info(f"User not found: {user_id}")
+                return {"status": "error", "message": "User not found"}
+            
+            user_cache.update(user_id, {"achievements": result["achievements"], **score_fields(result["score"])})
+            leaderboard.update(user_id, score_fields(result["score"]))
         
-        # Если достижение уже добавлено, ничего не делаем
-        if achievement_id in achievements:
+        if result["added"]:
+            logger.info("Achievement added successfully")
+        else:
             logger.info("Achievement already exists")
-            return True
-        
-        # Добавляем новое достижение
-        achievements.append(achievement_id)
-        
-        # Обновляем данные пользователя
-        def update_query():
-            return supabase.table("users").update({"achievements": achievements}).eq("user_id", user_id).execute()
-        
-        update_response = execute_supabase_query(update_query)
-        
-        logger.info("Achievement added successfully")
-        return update_response.data is not None
+        return {
+            "status": "success",
+            "added": result["added"],
+            "reward": achievement["reward"] if result["added"] else 0,
+            "achievements": result["achievements"],
+            "score": result["score"]
+        }
     except Exception as e:
         logger.error(f"Error adding achievement: {e}")
-        return False
+        return {"status": "error", "message": str(e)}
 
 # Функция для получения ежедневного бонуса
-def claim_daily_bonus(user_id: str) -> Dict[str, Any]:
-    if supabase is None:
-        logger.error("Supabase client is not initialized")
-        return {"status": "error", "message": "Supabase client is not initialized"}
+async def claim_daily_bonus(user_id: str) -> Dict[str, Any]:
+    if store is None:
+        logger.error("Storage is not initialized")
+        return {"status": "error", "message": "Storage is not initialized"}
         
     try:
         logger.info(f"Claiming daily bonus for user: {user_id}")
         
-        # Получаем данные пользователя
-        def query():
-            return supabase.table("users").select("*").eq("user_id", user_id).execute()
-        
-        response = execute_supabase_query(query)
-        
-        if not response.data or len(response.data) == 0:
-            logger.info(f"User not found: {user_id}")
-            return {"status": "error", "message": "User not found"}
-        
-        user_data = response.data[0]
-        daily_bonus = user_data.get("daily_bonus", {
-            'last_claim': None,
-            'streak': 0,
-            'claimed_days': []
-        })
-        
-        current_time = datetime.now(timezone.utc)
-        today = current_time.date().isoformat()
-        
-        # Проверяем, был ли уже получен бонус сегодня
-        last_claim = daily_bonus.get('last_claim')
-        if last_claim and isinstance(last_claim, str):
-            last_claim = datetime.fromisoformat(last_claim.replace('Z', '+00:00'))
-        
-        if last_claim and last_claim.date() == current_time.date():
-            logger.info("Daily bonus already claimed today")
-            return {"status": "error", "message": "Daily bonus already claimed today"}
-        
-        # Определяем день бонуса
-        if daily_bonus['streak'] == 0 or (last_claim and 
-                                         (current_time.date() - last_claim.date()).days > 1):
-            # Если серия прервана, начинаем заново
-            daily_bonus['streak'] = 1
-        else:
-            # Увеличиваем серию
-            daily_bonus['streak'] += 1
-        
-        # Ограничиваем серию максимальным количеством дней
-        if daily_bonus['streak'] > len(DAILY_BONUSES):
-            daily_bonus['streak'] = len(DAILY_BONUSES)
+        async with user_locks.lock(user_id):
+            # Сначала записываем отложенные изменения пользователя
+            await write_buffer.flush_key(user_id)
+            
+            # Проверка, расчет серии и начисление очков выполняются хранилищем атомарно,
+            # поэтому два одновременных запроса не получат бонус дважды
+            async def query():
+                return await store.claim_daily_bonus(user_id, [bonus['reward'] for bonus in DAILY_BONUSES])
+            
+            # Без повторных попыток: после потерянного ответа повтор вернул бы "уже получен"
+            result = await execute_storage_query(query, idempotent=False)
+            
+            if result["status"] != "success":
+                logger.info(f"Daily bonus not claimed: {result['message']}")
+                return result
+            
+            user_cache.update(user_id, {"daily_bonus": result["daily_bonus"], **score_fields(result["score"])})
+            leaderboard.update(user_id, score_fields(result["score"]))
+            
+        logger.info(f"Daily bonus claimed successfully: {result['reward']}")
+        return result
+    except Exception as e:
+        logger.error(f"Error claiming daily bonus: {e}")
+        return {"status": "error", "message": str(e)}
+
+# Задание с рекламой: награда за каждые ADS_TASK_REQUIRED просмотров
+ADS_TASK_REQUIRED = 10
+ADS_TASK_REWARD = 5000
+
+# Функция для получения награды за просмотры рекламы
+async def claim_ad_reward(user_id: str) -> Dict[str, Any]:
+    if store is None:
+        logger.error("Storage is not initialized")
+        return {"status": "error", "message": "Storage is not initialized"}
+    
+    try:
+        logger.info(f"Claiming ads task reward for user: {user_id}")
         
-        # Определяем награду
-        bonus_day = min(daily_bonus['streak'], len(DAILY_BONUSES))
-        bonus_reward = DAILY_BONUSES[bonus_day - 1]['reward']
+        async with user_locks.lock(user_id):
+            # Сначала записываем отложенные изменения пользователя
+            await write_buffer.flush_key(user_id)
+            
+            # Проверка счетчика, списание просмотров и начисление очков - одним атомарным запросом.
+            # Без повторных попыток: повтор после таймаута начислил бы награду дважды
+            async def query():
+                return await store.claim_ad_reward(user_id, ADS_TASK_REQUIRED, ADS_TASK_REWARD)
+            
+            result = await execute_storage_query(query, idempotent=False)
+            
+            if result is None:
+                logger.info(f"User not found: {user_id}")
+                return {"status": "error", "message": "User not found"}
+            
+            user_cache.update(user_id, {"ads_watched": result["ads_watched"], **score_fields(result["score"])})
+            leaderboard.update(user_id, score_fields(result["score"]))
         
-        # Обновляем данные пользователя
-        daily_bonus['last_claim'] = current_time.isoformat()  # Преобразуем в строку
-        if today not in daily_bonus['claimed_days']:
-            daily_bonus['claimed_days'].append(today)
+        if not result["claimed"]:
+            logger.info(f"Ads task reward not claimed: {result['ads_watched']}/{ADS_TASK_REQUIRED} ads watched")
+            return {"status": "error", "message": "Not enough ads watched", "ads_watched": result["ads_watched"]}
+            
+        logger.info(f"Ads task reward claimed successfully: {ADS_TASK_REWARD}")
+        return {"status": "success", "reward": ADS_TASK_REWARD, "ads_watched": result["ads_watched"], "score": result["score"]}
+    except Exception as e:
+        logger.error(f"Error claiming ads task reward: {e}")
+        return {"status": "error", "message": str(e)}
+
+# Награды заданий по id (задание с рекламой получает награду через claim_ad_reward)
+TASK_REWARDS = {task["id"]: task["reward"] for task in NORMAL_TASKS + DAILY_TASKS if task["id"] != "ads_task"}
+
+# Функция для получения награды за задание (проверка условия, отметка и начисление - атомарно)
+async def claim_task_reward(user_id: str, task_id: str) -> Dict[str, Any]:
+    if store is None:
+        logger.error("Storage is not initialized")
+        return {"status": "error", "message": "Storage is not initialized"}
+    
+    reward = TASK_REWARDS.get(task_id)
+    if reward is None:
+        return {"status": "error", "message": "Unknown task"}
+    
+    try:
+        logger.info(f"Claiming task {task_id} reward for user: {user_id}")
         
-        # Добавляем очки пользователю
-        new_score = user_data.get('score', 0) + bonus_reward
+        async with user_locks.lock(user_id):
+            # Сначала записываем отложенные изменения пользователя (например, адрес кошелька)
+            await write_buffer.flush_key(user_id)
+            
+            # Без повторных попыток: повтор после таймаута вернул бы "уже получено"
+            async def query():
+                return await store.claim_task_reward(user_id, task_id, reward)
+            
+            result = await execute_storage_query(query, idempotent=False)
+            
+            if result is None:
+                logger.info(f"User not found: {user_id}")
+                return {"status": "error", "message": "User not found"}
+            
+            task_state = {key: value for key, value in result.items() if key != "claimed"}
+            user_cache.update(user_id, {**task_state, **score_fields(result["score"])})
+            leaderboard.update(user_id, score_fields(result["score"]))
         
-        def update_query():
-            return supabase.table("users").update({
-                "score": new_score,
-                "daily_bonus": daily_bonus
-            }).eq("user_id", user_id).execute()
+        if not result["claimed"]:
+            logger.info(f"Task {task_id} reward not claimed for user {user_id}")
+            return {"status": "error", "message": "Task conditions not met", **task_state}
+            
+        logger.info(f"Task {task_id} reward claimed successfully: {reward}")
+        return {"status": "success", "task_id": task_id, "reward": reward, **task_state}
+    except Exception as e:
+        logger.error(f"Error claiming task reward: {e}")
+        return {"status": "error", "message": str(e)}
+
+# Каталог улучшений по id
+UPGRADES_BY_ID = {upgrade["id"]: upgrade for upgrade in UPGRADES}
+
+# Функция для покупки улучшения (проверка и списание стоимости - одним атомарным запросом)
+async def purchase_upgrade(user_id: str, upgrade_id: str) -> Dict[str, Any]:
+    if store is None:
+        logger.error("Storage is not initialized")
+        return {"status": "error", "message": "Storage is not initialized"}
+    
+    upgrade = UPGRADES_BY_ID.get(upgrade_id)
+    if upgrade is None:
+        return {"status": "error", "message": "Unknown upgrade"}
+    
+    try:
+        logger.info(f"Purchasing upgrade {upgrade_id} for user: {user_id}")
         
-        update_response = execute_supabase_query(update_query)
+        async with user_locks.lock(user_id):
+            user = await load_user(user_id)
+            if not user:
+                return {"status": "error", "message": "User not found"}
+            
+            # Пассивный доход до покупки начисляется по прежней ставке:
+            # фиксируем очки вместе с якорями и записываем их до списания
+            await write_user_fields(user_id, user.to_row(TAP_COLUMNS))
+            await write_buffer.flush_key(user_id)
+            
+            # Без повторных попыток: повтор после таймаута вернул бы "уже куплено"
+            async def query():
+                return await store.purchase_upgrade(user_id, upgrade_id, upgrade["cost"])
+            
+            result = await execute_storage_query(query, idempotent=False)
+            
+            if result is None:
+                logger.info(f"User not found: {user_id}")
+                return {"status": "error", "message": "User not found"}
+            
+            user_cache.update(user_id, {"upgrades": result["upgrades"], **score_fields(result["score"])})
+            leaderboard.update(user_id, score_fields(result["score"]))
         
-        if not update_response.data:
-            logger.info("Failed to update user data")
-            return {"status": "error", "message": "Failed to update user data"}
+        if not result["purchased"]:
+            message = "Upgrade already purchased" if upgrade_id in result["upgrades"] else "Not enough coins"
+            logger.info(f"Upgrade {upgrade_id} not purchased for user {user_id}: {message}")
+            return {"status": "error", "message": message, "score": result["score"]}
         
-        logger.info(f"Daily bonus claimed successfully: {bonus_reward}")
+        click_bonus, passive_income = UPGRADE_TABLE.totals(UPGRADE_TABLE.mask(result["upgrades"]))
+        logger.info(f"Upgrade {upgrade_id} purchased successfully for {upgrade['cost']}")
         return {
-            "status": "success", 
-            "reward": bonus_reward,
-            "streak": daily_bonus['streak'],
-            "daily_bonus": daily_bonus
+            "status": "success",
+            "upgrade_id": upgrade_id,
+            "score": result["score"],
+            "upgrades": result["upgrades"],
+            "click_bonus": click_bonus,
+            "passive_income": passive_income
         }
     except Exception as e:
-        logger.error(f"Error claiming daily bonus: {e}")
+        logger.error(f"Error purchasing upgrade: {e}")
         return {"status": "error", "message": str(e)}
 
-# Монтируем статические файлы
+# Каталог мини-игр по id
+MINIGAMES_BY_ID = {minigame["id"]: minigame for minigame in MINIGAMES}
+
+# Время последней награды за мини-игру: {"played_at": time.monotonic()}, ключ - "<user_id>:<minigame_id>".
+# Награду можно получать не чаще, чем длится сама игра
+minigame_plays = UserCache(
+    max_size=int(os.environ.get("MINIGAME_PLAYS_SIZE", 10000)),
+    ttl=max(minigame["duration"] for minigame in MINIGAMES),
+)
+
+# Функция для получения награды за мини-игру (не больше награды из каталога)
+async def claim_minigame_reward(user_id: str, minigame_id: str, coins: int) -> Dict[str, Any]:
+    minigame = MINIGAMES_BY_ID.get(minigame_id)
+    if minigame is None:
+        return {"status": "error", "message": "Unknown minigame"}
+    
+    # Проверка и отметка без await между ними, поэтому параллельные запросы не пройдут оба
+    key = f"{user_id}:{minigame_id}"
+    last_play = minigame_plays.get(key)
+    if last_play is not None and time.monotonic() - last_play["played_at"] < minigame["duration"]:
+        return {"status": "error", "message": "Minigame played too recently"}
+    minigame_plays.put(key, {"played_at": time.monotonic()}, merge=False)
+    
+    reward = max(0, min(coins, minigame["reward"]))
+    score = await increment_score(user_id, reward)
+    if score is None:
+        minigame_plays.invalidate(key)
+        return {"status": "error", "message": "Failed to add reward"}
+        
+    return {"status": "success", "reward": reward, "score": score}
+
+# Собранные app.<hash>.css/js, заранее сжатые (заполняется после сборки страницы)
+page_asset_bodies: Dict[str, CompressedBody] = {}
+
+# Хэши (ETag) всех файлов статики считаются при старте, небольшие файлы держим в памяти
+static_file_cache = StaticFileCache(
+    max_file_size=int(os.getenv("STATIC_CACHE_MAX_FILE_SIZE", str(512 * 1024))),
+    max_total_size=int(os.getenv("STATIC_CACHE_MAX_TOTAL_SIZE", str(32 * 1024 * 1024))),
+)
+static_file_cache.warm(STATIC_DIR)
+
+# Монтируем статические файлы (собранные app.<hash>.css/js и ссылки с ?v=<hash> - с вечным кэшем)
 try:
-    app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+    app.mount(
+        "/static",
+        AssetStaticFiles(directory=STATIC_DIR, precompressed=page_asset_bodies, file_cache=static_file_cache),
+        name="static",
+    )
     logger.info(f"Static files mounted from {STATIC_DIR}")
 except Exception as e:
     logger.error(f"Error mounting static files: {e}")
 
+# Запускаем фоновый сброс буфера отложенной записи
+@app.on_event("startup")
+async def start_write_buffer():
+    write_buffer.start()
+    logger.info(f"Write-behind buffer started (flush every {write_buffer.flush_interval}s)")
+
+# Заполняем рейтинг из базы в фоне; до готовности /top читает из базы
+@app.on_event("startup")
+async def start_leaderboard_rebuild():
+    app.state.leaderboard_task = asyncio.get_running_loop().create_task(rebuild_leaderboard())
+
+# Запускаем рассылку топа по WebSocket
+@app.on_event("startup")
+async def start_top_push():
+    app.state.top_push_task = asyncio.get_running_loop().create_task(push_top_updates())
+
+@app.on_event("shutdown")
+async def stop_top_push():
+    app.state.top_push_task.cancel()
+    app.state.leaderboard_task.cancel()
+
+# Записываем все отложенные изменения и закрываем хранилище при остановке
+@app.on_event("shutdown")
+async def close_store():
+    await write_buffer.stop()
+    logger.info("Write-behind buffer flushed")
+    if store is not None:
+        await store.close()
+        logger.info(f"Storage closed: {store.name}")
+
+# Статистика кэша, буфера записи, объединения запросов, хранилища и размыкателя цепи (для подбора размеров на инстанс)
+@app.get("/stats")
+async def get_stats():
+    return FastJSONResponse(content={
+        "user_cache": user_cache.get_stats(),
+        "write_buffer": {**write_buffer.stats, "pending": len(write_buffer)},
+        "user_loads": {**user_loads.stats, "in_flight": len(user_loads)},
+        "user_locks": len(user_locks),
+        "storage": store.name if store is not None else None,
+        "storage_breaker": storage_breaker.get_stats(),
+        "retry_budget": retry_budget.get_stats(),
+        "static_files": static_file_cache.get_stats(),
+    })
+
 # Обработчик для favicon.ico
 @app.get("/favicon.ico")
 async def favicon():
@@ -690,42 +1260,36 @@ async def adsgram_reward(request: Request):
         
         if not user_id:
             logger.warning("Missing userid parameter in Adsgram request")
-            return JSONResponse(content={"status": "error", "message": "Missing userid parameter"}, status_code=400)
+            return FastJSONResponse(content={"status": "error", "message": "Missing userid parameter"}, status_code=400)
         
         logger.info(f"Processing Adsgram reward for user {user_id}")
         
-        # Загружаем данные пользователя
-        user_data = load_user(user_id)
-        
-        if not user_data:
-            logger.warning(f"User not found: {user_id}")
-            return JSONResponse(content={"status": "error", "message": "User not found"}, status_code=404)
-        
-        # Увеличиваем счетчик просмотренной рекламы
-        if 'ads_watched' not in user_data:
-            user_data['ads_watched'] = 0
-        
-        old_count = user_data['ads_watched']
-        user_data['ads_watched'] += 1
-        
-        # Обновляем время последнего просмотра рекламы
-        user_data['last_ad_time'] = datetime.now(timezone.utc).isoformat()
-        
-        logger.info(f"Updated ads_watched for user {user_id}: {old_count} -> {user_data['ads_watched']}")
-        
-        # Сохраняем обновленные данные
-        success = save_user(user_data)
+        # Колбэк приходит посреди сессии, поэтому меняем счетчик под блокировкой пользователя
+        async with user_locks.lock(user_id):
+            # Сначала записываем отложенные изменения пользователя, чтобы буфер не затер счетчик
+            await write_buffer.flush_key(user_id)
+            
+            # Увеличиваем счетчик и время просмотра рекламы одним атомарным запросом.
+            # Без повторных попыток: повтор после таймаута засчитал бы просмотр дважды
+            async def query():
+                return await store.record_ad_view(user_id)
+            
+            result = await execute_storage_query(query, idempotent=False)
+            
+            if result is None:
+                logger.warning(f"User not found: {user_id}")
+                return FastJSONResponse(content={"status": "error", "message": "User not found"}, status_code=404)
+            
+            user_cache.update(user_id, result)
         
-        if success:
-            logger.info(f"Successfully updated ads_watched for user {user_id}: {user_data['ads_watched']}")
-            return JSONResponse(content={"status": "success", "ads_watched": user_data['ads_watched']})
-        else:
-            logger.error(f"Failed to save user data for {user_id}")
-            return JSONResponse(content={"status": "error", "message": "Failed to save user data"}, status_code=500)
+        logger.info(f"Successfully updated ads_watched for user {user_id}: {result['ads_watched']}")
+        return FastJSONResponse(content={"status": "success", "ads_watched": result['ads_watched']})
             
+    except CircuitOpenError as e:
+        return storage_unavailable_response(e)
     except Exception as e:
         logger.error(f"Error in /adsgram-reward: {e}")
-        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
 
 html_content = """
 <!DOCTYPE html>
@@ -2442,21 +3006,23 @@ html_content = """
   </nav>
 
   <script>
-    // Уровни игры
-    const LEVELS = [
-      {score: 0, name: "Новичок", name_en: "Newbie"},
-      {score: 100, name: "Любитель", name_en: "Amateur"},
-      {score: 500, name: "Профи", name_en: "Pro"},
-      {score: 2000, name: "Мастер", name_en: "Master"},
-      {score: 5000, name: "Эксперт по Фембоям", name_en: "Femboy Expert"},
-      {score: 10000, name: "Фембой", name_en: "Femboy"},
-      {score: 50000, name: "Фурри-Фембой", name_en: "Furry Femboy"},
-      {score: 200000, name: "Феликс", name_en: "Felix"},
-      {score: 500000, name: "Астольфо", name_en: "Astolfo"},
-      {score: 1000000, name: "Владелец фембоев", name_en: "Femboy Owner"},
-      {score: 5000000, name: "Император фембоев", name_en: "Emperor of Femboys"},
-      {score: 10000000, name: "Бог фембоев", name_en: "God of Femboys"}
-    ];
+    // Уровни игры: пороги и названия приходят с сервера (/config) и хранятся в localStorage
+    let LEVELS = {thresholds: [0], names: ["Новичок"], names_en: ["Newbie"]};
+    
+    // Спрайт миниатюр улучшений из /config (null - показываем исходные картинки)
+    let UPGRADE_SPRITE = null;
+    
+    // Последняя полученная конфигурация доступна сразу, до ответа сервера
+    let cachedConfig = null;
+    try {
+      cachedConfig = JSON.parse(localStorage.getItem('gameConfig'));
+    } catch (error) {
+      cachedConfig = null;
+    }
+    if (cachedConfig && cachedConfig.config) {
+      LEVELS = cachedConfig.config.levels;
+      UPGRADE_SPRITE = cachedConfig.config.upgrade_sprite || null;
+    }
     
     // Улучшения игры (сбалансированная стоимость)
     const UPGRADES = [
@@ -2681,24 +3247,53 @@ html_content = """
       }
     };
     
-    // Функция для определения уровня по очкам
+    // Индекс уровня по очкам: двоичный поиск по порогам
     function getLevelByScore(score) {
-      for (let i = LEVELS.length - 1; i >= 0; i--) {
-        if (score >= LEVELS[i].score) {
-          return LEVELS[i];
+      const thresholds = LEVELS.thresholds;
+      let low = 0;
+      let high = thresholds.length;
+      while (low < high) {
+        const mid = (low + high) >> 1;
+        if (thresholds[mid] <= score) {
+          low = mid + 1;
+        } else {
+          high = mid;
         }
       }
-      return LEVELS[0];
+      return Math.max(low - 1, 0);
     }
     
-    // Функция для получения следующего уровня
-    function getNextLevel(currentScore) {
-      for (let i = 0; i < LEVELS.length - 1; i++) {
-        if (currentScore < LEVELS[i+1].score) {
-          return LEVELS[i+1];
+    // Название уровня на текущем языке
+    function getLevelName(index) {
+      const names = currentLanguage === 'ru' ? LEVELS.names : LEVELS.names_en;
+      return names[index];
+    }
+    
+    // Проверка таблиц игры на сервере (If-None-Match с ETag сохраненной копии)
+    async function loadConfig() {
+      try {
+        const response = await fetch('/config', {
+          cache: 'no-store',
+          headers: cachedConfig && cachedConfig.etag ? { 'If-None-Match': cachedConfig.etag } : {}
+        });
+        
+        // Сохраненная копия актуальна
+        if (response.status === 304) return;
+        
+        if (!response.ok) {
+          throw new Error(`Ошибка сервера: ${response.status}`);
         }
+        
+        const config = await response.json();
+        cachedConfig = { etag: response.headers.get('ETag'), config };
+        localStorage.setItem('gameConfig', JSON.stringify(cachedConfig));
+        LEVELS = config.levels;
+        UPGRADE_SPRITE = config.upgrade_sprite || null;
+        // Пороги могли измениться - уровень пересчитается при следующем обновлении
+        currentLevel = null;
+      } catch (error) {
+        console.error('Error loading config:', error);
       }
-      return null; // Если достигнут максимальный уровень
     }
 
     // Инициализация Telegram Web App
@@ -2714,15 +3309,17 @@ html_content = """
     let userData = {
       score: 0,
       total_clicks: 0,
-      level: "Новичок",
+      level: 0,
       wallet_address: "",
       wallet_task_completed: false,
       channel_task_completed: false,
-      referrals: [],
+      referral_count: 0,
       last_referral_task_completion: null,
       energy: 250,
       last_energy_update: new Date().toISOString(),
       upgrades: [],
+      click_bonus: 0,
+      passive_income: 0,
       ads_watched: 0,
       last_ad_time: new Date().toISOString(),
       achievements: [],
@@ -2913,6 +3510,26 @@ function initAdsgram() {
     }
     
     // Функция для загрузки данных пользователя с сервера
+    // Повтор загрузки данных, пока сервер или хранилище недоступны: ждем Retry-After,
+    // а без него - растущую паузу. Локальное состояние при этом не трогаем
+    const USER_LOAD_RETRY_MIN_MS = 1000;
+    const USER_LOAD_RETRY_MAX_MS = 60000;
+    let userLoadRetryDelay = USER_LOAD_RETRY_MIN_MS;
+    let userLoadRetryTimer = null;
+    
+    function scheduleUserDataRetry(response) {
+      if (userLoadRetryTimer) return;
+      
+      const retryAfter = response ? parseInt(response.headers.get('Retry-After'), 10) : NaN;
+      const delay = Number.isFinite(retryAfter) ? retryAfter * 1000 : userLoadRetryDelay;
+      userLoadRetryDelay = Math.min(userLoadRetryDelay * 2, USER_LOAD_RETRY_MAX_MS);
+      
+      userLoadRetryTimer = setTimeout(() => {
+        userLoadRetryTimer = null;
+        loadUserData();
+      }, delay);
+    }
+    
     async function loadUserData() {
       if (!user) return;
       
@@ -2921,10 +3538,11 @@ function initAdsgram() {
         if (response.ok) {
           const data = await response.json();
           if (data.user) {
+            userLoadRetryDelay = USER_LOAD_RETRY_MIN_MS;
             userData = data.user;
             // Убедимся, что все поля присутствуют
-            if (!userData.referrals) {
-              userData.referrals = [];
+            if (!userData.referral_count) {
+              userData.referral_count = 0;
             }
             if (!userData.wallet_address) {
               userData.wallet_address = "";
@@ -2979,6 +3597,9 @@ function initAdsgram() {
               userData.language = 'ru';
             }
             
+            // Запоминаем состояние сервера, дальше отправляем только изменения
+            rememberSavedState();
+            
             // Устанавливаем текущий язык
             currentLanguage = userData.language;
             updateLanguageUI();
@@ -3023,6 +3644,20 @@ function initAdsgram() {
           }
         }
         
+        // Новый пользователь - только если сервер его не знает (404). 503 и другие
+        // ошибки значат, что данные сейчас недоступны: пустой профиль затер бы их
+        if (response.status !== 404) {
+          console.error('Error loading user data, will retry:', response.status);
+          scheduleUserDataRetry(response);
+          checkWalletTask();
+          checkChannelTask();
+          checkReferralTask();
+          checkAdsTask();
+          updateAchievements();
+          updateDailyBonus();
+          return;
+        }
+        
         // Если данных нет, создаем нового пользователя
         userData = {
           id: user.id,
@@ -3032,11 +3667,11 @@ function initAdsgram() {
           photo_url: user.photo_url || '',
           score: 0,
           total_clicks: 0,
-          level: "Новичок",
+          level: 0,
           wallet_address: "",
           wallet_task_completed: false,
           channel_task_completed: false,
-          referrals: [],
+          referral_count: 0,
           last_referral_task_completion: null,
           energy: MAX_ENERGY,
           last_energy_update: new Date().toISOString(),
@@ -3067,6 +3702,8 @@ function initAdsgram() {
         updateDailyBonus();
       } catch (error) {
         console.error('Error loading user data:', error);
+        // Сеть недоступна: повторяем загрузку позже
+        scheduleUserDataRetry(null);
         // Даже при ошибке, обновляем состояние заданий на основе локальных данных
         checkWalletTask();
         checkChannelTask();
@@ -3077,36 +3714,149 @@ function initAdsgram() {
       }
     }
     
+  // Постоянное WebSocket-соединение: клики и сохранения уходят вверх,
+  // подтверждения и обновления топа приходят вниз без опроса
+  let socket = null;
+  let socketRequestId = 0;
+  const socketRequests = new Map();
+  
+  function connectSocket() {
+    if (!user) return;
+    
+    const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
+    const ws = new WebSocket(`${protocol}://${window.location.host}/ws?user_id=${user.id}`);
+    
+    ws.onopen = () => {
+      socket = ws;
+    };
+    
+    ws.onmessage = (event) => {
+      const message = JSON.parse(event.data);
+      
+      if (message.type === 'top') {
+        applyTopUsers(message.users);
+        return;
+      }
+      
+      const resolve = socketRequests.get(message.id);
+      if (resolve) {
+        socketRequests.delete(message.id);
+        resolve(message);
+      }
+    };
+    
+    ws.onclose = () => {
+      socket = null;
+      // Незавершенные запросы повторятся по HTTP
+      socketRequests.forEach(resolve => resolve(null));
+      socketRequests.clear();
+      setTimeout(connectSocket, 3000);
+    };
+  }
+  
+  function isSocketOpen() {
+    return socket !== null && socket.readyState === WebSocket.OPEN;
+  }
+  
+  // Отправляет сообщение и ждет подтверждения; null, если соединение оборвалось
+  function socketRequest(payload) {
+    return new Promise(resolve => {
+      const id = ++socketRequestId;
+      socketRequests.set(id, resolve);
+      socket.send(JSON.stringify({ ...payload, id }));
+    });
+  }
+  
+  // Поля, которые синхронизируются с сервером частичным сохранением.
+  // Очки, улучшения и отметки заданий ведет сервер: клики уходят пакетами,
+  // награды и покупки - отдельными запросами (postGameAction)
+  const SYNCED_FIELDS = [
+    'first_name', 'last_name', 'username', 'photo_url', 'wallet_address', 'language'
+  ];
+  
+  // Последнее подтвержденное сервером состояние (поля в виде JSON-строк)
+  let savedState = null;
+  
+  function rememberSavedState() {
+    savedState = {};
+    SYNCED_FIELDS.forEach(field => {
+      savedState[field] = JSON.stringify(userData[field]);
+    });
+  }
+  
+  // Поля, измененные с момента последнего сохранения
+  function getDirtyFields() {
+    const changes = {};
+    const serialized = {};
+    SYNCED_FIELDS.forEach(field => {
+      const value = JSON.stringify(userData[field]);
+      if (value !== savedState[field]) {
+        changes[field] = userData[field];
+        serialized[field] = value;
+      }
+    });
+    return { changes, serialized };
+  }
+  
+  // Частичное сохранение: отправляем на сервер только измененные поля
+  async function patchUserData() {
+    // Сначала отправляем накопленные клики, чтобы не учесть их дважды
+    await flushTaps();
+    
+    const { changes, serialized } = getDirtyFields();
+    if (Object.keys(changes).length === 0) return true;
+    
+    try {
+      if (isSocketOpen()) {
+        const ack = await socketRequest({ type: 'patch', changes });
+        if (ack && ack.status === 'success') {
+          Object.assign(savedState, serialized);
+          return true;
+        }
+      }
+      
+      const response = await fetch(`/user/${user.id}`, {
+        method: 'PATCH',
+        headers: {
+          'Content-Type': 'application/json'
+        },
+        body: JSON.stringify(changes)
+      });
+      
+      if (response.ok) {
+        Object.assign(savedState, serialized);
+        return true;
+      }
+      
+      if (response.status === 404) {
+        // Сервер не знает пользователя - сохраняем полностью
+        savedState = null;
+        return saveUserData();
+      }
+      
+      console.error('Error patching user data:', response.status, await response.text());
+      return false;
+    } catch (error) {
+      console.error('Error patching user data:', error);
+      return false;
+    }
+  }
+  
   // Функция для сохранения данных пользователя на сервере
 async function saveUserData() {
   if (!user) return;
   
+  // Если сервер уже знает пользователя, отправляем только изменения
+  if (savedState) {
+    return patchUserData();
+  }
+  
   try {
-    // Создаем объект для отправки на сервер, исключая поля, которых нет в БД
-    const dataToSend = {
-      id: userData.id,
-      first_name: userData.first_name,
-      last_name: userData.last_name,
-      username: userData.username,
-      photo_url: userData.photo_url,
-      score: userData.score,
-      total_clicks: userData.total_clicks,
-      level: userData.level,
-      wallet_address: userData.wallet_address,
-      wallet_task_completed: userData.wallet_task_completed,
-      channel_task_completed: userData.channel_task_completed,
-      referrals: userData.referrals,
-      energy: userData.energy,
-      last_energy_update: userData.last_energy_update,
-      last_referral_task_completion: userData.last_referral_task_completion,
-      upgrades: userData.upgrades,
-      ads_watched: userData.ads_watched,
-      achievements: userData.achievements,
-      daily_bonus: userData.daily_bonus,
-      language: userData.language,
-      last_passive_income_update: userData.last_passive_income_update,
-      last_ad_time: userData.last_ad_time
-    };
+    // Отправляем только поля профиля: счетчики и прогресс ведет сервер
+    const dataToSend = { id: userData.id };
+    SYNCED_FIELDS.forEach(field => {
+      dataToSend[field] = userData[field];
+    });
     
     console.log('Saving user data:', dataToSend);
     
@@ -3139,6 +3889,8 @@ async function saveUserData() {
         userData.active_skin = oldActiveSkin || 'default';
         userData.auto_clickers = oldAutoClickers || 0;
         
+        rememberSavedState();
+        
         console.log('User data saved successfully');
         return true;
       } else {
@@ -3165,27 +3917,19 @@ async function saveUserData() {
 
 
     
- async function updateTopData() {
-  try {
-    const response = await fetch('/top');
-    
-    if (!response.ok) {
-      throw new Error(`Ошибка сервера: ${response.status}`);
-    }
-    
-    const data = await response.json();
-    
-    if (data.users && data.users.length > 0) {
+  // Отображение полученного топа (из опроса или из WebSocket)
+  function applyTopUsers(users) {
+    if (users && users.length > 0) {
       // Проверяем, существует ли элемент topPreview перед обновлением
       const topPreview = document.getElementById('topPreview');
       if (topPreview) {
         // Обновляем превью топа (первые 3)
-        updateTopPreview(data.users.slice(0, 3));
+        updateTopPreview(users.slice(0, 3));
       }
       
       // Если текущая страница - топ, обновляем и топ
       if (document.getElementById('top').classList.contains('active')) {
-        renderTop(data.users);
+        renderTop(users);
       }
     } else {
       console.warn('No users data received');
@@ -3194,6 +3938,31 @@ async function saveUserData() {
         topPreview.innerHTML = '<div class="top-preview-item">Нет данных</div>';
       }
     }
+  }
+    
+  // ETag последнего полученного топа для условных запросов
+  let topEtag = null;
+    
+ async function updateTopData() {
+  // При открытом WebSocket сервер сам присылает обновления топа
+  if (isSocketOpen()) return;
+  
+  try {
+    const response = await fetch('/top', {
+      cache: 'no-store',
+      headers: topEtag ? { 'If-None-Match': topEtag } : {}
+    });
+    
+    // Топ не изменился - ничего не разбираем и не перерисовываем
+    if (response.status === 304) return;
+    
+    if (!response.ok) {
+      throw new Error(`Ошибка сервера: ${response.status}`);
+    }
+    
+    const data = await response.json();
+    topEtag = response.headers.get('ETag');
+    applyTopUsers(data.users);
   } catch (error) {
     console.error('Error updating top data:', error);
     const topPreview = document.getElementById('topPreview');
@@ -3295,8 +4064,7 @@ async function saveUserData() {
         document.getElementById('totalClicks').textContent = userData.total_clicks;
         
         // Получаем уровень на основе очков
-        const currentLevel = getLevelByScore(userData.score);
-        document.getElementById('userLevel').textContent = currentLanguage === 'ru' ? currentLevel.name : currentLevel.name_en;
+        document.getElementById('userLevel').textContent = getLevelName(getLevelByScore(userData.score));
         
         // Обновляем бонусы
         const clickBonus = calculateClickBonus();
@@ -3423,7 +4191,7 @@ async function loadTop() {
             <div class="top-score">
               ${user.score}
               <img class="top-coin" src="/static/FemboyCoinsPink.png" alt="монетки">
-              <span class="top-level">${user.level}</span>
+              <span class="top-level">${getLevelName(user.level)}</span>
             </div>
           </div>
         `;
@@ -3433,38 +4201,50 @@ async function loadTop() {
     }
 
     // Обновление уровня игрока
+    // Текущий уровень и его границы: пока очки внутри [start, next), таблица не нужна
+    let currentLevel = null;
+    
     function updateLevel() {
       const score = userData.score;
-      const currentLevel = getLevelByScore(score);
-      const nextLevel = getNextLevel(score);
+      
+      if (!currentLevel || (currentLevel.index > 0 && score < currentLevel.start) ||
+          (currentLevel.next !== null && score >= currentLevel.next)) {
+        const index = getLevelByScore(score);
+        currentLevel = {
+          index,
+          start: LEVELS.thresholds[index],
+          next: index + 1 < LEVELS.thresholds.length ? LEVELS.thresholds[index + 1] : null
+        };
+        userData.level = index;
+        
+        // Уровень сменился - проверяем, был ли достигнут новый
+        const storedIndex = localStorage.getItem('lastLevelIndex');
+        const lastLevelIndex = storedIndex !== null
+          ? Number(storedIndex)
+          : Math.max(LEVELS.names.indexOf(localStorage.getItem('lastLevelName')), 0);
+        if (index !== lastLevelIndex) {
+          localStorage.setItem('lastLevelIndex', index);
+          showLevelUp(getLevelName(index));
+        }
+      }
+      
+      const levelName = getLevelName(currentLevel.index);
       
       // Обновляем прогресс-бар
-      if (nextLevel) {
+      if (currentLevel.next !== null) {
         // Если есть следующий уровень
-        const currentLevelScore = currentLevel.score;
-        const nextLevelScore = nextLevel.score;
-        const progress = ((score - currentLevelScore) / (nextLevelScore - currentLevelScore)) * 100;
+        const progress = ((score - currentLevel.start) / (currentLevel.next - currentLevel.start)) * 100;
         
         document.getElementById('levelProgressBar').style.width = `${progress}%`;
-        const levelName = currentLanguage === 'ru' ? currentLevel.name : currentLevel.name_en;
-        document.getElementById('levelProgressText').textContent = `${translations[currentLanguage].level}: ${levelName} (${score - currentLevelScore}/${nextLevelScore - currentLevelScore})`;
+        document.getElementById('levelProgressText').textContent = `${translations[currentLanguage].level}: ${levelName} (${score - currentLevel.start}/${currentLevel.next - currentLevel.start})`;
       } else {
         // Если достигнут максимальный уровень
-        const levelName = currentLanguage === 'ru' ? currentLevel.name : currentLevel.name_en;
         document.getElementById('levelProgressBar').style.width = '100%';
         document.getElementById('levelProgressText').textContent = `${translations[currentLanguage].level}: ${levelName}`;
       }
       
       // Обновляем уровень в профиле
-      const profileLevelName = currentLanguage === 'ru' ? currentLevel.name : currentLevel.name_en;
-      document.getElementById('userLevel').textContent = profileLevelName;
-      
-      // Проверяем, был ли достигнут новый уровень
-      const lastLevelName = localStorage.getItem('lastLevelName') || LEVELS[0].name;
-      if (currentLevel.name !== lastLevelName) {
-        localStorage.setItem('lastLevelName', currentLevel.name);
-        showLevelUp(currentLanguage === 'ru' ? currentLevel.name : currentLevel.name_en);
-      }
+      document.getElementById('userLevel').textContent = levelName;
     }
 
     // Показать модальное окно повышения уровня
@@ -3553,13 +4333,13 @@ async function loadTop() {
     
     // Проверка задания с рефералами
     function checkReferralTask() {
-      // Убедимся, что referrals - это массив
-      if (!Array.isArray(userData.referrals)) {
-        userData.referrals = [];
+      // Число рефералов считает сервер, сам список загружается только по запросу
+      if (!userData.referral_count) {
+        userData.referral_count = 0;
       }
       
       // Обновляем счетчик рефералов
-      document.getElementById('referral-count-value').textContent = userData.referrals.length;
+      document.getElementById('referral-count-value').textContent = userData.referral_count;
       
       // Проверяем, можно ли выполнить задание
       const now = new Date();
@@ -3575,7 +4355,7 @@ async function loadTop() {
         
         // Обновляем таймер
         updateReferralTimer();
-      } else if (userData.referrals.length >= 3) {
+      } else if (userData.referral_count >= 3) {
         // Задание доступно для выполнения
         document.getElementById('referral-task-button').textContent = translations[currentLanguage].get_reward;
         document.getElementById('referral-task-button').disabled = false;
@@ -3687,27 +4467,17 @@ async function claimWalletTaskReward() {
     return;
   }
   
-  // Добавляем награду
-  userData.score += 1000;
-  userData.wallet_task_completed = true;
-  
-  console.log('Saving wallet task completion...');
-  
-  // Сохраняем данные и ждем завершения
+  // Сервер проверяет задание по сохраненному адресу кошелька
   const saved = await saveUserData();
   
-  if (saved) {
-    console.log('Wallet task saved successfully');
-    // Обновляем интерфейс только после успешного сохранения
-    updateScoreDisplay();
-    updateLevel();
-    checkWalletTask();
-    
-    // Показываем уведомление
-    showNotification(translations[currentLanguage].notification_reward.replace('{0}', '1000'));
-  } else {
-    console.error('Failed to save wallet task');
+  if (!saved) {
+    console.error('Failed to save wallet address');
     showNotification('Ошибка сохранения данных');
+    return;
+  }
+  
+  if (await claimTask('wallet_task')) {
+    checkWalletTask();
   }
 }
 
@@ -3720,33 +4490,14 @@ async function claimChannelTaskReward() {
     return;
   }
   
-  // Добавляем награду
-  userData.score += 2000;
-  userData.channel_task_completed = true;
-  
-  console.log('Saving channel task completion...');
-  
-  // Сохраняем данные и ждем завершения
-  const saved = await saveUserData();
-  
-  if (saved) {
-    console.log('Channel task saved successfully');
-    // Обновляем интерфейс только после успешного сохранения
-    updateScoreDisplay();
-    updateLevel();
+  if (await claimTask('channel_subscription')) {
     checkChannelTask();
-    
-    // Показываем уведомление
-    showNotification(translations[currentLanguage].notification_reward.replace('{0}', '2000'));
-  } else {
-    console.error('Failed to save channel task');
-    showNotification('Ошибка сохранения данных');
   }
 }
     
     // Получение награды за задание с рефералами
     async function claimReferralTaskReward() {
-      if (userData.referrals.length < 3) return;
+      if (userData.referral_count < 3) return;
       
       const now = new Date();
       const lastCompletion = userData.last_referral_task_completion ? 
@@ -3758,20 +4509,40 @@ async function claimChannelTaskReward() {
         return;
       }
       
-      // Добавляем награду
-      userData.score += 5000;
-      userData.last_referral_task_completion = now.toISOString();
-      
-      // Сохраняем данные
-      await saveUserData();
-      
-      // Обновляем интерфейс
-      updateScoreDisplay();
-      updateLevel();
-      checkReferralTask();
-      
-      // Показываем уведомление
-      showNotification(translations[currentLanguage].notification_reward.replace('{0}', '5000'));
+      if (await claimTask('referral_task')) {
+        checkReferralTask();
+      }
+    }
+    
+    // Получение награды за задание: сервер проверяет условие, ставит отметку и начисляет награду
+    async function claimTask(taskId) {
+      try {
+        const data = await postGameAction('/tasks/claim', { task_id: taskId });
+        
+        if (typeof data.wallet_task_completed === 'boolean') {
+          userData.wallet_task_completed = data.wallet_task_completed;
+          userData.channel_task_completed = data.channel_task_completed;
+          userData.last_referral_task_completion = data.last_referral_task_completion;
+        }
+        
+        if (data.status !== 'success') {
+          console.error('Task reward not claimed:', taskId, data.message);
+          showNotification(data.message || 'Ошибка при получении награды');
+          return false;
+        }
+        
+        // Обновляем интерфейс
+        updateScoreDisplay();
+        updateLevel();
+        
+        // Показываем уведомление
+        showNotification(translations[currentLanguage].notification_reward.replace('{0}', data.reward));
+        return true;
+      } catch (error) {
+        console.error('Error claiming task reward:', error);
+        showNotification('Ошибка при получении награды');
+        return false;
+      }
     }
     
     // Получение награды за задание с рекламой
@@ -3783,22 +4554,40 @@ async function claimChannelTaskReward() {
         return;
       }
       
-      // Добавляем награду
-      userData.score += 5000;
-      
-      // Сбрасываем счетчик (задание можно выполнять снова)
-      userData.ads_watched = 0;
-      
-      // Сохраняем данные
-      await saveUserData();
-      
-      // Обновляем интерфейс
-      updateScoreDisplay();
-      updateLevel();
-      checkAdsTask();
-      
-      // Показываем уведомление
-      showNotification(translations[currentLanguage].notification_reward.replace('{0}', '5000'));
+      try {
+        // Сервер сам проверяет счетчик, списывает просмотры и начисляет награду
+        const response = await fetch('/ads-reward', {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json'
+          },
+          body: JSON.stringify({
+            user_id: user.id
+          })
+        });
+        const data = await response.json();
+        
+        if (typeof data.ads_watched === 'number') {
+          userData.ads_watched = data.ads_watched;
+        }
+        
+        if (data.status === 'success') {
+          userData.score += data.reward;
+          
+          // Обновляем интерфейс
+          updateScoreDisplay();
+          updateLevel();
+          
+          // Показываем уведомление
+          showNotification(translations[currentLanguage].notification_reward.replace('{0}', data.reward));
+        } else {
+          showNotification(data.message || 'Ошибка при получении награды');
+        }
+        checkAdsTask();
+      } catch (error) {
+        console.error('Error claiming ads task reward:', error);
+        showNotification('Ошибка при получении награды');
+      }
     }
     
    function watchAds() {
@@ -3820,7 +4609,7 @@ async function claimChannelTaskReward() {
   
   // Запускаем таймер на 3 секунды
   setTimeout(() => {
-    // Увеличиваем счетчик просмотренной рекламы
+    // Счетчик и время просмотра ведет сервер по уведомлению Adsgram; здесь только отображение
     userData.ads_watched = (userData.ads_watched || 0) + 1;
     userData.last_ad_time = new Date().toISOString();
     console.log('Updated ads_watched locally:', userData.ads_watched);
@@ -3831,11 +4620,6 @@ async function claimChannelTaskReward() {
     // Показываем уведомление
     showNotification(translations[currentLanguage].notification_ad_watched);
     
-    // Сохраняем данные
-    saveUserData().catch(error => {
-      console.error('Error saving user data after ad watch:', error);
-    });
-    
     // Разблокируем кнопку
     adsTaskButton.disabled = false;
   }, 3000);
@@ -4021,6 +4805,20 @@ async function claimChannelTaskReward() {
     }
     
     // Отрисовка улучшений
+    // Картинка улучшения: плитка из спрайта под плотность экрана или исходный файл
+    function upgradeImageStyle(upgrade) {
+      const index = UPGRADE_SPRITE ? UPGRADE_SPRITE.ids.indexOf(upgrade.id) : -1;
+      if (index < 0) {
+        return `background-image: url('${upgrade.image}')`;
+      }
+      
+      const tile = UPGRADE_SPRITE.tile;
+      const pixels = tile * (window.devicePixelRatio || 1);
+      const size = UPGRADE_SPRITE.sizes.find(s => s >= pixels) || UPGRADE_SPRITE.sizes[UPGRADE_SPRITE.sizes.length - 1];
+      const url = UPGRADE_SPRITE.url.replace('{size}', size);
+      return `background-image: url('${url}'); background-size: ${tile * UPGRADE_SPRITE.ids.length}px ${tile}px; background-position: -${index * tile}px 0`;
+    }
+    
     function renderUpgrades() {
       const container = document.getElementById('upgrades-container');
       container.innerHTML = '';
@@ -4035,7 +4833,7 @@ async function claimChannelTaskReward() {
         const description = currentLanguage === 'ru' ? upgrade.description : upgrade.description_en;
         
         upgradeElement.innerHTML = `
-          <div class="upgrade-image" style="background-image: url('${upgrade.image}')"></div>
+          <div class="upgrade-image" style="${upgradeImageStyle(upgrade)}"></div>
           <div class="upgrade-description">${description}</div>
           <div class="upgrade-cost">
             <img src="/static/FemboyCoinsPink.png" alt="монетки">
@@ -4077,35 +4875,37 @@ async function claimChannelTaskReward() {
         return;
       }
       
-      // Списываем стоимость
-      userData.score -= upgrade.cost;
-      
-      // Добавляем улучшение в список купленных
-      userData.upgrades.push(upgradeId);
-      
-      // Применяем эффект улучшения
-      applyUpgradeEffect(upgrade.effect);
-      
-      // Сохраняем данные
-      await saveUserData();
-      
-      // Обновляем интерфейс
-      updateScoreDisplay();
-      updateBonuses();
-      renderUpgrades();
-      
-      // Показываем уведомление
-      showNotification(translations[currentLanguage].upgrade_purchased);
-    }
-    
-    // Применение эффекта улучшения
-    function applyUpgradeEffect(effect) {
-      if (effect.clickBonus) {
-        // Бонус за клик - эффект применяется автоматически при расчете
-        console.log('Applied click bonus upgrade');
-      } else if (effect.passiveIncome) {
-        // Пассивный доход - эффект применяется автоматически при расчете
-        console.log('Applied passive income upgrade');
+      try {
+        // Сервер сам проверяет очки, списывает стоимость и добавляет улучшение
+        const data = await postGameAction('/upgrades/purchase', { upgrade_id: upgradeId });
+        
+        if (data.status !== 'success') {
+          if (data.message === 'Upgrade already purchased') {
+            showNotification(translations[currentLanguage].upgrade_already_purchased);
+          } else if (data.message === 'Not enough coins') {
+            showNotification(translations[currentLanguage].not_enough_coins);
+          } else {
+            showNotification(data.message || 'Ошибка при покупке улучшения');
+          }
+          updateScoreDisplay();
+          return;
+        }
+        
+        // Итоги эффектов улучшений считает сервер
+        userData.upgrades = data.upgrades;
+        userData.click_bonus = data.click_bonus;
+        userData.passive_income = data.passive_income;
+        
+        // Обновляем интерфейс
+        updateScoreDisplay();
+        updateBonuses();
+        renderUpgrades();
+        
+        // Показываем уведомление
+        showNotification(translations[currentLanguage].upgrade_purchased);
+      } catch (error) {
+        console.error('Error purchasing upgrade:', error);
+        showNotification('Ошибка при покупке улучшения');
       }
     }
     
@@ -4120,32 +4920,14 @@ async function claimChannelTaskReward() {
       }
     }
     
-    // Расчет бонуса за клик
+    // Бонус за клик: итог по улучшениям считает сервер
     function calculateClickBonus() {
-      let bonus = 0;
-      
-      userData.upgrades.forEach(upgradeId => {
-        const upgrade = UPGRADES.find(u => u.id === upgradeId);
-        if (upgrade && upgrade.effect.clickBonus) {
-          bonus += upgrade.effect.clickBonus;
-        }
-      });
-      
-      return bonus;
+      return userData.click_bonus || 0;
     }
     
-    // Расчет пассивного дохода
+    // Пассивный доход: итог по улучшениям считает сервер
     function calculatePassiveIncome() {
-      let income = 0;
-      
-      userData.upgrades.forEach(upgradeId => {
-        const upgrade = UPGRADES.find(u => u.id === upgradeId);
-        if (upgrade && upgrade.effect.passiveIncome) {
-          income += upgrade.effect.passiveIncome;
-        }
-      });
-      
-      return income;
+      return userData.passive_income || 0;
     }
     
     // Обновление бонусов
@@ -4163,14 +4945,23 @@ async function claimChannelTaskReward() {
       }
     }
     
-    // Применение пассивного дохода
+ // Период начисления пассивного дохода (как на сервере)
+    const PASSIVE_INCOME_PERIOD_MS = 5000;
+    
+    // Применение пассивного дохода: только для отображения, без сохранения.
+    // Сервер начисляет тот же доход по якорю last_passive_income_update при чтении
     function applyPassiveIncome() {
       const passiveIncome = calculatePassiveIncome();
+      const anchor = userData.last_passive_income_update ? new Date(userData.last_passive_income_update).getTime() : Date.now();
+      const periods = Math.floor((Date.now() - anchor) / PASSIVE_INCOME_PERIOD_MS);
+      
+      if (periods <= 0) return;
+      
+      userData.last_passive_income_update = new Date(anchor + periods * PASSIVE_INCOME_PERIOD_MS).toISOString();
       
       if (passiveIncome > 0) {
-        userData.score += passiveIncome;
+        userData.score += passiveIncome * periods;
         updateScoreDisplay();
-        saveUserData();
         
         // Визуальный эффект получения монет
         const scoreElement = document.getElementById('score');
@@ -4246,25 +5037,11 @@ async function claimChannelTaskReward() {
         }
         
         if (isUnlocked) {
-          // Разблокируем достижение
+          // Отмечаем сразу, чтобы следующий клик не отправил достижение повторно
           userData.achievements.push(achievement.id);
           
-          // Добавляем награду
-          userData.score += achievement.reward;
-          
-          // Сохраняем данные
-          saveUserData();
-          
-          // Обновляем интерфейс
-          updateScoreDisplay();
-          updateLevel();
-          updateAchievements();
-          
-          // Получаем название в зависимости от языка
-          const name = currentLanguage === 'ru' ? achievement.name : achievement.name_en;
-          
-          // Показываем уведомление
-          showNotification(translations[currentLanguage].notification_achievement.replace('{0}', name));
+          // Сервер проверяет условие сам и начисляет награду вместе с достижением
+          saveAchievement(achievement);
         }
       });
     }
@@ -4325,6 +5102,38 @@ async function claimChannelTaskReward() {
       }
     }
     
+    // Сохранение разблокированного достижения (сервер добавляет его и награду атомарно)
+    async function saveAchievement(achievement) {
+      try {
+        const data = await postGameAction('/achievements', { achievement_id: achievement.id });
+        
+        if (data.status !== 'success') {
+          console.error('Error saving achievement:', data.message);
+          // Сервер не подтвердил условие: проверим еще раз позже
+          userData.achievements = userData.achievements.filter(id => id !== achievement.id);
+          return;
+        }
+        
+        userData.achievements = data.achievements;
+        
+        // Обновляем интерфейс
+        updateScoreDisplay();
+        updateLevel();
+        updateAchievements();
+        
+        if (data.added) {
+          // Получаем название в зависимости от языка
+          const name = currentLanguage === 'ru' ? achievement.name : achievement.name_en;
+          
+          // Показываем уведомление
+          showNotification(translations[currentLanguage].notification_achievement.replace('{0}', name));
+        }
+      } catch (error) {
+        console.error('Error saving achievement:', error);
+        userData.achievements = userData.achievements.filter(id => id !== achievement.id);
+      }
+    }
+    
     // Получение ежедневного бонуса
     async function claimDailyBonus() {
       try {
@@ -4401,7 +5210,7 @@ async function claimChannelTaskReward() {
       
       // Обновляем тексты в профиле
       document.querySelector('.profile-stats p:nth-child(1)').innerHTML = `${translations[currentLanguage].collected_coins}: <span id="profileScore">${userData.score}</span>`;
-      document.querySelector('.profile-stats p:nth-child(2)').innerHTML = `${translations[currentLanguage].femboy_level}: <span id="userLevel">${getLevelByScore(userData.score).name}</span>`;
+      document.querySelector('.profile-stats p:nth-child(2)').innerHTML = `${translations[currentLanguage].femboy_level}: <span id="userLevel">${getLevelName(getLevelByScore(userData.score))}</span>`;
       document.querySelector('.profile-stats p:nth-child(3)').innerHTML = `${translations[currentLanguage].total_clicks}: <span id="totalClicks">${userData.total_clicks}</span>`;
       document.querySelector('.profile-stats p:nth-child(4)').innerHTML = `${translations[currentLanguage].click_bonus}: <span id="clickBonus">${calculateClickBonus()}</span>`;
       document.querySelector('.profile-stats p:nth-child(5)').innerHTML = `${translations[currentLanguage].passive_income}: <span id="passiveIncomeStat">${calculatePassiveIncome()}</span>/5 сек`;
@@ -4556,20 +5365,27 @@ async function claimChannelTaskReward() {
       });
       
       // Обработчик кнопки результата
-      document.getElementById('minigame-result-button').addEventListener('click', function() {
+      document.getElementById('minigame-result-button').addEventListener('click', async function() {
         // Закрываем мини-игру
         minigameContainer.classList.remove('active');
         
-        // Начисляем награду
-        const minigame = MINIGAMES.find(m => m.id === 'catch_coins');
-        const reward = Math.min(score, minigame.reward);
-        
-        userData.score += reward;
-        updateScoreDisplay();
-        saveUserData();
-        
-        // Показываем уведомление
-        showNotification(translations[currentLanguage].notification_minigame_reward.replace('{0}', reward));
+        try {
+          // Награду начисляет сервер, не больше награды из каталога
+          const data = await postGameAction('/minigame', { minigame_id: 'catch_coins', coins: score });
+          
+          if (data.status !== 'success') {
+            console.error('Minigame reward not claimed:', data.message);
+            return;
+          }
+          
+          updateScoreDisplay();
+          updateLevel();
+          
+          // Показываем уведомление
+          showNotification(translations[currentLanguage].notification_minigame_reward.replace('{0}', data.reward));
+        } catch (error) {
+          console.error('Error claiming minigame reward:', error);
+        }
       });
     }
 
@@ -4589,14 +5405,14 @@ async function claimChannelTaskReward() {
             userData.score += 1 + clickBonus;
             userData.total_clicks++;
             
+            // Клик уйдет на сервер в ближайшем пакете
+            queueTap(1 + clickBonus);
+            
             // Обновляем отображение
             updateScoreDisplay();
             updateEnergyDisplay();
             updateLevel();
             
-            // Сохраняем данные
-            saveUserData();
-            
             // Проверяем достижения
             checkNewAchievements();
           }
@@ -4628,7 +5444,113 @@ async function claimChannelTaskReward() {
     const imgNormal = "/static/Photo_femb_static.jpg";
     const imgActive = "https://i.pinimg.com/736x/88/b3/b6/88b3b6e1175123e5c990931067c4b055.jpg";
 
-   let isProcessingClick = false;
+    // Пакетная отправка кликов: сервер сам начисляет очки и тратит энергию
+    const TAP_FLUSH_INTERVAL = 1000;
+    const tapSession = Math.random().toString(36).slice(2);
+    let tapSeq = 0;
+    let pendingTaps = 0;
+    let pendingTapScore = 0;
+    let tapWindowStart = Date.now();
+    let tapFlushPromise = null;
+
+    function queueTap(scoreIncrease) {
+      if (pendingTaps === 0) {
+        tapWindowStart = Date.now();
+      }
+      pendingTaps++;
+      pendingTapScore += scoreIncrease;
+    }
+
+    // Награды и покупки: сервер проверяет условие и меняет очки сам.
+    // Сначала отправляем накопленные клики, чтобы проверка шла по актуальному счету
+    async function postGameAction(path, body) {
+      await flushTaps();
+      
+      const response = await fetch(path, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ user_id: user.id, ...body })
+      });
+      const data = await response.json();
+      
+      // Счет сервера плюс клики, сделанные пока запрос был в пути
+      if (typeof data.score === 'number') {
+        userData.score = data.score + pendingTapScore;
+      }
+      return data;
+    }
+    
+    // Отправляет накопленные клики; параллельно выполняется не больше одного запроса
+    async function flushTaps() {
+      if (tapFlushPromise) {
+        await tapFlushPromise;
+      }
+      if (!user || pendingTaps === 0) return;
+      
+      tapFlushPromise = sendTaps();
+      try {
+        await tapFlushPromise;
+      } finally {
+        tapFlushPromise = null;
+      }
+    }
+
+    async function sendTaps() {
+      const taps = pendingTaps;
+      const tapScore = pendingTapScore;
+      const windowMs = Date.now() - tapWindowStart;
+      pendingTaps = 0;
+      pendingTapScore = 0;
+      tapSeq++;
+      
+      const batch = {
+        taps: taps,
+        window_ms: windowMs,
+        seq: tapSeq,
+        session: tapSession
+      };
+      
+      try {
+        // По WebSocket, если соединение открыто, иначе обычным запросом
+        let data = isSocketOpen() ? await socketRequest({ type: 'taps', ...batch }) : null;
+        
+        if (!data || data.status !== 'success') {
+          const response = await fetch('/taps', {
+            method: 'POST',
+            headers: {
+              'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ user_id: user.id, ...batch })
+          });
+          
+          if (!response.ok) {
+            throw new Error(`Ошибка сервера: ${response.status}`);
+          }
+          
+          data = await response.json();
+        }
+        
+        // Состояние сервера плюс клики, сделанные пока запрос был в пути
+        userData.score = data.score + pendingTapScore;
+        userData.total_clicks = data.total_clicks + pendingTaps;
+        userData.energy = Math.max(0, data.energy - pendingTaps);
+        userData.last_energy_update = data.last_energy_update;
+        userData.last_passive_income_update = data.last_passive_income_update;
+        userData.click_bonus = data.click_bonus;
+        userData.passive_income = data.passive_income;
+        
+        updateScoreDisplay();
+        updateEnergyDisplay();
+        updateLevel();
+      } catch (error) {
+        console.error('Error sending taps:', error);
+        // Возвращаем клики в очередь, чтобы отправить их со следующим пакетом
+        pendingTaps += taps;
+        pendingTapScore += tapScore;
+      }
+    }
 
 function incrementScore() {
   // Проверяем, достаточно ли энергии
@@ -4637,31 +5559,17 @@ function incrementScore() {
     return;
   }
   
-  // Защита от множественных одновременных кликов
-  if (isProcessingClick) {
-    return;
-  }
-  
-  isProcessingClick = true;
-  
   // Тратим энергию
   userData.energy--;
   
   // Рассчитываем бонус за клик
   const clickBonus = calculateClickBonus();
   
-  // Проверяем активные бусты
-  let scoreMultiplier = 1;
-  userData.active_boosts.forEach(boost => {
-    if (boost.type === 'score_multiplier') {
-      scoreMultiplier *= boost.multiplier;
-    }
-  });
-  
-  // Увеличиваем счет с учетом бонуса и бустов
-  const scoreIncrease = Math.floor((1 + clickBonus) * scoreMultiplier);
+  // Увеличиваем счет с учетом бонуса (сервер подтвердит при отправке пакета)
+  const scoreIncrease = 1 + clickBonus;
   userData.score += scoreIncrease;
   userData.total_clicks++;
+  queueTap(scoreIncrease);
   
   // Создаем эффект молнии
   createLightning();
@@ -4671,11 +5579,6 @@ function incrementScore() {
   updateEnergyDisplay();
   updateLevel();
   
-  // Сохраняем данные на сервере после каждого клика
-  saveUserData().finally(() => {
-    isProcessingClick = false;
-  });
-  
   // Проверяем достижения
   checkNewAchievements();
 }
@@ -4750,11 +5653,16 @@ function incrementScore() {
       // Инициализируем Adsgram с вашим UnitID
       initAdsgram();
       
+      // Таблицы игры нужны до первого расчета уровня
+      await loadConfig();
+      
       // Загружаем данные пользователя при запуске
       if (user) {
         await loadUserData();
         // Обрабатываем реферальный параметр
         await processReferralParam();
+        // Открываем постоянное соединение с сервером
+        connectSocket();
       }
       
       // Обработчик для кнопок меню
@@ -4811,7 +5719,7 @@ function incrementScore() {
       
       // Обработчики для задания с рефералами
       document.getElementById('referral-task-button').addEventListener('click', function() {
-        if (userData.referrals.length >= 3) {
+        if (userData.referral_count >= 3) {
           claimReferralTaskReward();
         } else {
           openReferralTaskModal();
@@ -4908,8 +5816,11 @@ function incrementScore() {
       // Устанавливаем интервал для обновления энергии каждую секунду
       setInterval(updateEnergy, 1000);
       
-      // Устанавливаем интервал для пассивного дохода каждые 5 секунд
-      setInterval(applyPassiveIncome, 5000);
+      // Обновляем отображение пассивного дохода (без запросов к серверу)
+      setInterval(applyPassiveIncome, 1000);
+      
+      // Отправляем накопленные клики пакетом раз в секунду
+      setInterval(flushTaps, TAP_FLUSH_INTERVAL);
       
       // Устанавливаем интервал для проверки блокировки кнопки рекламы каждую секунду
       setInterval(checkAdsTask, 1000);
@@ -4923,9 +5834,23 @@ function incrementScore() {
 </html>
 """
 
+# Стили и скрипт страницы выносятся в /static/app.<hash>.css/js, в HTML остается оболочка.
+# Если каталог статики недоступен для записи, отдаем страницу целиком, как раньше
+try:
+    html_shell, page_assets = build_assets(html_content, STATIC_DIR, file_cache=static_file_cache)
+except OSError as e:
+    logger.error(f"Error building page assets, serving inline page: {e}")
+    html_shell, page_assets = html_content, {}
+page_asset_bodies.update({name: CompressedBody(content) for name, content in page_assets.items()})
+html_shell_body = CompressedBody(html_shell.encode("utf-8"))
+html_shell_etag = f'"{hashlib.blake2b(html_shell_body.body, digest_size=8).hexdigest()}"'
+
 @app.get("/", response_class=HTMLResponse)
-async def root():
-    return HTMLResponse(content=html_content)
+async def root(request: Request):
+    # Оболочка перепроверяется при каждом открытии, ресурсы по ссылкам берутся из кэша
+    headers = {"ETag": html_shell_etag, "Cache-Control": "no-cache"}
+    return html_shell_body.response(request.headers.get("accept-encoding"), "text/html; charset=utf-8", headers,
+                                    if_none_match=request.headers.get("if-none-match"))
 
 @app.get("/tonconnect-manifest.json")
 async def tonconnect_manifest():
@@ -4936,7 +5861,35 @@ async def tonconnect_manifest():
         "termsOfUseUrl": "https://tofemb.onrender.com/terms",
         "privacyPolicyUrl": "https://tofemb.onrender.com/privacy"
     }
-    return JSONResponse(content=manifest)
+    return FastJSONResponse(content=manifest)
+
+# Миниатюры картинок улучшений (собираются tools/build_thumbnails.py)
+thumbnails = ThumbnailManifest(STATIC_DIR)
+
+# Игровые таблицы для клиента: сериализуются один раз при старте, клиент хранит
+# их в localStorage и перепроверяет по ETag
+game_config = {"levels": LEVEL_TABLE.to_config(), "upgrade_sprite": thumbnails.sprite_config("upgrades")}
+config_body = CompressedBody(dumps(game_config))
+config_etag = f'"{hashlib.blake2b(config_body.body, digest_size=8).hexdigest()}"'
+
+@app.get("/config")
+async def get_config(request: Request):
+    """Таблица уровней (пороги и названия) и спрайт миниатюр улучшений"""
+    headers = {"ETag": config_etag, "Cache-Control": "no-cache"}
+    return config_body.response(request.headers.get("accept-encoding"), "application/json", headers,
+                                if_none_match=request.headers.get("if-none-match"))
+
+@app.get("/img/{name}")
+async def get_thumbnail(name: str, request: Request):
+    """Миниатюра в лучшем формате, который принимает клиент (AVIF, WebP или PNG)"""
+    path = thumbnails.select(name, request.headers.get("accept"))
+    if path is None or not path.exists():
+        return FastJSONResponse(content={"status": "error", "message": "Image not found"}, status_code=404)
+    # Навсегда кэшируется только ответ на URL с текущей версией манифеста (?v=...):
+    # без версии или со старой версией под тем же URL позже окажется другой файл
+    versioned = bool(thumbnails.version) and request.query_params.get("v") == thumbnails.version
+    cache_control = IMMUTABLE_CACHE_CONTROL if versioned else REVALIDATE_CACHE_CONTROL
+    return FileResponse(path, headers={"Vary": "Accept", "Cache-Control": cache_control})
 
 # Добавим эндпоинты для страниц условий использования и политики конфиденциальности
 @app.get("/terms", response_class=HTMLResponse)
@@ -4998,47 +5951,19 @@ async def get_user_data(user_id: str):
     """Получение данных пользователя по ID"""
     try:
         logger.info(f"GET /user/{user_id} endpoint called")
-        user_data = load_user(user_id)
+        user = await load_user(user_id, with_profile=True)
         
-        if user_data:
-            # Преобразуем данные для фронтенда
-            response_data = {
-                "id": user_data["user_id"],
-                "first_name": user_data["first_name"],
-                "last_name": user_data["last_name"],
-                "username": user_data["username"],
-                "photo_url": user_data["photo_url"],
-                "score": user_data["score"],
-                "total_clicks": user_data["total_clicks"],
-                "level": user_data["level"],
-                "wallet_address": user_data["wallet_address"],
-                "wallet_task_completed": user_data["wallet_task_completed"],
-                "channel_task_completed": user_data["channel_task_completed"],
-                "referrals": user_data["referrals"],
-                "last_referral_task_completion": user_data["last_referral_task_completion"],
-                "energy": user_data["energy"],
-                "last_energy_update": user_data["last_energy_update"],
-                "upgrades": user_data["upgrades"],
-                "ads_watched": user_data["ads_watched"],
-                "achievements": user_data["achievements"],
-                "daily_bonus": user_data["daily_bonus"],
-                "active_boosts": user_data["active_boosts"],
-                "skins": user_data["skins"],
-                "active_skin": user_data["active_skin"],
-                "auto_clickers": user_data["auto_clickers"],
-                "language": user_data["language"],
-                "last_passive_income_update": user_data["last_passive_income_update"],
-                "last_ad_time": user_data["last_ad_time"]
-            }
-            
-            logger.info(f"Returning user data for {user_data['first_name']}")
-            return JSONResponse(content={"user": response_data})
+        if user:
+            logger.info(f"Returning user data for {user.first_name}")
+            return FastJSONResponse(content={"user": user.to_response()})
         else:
             logger.info(f"User not found with ID {user_id}")
-            return JSONResponse(content={"status": "error", "message": "User not found"}, status_code=404)
+            return FastJSONResponse(content={"status": "error", "message": "User not found"}, status_code=404)
+    except CircuitOpenError as e:
+        return storage_unavailable_response(e)
     except Exception as e:
         logger.error(f"Error in /user/{user_id}: {e}")
-        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
 
 @app.post("/user")
 async def save_user_data(request: Request):
@@ -5047,62 +5972,85 @@ async def save_user_data(request: Request):
         logger.info(f"POST /user endpoint called")
         data = await request.json()
         
-        # Логируем ключевые поля
-        logger.info(f"Saving data for user {data.get('id')}:")
-        logger.info(f"  wallet_task_completed: {data.get('wallet_task_completed')}")
-        logger.info(f"  channel_task_completed: {data.get('channel_task_completed')}")
-        logger.info(f"  score: {data.get('score')}")
+        logger.info(f"Saving data for user {data.get('id')}")
         
         # Сохраняем в базу данных
-        success = save_user(data)
+        success = await save_user(data)
         
         if success:
             # Получаем обновленные данные
             user_id = str(data.get('id'))
-            user_data = load_user(user_id)
+            user = await load_user(user_id, with_profile=True)
             
-            if user_data:
-                # Преобразуем данные для фронтенда
-                response_data = {
-                    "id": user_data["user_id"],
-                    "first_name": user_data["first_name"],
-                    "last_name": user_data["last_name"],
-                    "username": user_data["username"],
-                    "photo_url": user_data["photo_url"],
-                    "score": user_data["score"],
-                    "total_clicks": user_data["total_clicks"],
-                    "level": user_data["level"],
-                    "wallet_address": user_data["wallet_address"],
-                    "wallet_task_completed": user_data["wallet_task_completed"],
-                    "channel_task_completed": user_data["channel_task_completed"],
-                    "referrals": user_data["referrals"],
-                    "last_referral_task_completion": user_data["last_referral_task_completion"],
-                    "energy": user_data["energy"],
-                    "last_energy_update": user_data["last_energy_update"],
-                    "upgrades": user_data["upgrades"],
-                    "ads_watched": user_data["ads_watched"],
-                    "achievements": user_data["achievements"],
-                    "daily_bonus": user_data["daily_bonus"],
-                    "active_boosts": user_data["active_boosts"],
-                    "skins": user_data["skins"],
-                    "active_skin": user_data["active_skin"],
-                    "auto_clickers": user_data["auto_clickers"],
-                    "language": user_data["language"],
-                    "last_passive_income_update": user_data["last_passive_income_update"],
-                    "last_ad_time": user_data["last_ad_time"]
-                }
-                
-                logger.info(f"User saved successfully: {user_data['first_name']}")
-                return JSONResponse(content={"status": "success", "user": response_data})
+            if user:
+                logger.info(f"User saved successfully: {user.first_name}")
+                # Новый игрок попадает в рейтинг сразу, а не после первого клика
+                leaderboard.update(user_id, user.to_row(LEADERBOARD_COLUMNS))
+                return FastJSONResponse(content={"status": "success", "user": user.to_response()})
             else:
                 logger.info(f"Failed to retrieve saved user")
-                return JSONResponse(content={"status": "error", "message": "Failed to retrieve saved user"}, status_code=500)
+                return FastJSONResponse(content={"status": "error", "message": "Failed to retrieve saved user"}, status_code=500)
         else:
             logger.info(f"Failed to save user")
-            return JSONResponse(content={"status": "error", "message": "Failed to save user"}, status_code=500)
+            return FastJSONResponse(content={"status": "error", "message": "Failed to save user"}, status_code=500)
+    except (CircuitOpenError, WriteBufferFull) as e:
+        return storage_unavailable_response(e)
     except Exception as e:
         logger.error(f"Error in POST /user: {e}")
-        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+@app.patch("/user/{user_id}")
+async def patch_user_data(user_id: str, request: Request):
+    """Частичное сохранение: клиент присылает только измененные поля"""
+    try:
+        logger.info(f"PATCH /user/{user_id} endpoint called")
+        data = await request.json()
+        
+        if not isinstance(data, dict):
+            return FastJSONResponse(content={"status": "error", "message": "Invalid data"}, status_code=400)
+        
+        result = await patch_user(user_id, data)
+        
+        if result["status"] == "success":
+            return FastJSONResponse(content=result)
+        elif result["message"] == "User not found":
+            return FastJSONResponse(content=result, status_code=404)
+        elif result["message"] == "Invalid data":
+            return FastJSONResponse(content=result, status_code=400)
+        else:
+            return FastJSONResponse(content=result, status_code=500)
+    except Exception as e:
+        logger.error(f"Error in PATCH /user/{user_id}: {e}")
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+@app.post("/taps")
+async def post_taps(request: Request):
+    """Пакет кликов: количество, окно времени и номер пакета клиента"""
+    try:
+        data = await request.json()
+        user_id = data.get('user_id')
+        
+        if not user_id:
+            return FastJSONResponse(content={"status": "error", "message": "Missing user_id"}, status_code=400)
+        
+        try:
+            taps = int(data.get('taps', 0))
+            window_ms = int(data.get('window_ms', 0))
+            seq = int(data.get('seq', 0))
+        except (TypeError, ValueError):
+            return FastJSONResponse(content={"status": "error", "message": "Invalid data"}, status_code=400)
+        
+        result = await apply_taps(str(user_id), taps, window_ms, seq, str(data.get('session', '')))
+        
+        if result["status"] == "success":
+            return FastJSONResponse(content=result)
+        elif result["message"] == "User not found":
+            return FastJSONResponse(content=result, status_code=404)
+        else:
+            return FastJSONResponse(content=result, status_code=500)
+    except Exception as e:
+        logger.error(f"Error in POST /taps: {e}")
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
 
 @app.post("/referral")
 async def handle_referral(request: Request):
@@ -5114,47 +6062,230 @@ async def handle_referral(request: Request):
         referred_id = str(data.get('referred_id'))
         
         if referrer_id and referred_id and referrer_id != referred_id:
-            success = add_referral(referrer_id, referred_id)
+            success = await add_referral(referrer_id, referred_id)
             
             if success:
                 logger.info(f"Referral added successfully: {referrer_id} -> {referred_id}")
-                return JSONResponse(content={"status": "success"})
+                return FastJSONResponse(content={"status": "success"})
             else:
                 logger.info(f"Failed to add referral")
-                return JSONResponse(content={"status": "error", "message": "Failed to add referral"})
+                return FastJSONResponse(content={"status": "error", "message": "Failed to add referral"})
         else:
             logger.info(f"Invalid referral data")
-            return JSONResponse(content={"status": "error", "message": "Invalid data"})
+            return FastJSONResponse(content={"status": "error", "message": "Invalid data"})
     except Exception as e:
         logger.error(f"Error in POST /referral: {e}")
-        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+@app.get("/referrals/{user_id}")
+async def get_user_referrals(user_id: str, limit: int = 20, offset: int = 0):
+    """Число рефералов и страница их списка"""
+    try:
+        limit = min(max(limit, 1), MAX_REFERRALS_PAGE)
+        offset = max(offset, 0)
+        
+        # Нужно только число рефералов, поэтому не читаем всю запись
+        user_data = await load_user_fields(user_id, REFERRAL_COUNT_COLUMNS)
+        if not user_data:
+            return FastJSONResponse(content={"status": "error", "message": "User not found"}, status_code=404)
+        
+        referrals = await get_referrals(user_id, limit, offset)
+        return FastJSONResponse(content={
+            "status": "success",
+            "referral_count": user_data["referral_count"] or 0,
+            "referrals": referrals,
+            "next_offset": offset + len(referrals) if len(referrals) == limit else None
+        })
+    except CircuitOpenError as e:
+        return storage_unavailable_response(e)
+    except Exception as e:
+        logger.error(f"Error in /referrals/{user_id}: {e}")
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+# Строка топа для фронтенда: (ключ в JSON, колонка записи рейтинга)
+TOP_USER_ENCODER = RecordEncoder((
+    ("id", "user_id"), ("first_name", "first_name"), ("last_name", "last_name"), ("username", "username"),
+    ("photo_url", "photo_url"), ("score", "score"), ("level", "level"),
+), items=True)
+
+# Преобразование топа пользователей для фронтенда
+def format_top_users(top_users: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return TOP_USER_ENCODER.to_list(top_users)
+
+# Готовый ответ /top: JSON сериализуется и сжимается один раз на изменение рейтинга.
+# version растет при каждом изменении содержимого, etag - хэш тела ответа
+top_snapshot: Dict[str, Any] = {"source_version": None, "version": 0, "body": b"", "compressed": CompressedBody(b""), "etag": ""}
+
+async def get_top_snapshot() -> Dict[str, Any]:
+    # Рейтинг не менялся с последней сериализации - отдаем готовые байты
+    if leaderboard.ready and top_snapshot["source_version"] == leaderboard.version:
+        return top_snapshot
+    
+    source_version = leaderboard.version if leaderboard.ready else None
+    users = format_top_users(await get_top_users())
+    body = dumps({"users": users})
+    etag = f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+    
+    # Изменения за пределами топа не меняют тело ответа и его версию
+    if etag != top_snapshot["etag"]:
+        # Топ меняется часто, поэтому сжатие быстрее максимального
+        compressed = CompressedBody(body, brotli_quality=5, gzip_level=6)
+        top_snapshot.update(version=top_snapshot["version"] + 1, body=body, compressed=compressed, etag=etag)
+    top_snapshot["source_version"] = source_version
+    return top_snapshot
 
 @app.get("/top")
-async def get_top_users_endpoint():
+async def get_top_users_endpoint(request: Request):
     """Получение топа пользователей"""
     try:
-        logger.info(f"GET /top endpoint called")
-        top_users = get_top_users()
-        logger.info(f"Got {len(top_users)} top users from Supabase")
-        
-        # Преобразуем данные для фронтенда
-        response_users = []
-        for user in top_users:
-            response_users.append({
-                "id": user["user_id"],
-                "first_name": user["first_name"],
-                "last_name": user["last_name"],
-                "username": user["username"],
-                "photo_url": user["photo_url"],
-                "score": user["score"],
-                "level": user["level"]
-            })
+        snapshot = await get_top_snapshot()
+        headers = {
+            "ETag": snapshot["etag"],
+            "Cache-Control": "no-cache",
+            "X-Top-Version": str(snapshot["version"])
+        }
         
-        logger.info(f"Returning {len(response_users)} top users")
-        return JSONResponse(content={"users": response_users})
+        # Топ не изменился - CompressedBody отвечает 304 без тела
+        return snapshot["compressed"].response(request.headers.get("accept-encoding"), "application/json", headers,
+                                               if_none_match=request.headers.get("if-none-match"))
     except Exception as e:
         logger.error(f"Error in GET /top: {e}")
-        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+# Максимальное число соседей сверху и снизу в окне рейтинга
+MAX_AROUND_RADIUS = 50
+
+@app.get("/rank/{user_id}")
+async def get_user_rank(user_id: str):
+    """Место игрока в общем рейтинге"""
+    try:
+        if not leaderboard.ready:
+            return FastJSONResponse(content={"status": "error", "message": "Leaderboard is loading"}, status_code=503)
+        
+        rank = leaderboard.rank(user_id)
+        
+        if rank is None:
+            return FastJSONResponse(content={"status": "error", "message": "User not found"}, status_code=404)
+        
+        return FastJSONResponse(content={
+            "id": user_id,
+            "rank": rank,
+            "score": leaderboard.get_score(user_id),
+            "total": len(leaderboard)
+        })
+    except Exception as e:
+        logger.error(f"Error in GET /rank/{user_id}: {e}")
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+@app.get("/top/around/{user_id}")
+async def get_top_around_user(user_id: str, radius: int = 5):
+    """Окно рейтинга вокруг игрока: radius соседей выше и ниже"""
+    try:
+        if not leaderboard.ready:
+            return FastJSONResponse(content={"status": "error", "message": "Leaderboard is loading"}, status_code=503)
+        
+        radius = min(max(radius, 0), MAX_AROUND_RADIUS)
+        neighbours = leaderboard.around(user_id, radius)
+        
+        if not neighbours:
+            return FastJSONResponse(content={"status": "error", "message": "User not found"}, status_code=404)
+        
+        users = format_top_users(neighbours)
+        for user, neighbour in zip(users, neighbours):
+            user["rank"] = neighbour["rank"]
+        
+        return FastJSONResponse(content={
+            "rank": leaderboard.rank(user_id),
+            "total": len(leaderboard),
+            "users": users
+        })
+    except Exception as e:
+        logger.error(f"Error in GET /top/around/{user_id}: {e}")
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+# WebSocket-соединения игроков и рассылка топа
+ws_manager = ConnectionManager()
+TOP_PUSH_INTERVAL = 3
+
+# Последний разосланный топ, чтобы не отправлять одинаковые обновления
+latest_top_message: Optional[str] = None
+
+async def build_top_message() -> str:
+    # Используем уже сериализованный топ: {"users": [...]} -> {"type": "top", "users": [...]}
+    snapshot = await get_top_snapshot()
+    return '{"type":"top",' + snapshot["body"][1:].decode("utf-8")
+
+async def push_top_updates():
+    """Один запрос топа на всех подключенных игроков вместо опроса каждым клиентом"""
+    global latest_top_message
+    while True:
+        await asyncio.sleep(TOP_PUSH_INTERVAL)
+        if len(ws_manager) == 0:
+            continue
+        try:
+            message = await build_top_message()
+            if message != latest_top_message:
+                latest_top_message = message
+                await ws_manager.broadcast(message)
+        except Exception as e:
+            logger.error(f"Error pushing top updates: {e}")
+
+# Обработка одного сообщения от клиента
+async def handle_ws_message(user_id: str, message: Dict[str, Any]) -> Dict[str, Any]:
+    message_type = message.get("type")
+    
+    if message_type == "taps":
+        return await apply_taps(
+            user_id,
+            int(message.get("taps", 0)),
+            int(message.get("window_ms", 0)),
+            int(message.get("seq", 0)),
+            str(message.get("session", ""))
+        )
+    elif message_type == "patch":
+        changes = message.get("changes")
+        if not isinstance(changes, dict):
+            return {"status": "error", "message": "Invalid data"}
+        return await patch_user(user_id, changes)
+    elif message_type == "ping":
+        return {"status": "success"}
+    else:
+        return {"status": "error", "message": f"Unknown message type: {message_type}"}
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    """Постоянное соединение игрока: действия вверх, подтверждения и топ вниз"""
+    user_id = websocket.query_params.get("user_id")
+    
+    if not user_id:
+        await websocket.close(code=1008)
+        return
+    
+    await ws_manager.connect(user_id, websocket)
+    
+    try:
+        # Сразу отправляем текущий топ, дальше он приходит при изменениях
+        await websocket.send_text(latest_top_message or await build_top_message())
+        
+        while True:
+            text = await websocket.receive_text()
+            
+            try:
+                message = loads(text)
+                response = await handle_ws_message(user_id, message)
+            except (ValueError, TypeError, AttributeError) as e:
+                message = {}
+                response = {"status": "error", "message": f"Invalid message: {e}"}
+            
+            response["type"] = f"{message.get('type', 'error')}_ack"
+            response["id"] = message.get("id")
+            await websocket.send_text(dumps_text(response))
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Error in WebSocket for user {user_id}: {e}")
+    finally:
+        ws_manager.disconnect(user_id, websocket)
 
 @app.post("/daily-bonus")
 async def claim_daily_bonus_endpoint(request: Request):
@@ -5165,19 +6296,126 @@ async def claim_daily_bonus_endpoint(request: Request):
         user_id = data.get('user_id')
         
         if not user_id:
-            return JSONResponse(content={"status": "error", "message": "Missing user_id"}, status_code=400)
+            return FastJSONResponse(content={"status": "error", "message": "Missing user_id"}, status_code=400)
         
-        result = claim_daily_bonus(user_id)
+        result = await claim_daily_bonus(user_id)
         
         if result["status"] == "success":
             logger.info(f"Daily bonus claimed successfully for user {user_id}")
-            return JSONResponse(content=result)
+            return FastJSONResponse(content=result)
         else:
             logger.info(f"Failed to claim daily bonus for user {user_id}: {result['message']}")
-            return JSONResponse(content=result, status_code=400)
+            return FastJSONResponse(content=result, status_code=400)
     except Exception as e:
         logger.error(f"Error in POST /daily-bonus: {e}")
-        return JSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+@app.post("/ads-reward")
+async def claim_ad_reward_endpoint(request: Request):
+    """Получение награды за задание с рекламой"""
+    try:
+        logger.info(f"POST /ads-reward endpoint called")
+        data = await request.json()
+        user_id = data.get('user_id')
+        
+        if not user_id:
+            return FastJSONResponse(content={"status": "error", "message": "Missing user_id"}, status_code=400)
+        
+        result = await claim_ad_reward(str(user_id))
+        
+        if result["status"] == "success":
+            return FastJSONResponse(content=result)
+        elif result["message"] == "User not found":
+            return FastJSONResponse(content=result, status_code=404)
+        else:
+            return FastJSONResponse(content=result, status_code=400)
+    except Exception as e:
+        logger.error(f"Error in POST /ads-reward: {e}")
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+@app.post("/achievements")
+async def add_achievement_endpoint(request: Request):
+    """Сохранение разблокированного достижения"""
+    try:
+        logger.info(f"POST /achievements endpoint called")
+        data = await request.json()
+        user_id = data.get('user_id')
+        achievement_id = data.get('achievement_id')
+        
+        if not user_id or not isinstance(achievement_id, str) or not achievement_id:
+            return FastJSONResponse(content={"status": "error", "message": "Invalid data"}, status_code=400)
+        
+        result = await add_achievement(str(user_id), achievement_id)
+        return FastJSONResponse(content=result, status_code=game_action_status(result))
+    except Exception as e:
+        logger.error(f"Error in POST /achievements: {e}")
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+@app.post("/tasks/claim")
+async def claim_task_reward_endpoint(request: Request):
+    """Получение награды за задание"""
+    try:
+        logger.info(f"POST /tasks/claim endpoint called")
+        data = await request.json()
+        user_id = data.get('user_id')
+        task_id = data.get('task_id')
+        
+        if not user_id or not isinstance(task_id, str) or not task_id:
+            return FastJSONResponse(content={"status": "error", "message": "Invalid data"}, status_code=400)
+        
+        result = await claim_task_reward(str(user_id), task_id)
+        return FastJSONResponse(content=result, status_code=game_action_status(result))
+    except Exception as e:
+        logger.error(f"Error in POST /tasks/claim: {e}")
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+@app.post("/upgrades/purchase")
+async def purchase_upgrade_endpoint(request: Request):
+    """Покупка улучшения"""
+    try:
+        logger.info(f"POST /upgrades/purchase endpoint called")
+        data = await request.json()
+        user_id = data.get('user_id')
+        upgrade_id = data.get('upgrade_id')
+        
+        if not user_id or not isinstance(upgrade_id, str) or not upgrade_id:
+            return FastJSONResponse(content={"status": "error", "message": "Invalid data"}, status_code=400)
+        
+        result = await purchase_upgrade(str(user_id), upgrade_id)
+        return FastJSONResponse(content=result, status_code=game_action_status(result))
+    except Exception as e:
+        logger.error(f"Error in POST /upgrades/purchase: {e}")
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
+
+@app.post("/minigame")
+async def claim_minigame_reward_endpoint(request: Request):
+    """Награда за мини-игру: монетки, собранные клиентом, но не больше награды из каталога"""
+    try:
+        logger.info(f"POST /minigame endpoint called")
+        data = await request.json()
+        user_id = data.get('user_id')
+        minigame_id = data.get('minigame_id')
+        
+        try:
+            coins = int(data.get('coins', 0))
+        except (TypeError, ValueError):
+            return FastJSONResponse(content={"status": "error", "message": "Invalid data"}, status_code=400)
+        
+        if not user_id or not isinstance(minigame_id, str) or not minigame_id:
+            return FastJSONResponse(content={"status": "error", "message": "Invalid data"}, status_code=400)
+        
+        result = await claim_minigame_reward(str(user_id), minigame_id, coins)
+        if result["status"] == "success":
+            return FastJSONResponse(content=result)
+        elif result["message"] == "Minigame played too recently":
+            return FastJSONResponse(content=result, status_code=429)
+        elif result["message"] == "Unknown minigame":
+            return FastJSONResponse(content=result, status_code=400)
+        else:
+            return FastJSONResponse(content=result, status_code=500)
+    except Exception as e:
+        logger.error(f"Error in POST /minigame: {e}")
+        return FastJSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
 
 # Добавляем код для запуска на сервере
 if __name__ == "__main__":
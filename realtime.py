@@ -0,0 +1,58 @@
+"""Постоянные WebSocket-соединения игроков.
+
+Через одно соединение на игрока идут клики, частичные сохранения и
+обновления топа. Сервер сам рассылает изменения вместо опроса клиентами.
+"""
+import asyncio
+import logging
+from typing import Dict, Set
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать медленного клиента при рассылке, сек
+SEND_TIMEOUT = 5.0
+
+
+class ConnectionManager:
+    """Реестр открытых WebSocket-соединений по user_id"""
+
+    def __init__(self):
+        self._connections: Dict[str, Set[WebSocket]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(sockets) for sockets in self._connections.values())
+
+    async def connect(self, user_id: str, websocket: WebSocket) -> None:
+        await websocket.accept()
+        self._connections.setdefault(user_id, set()).add(websocket)
+        logger.info(f"WebSocket connected for user {user_id} ({len(self)} open)")
+
+    def disconnect(self, user_id: str, websocket: WebSocket) -> None:
+        sockets = self._connections.get(user_id)
+        if sockets is None:
+            return
+        sockets.discard(websocket)
+        if not sockets:
+            del self._connections[user_id]
+        logger.info(f"WebSocket disconnected for user {user_id} ({len(self)} open)")
+
+    async def send_to_user(self, user_id: str, text: str) -> None:
+        for websocket in list(self._connections.get(user_id, ())):
+            await self._send(user_id, websocket, text)
+
+    async def broadcast(self, text: str) -> None:
+        """Отправляет одно и то же сообщение всем подключенным игрокам"""
+        await asyncio.gather(*(
+            self._send(user_id, websocket, text)
+            for user_id, sockets in list(self._connections.items())
+            for websocket in list(sockets)
+        ))
+
+    async def _send(self, user_id: str, websocket: WebSocket, text: str) -> None:
+        try:
+            await asyncio.wait_for(websocket.send_text(text), timeout=SEND_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Dropping WebSocket for user {user_id}: {e}")
+            self.disconnect(user_id, websocket)
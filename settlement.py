@@ -0,0 +1,90 @@
+"""Ленивый расчет энергии и пассивного дохода по якорям.
+
+В базе хранятся только якоря: значение и момент времени, к которому оно
+относится (``energy`` + ``last_energy_update``, ``score`` +
+``last_passive_income_update``). Текущие значения вычисляются в замкнутой
+форме при чтении состояния, поэтому периодические записи не нужны.
+
+Время передается целыми миллисекундами эпохи (UTC): расчет обходится без
+объектов datetime, а ISO-строки разбираются и собираются только на границе
+с базой и клиентом.
+
+Якорь сдвигается ровно на начисленное число целых секунд/периодов,
+а не на текущее время, так что дробные остатки не теряются и повторный
+расчет из тех же якорей дает тот же результат.
+"""
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional, Tuple
+
+# Восстановление энергии: единиц в секунду
+ENERGY_REGEN_PER_SECOND = 1
+
+# Пассивный доход начисляется за каждый полный период
+PASSIVE_INCOME_PERIOD_SECONDS = 5
+PASSIVE_INCOME_PERIOD_MS = PASSIVE_INCOME_PERIOD_SECONDS * 1000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+def now_ms() -> int:
+    """Текущее время в миллисекундах эпохи"""
+    return time.time_ns() // 1_000_000
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """Разбирает ISO-время из базы (в том числе с 'Z'); без часового пояса считаем UTC"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def to_epoch_ms(value: Any) -> Optional[int]:
+    """ISO-время (или datetime, или число миллисекунд) в миллисекунды эпохи"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    parsed = parse_timestamp(value)
+    if parsed is None:
+        return None
+    return (parsed - EPOCH) // MILLISECOND
+
+
+def format_epoch_ms(value: Optional[int]) -> Optional[str]:
+    """Миллисекунды эпохи в ISO-время UTC"""
+    if value is None:
+        return None
+    return (EPOCH + value * MILLISECOND).isoformat(timespec="milliseconds")
+
+
+def settle_energy(energy: int, anchor: Optional[int], max_energy: int, now: int) -> Tuple[int, int]:
+    """Энергия на момент ``now`` и новый якорь"""
+    if anchor is None or anchor > now:
+        return max_energy, now
+
+    seconds = (now - anchor) // 1000
+    restored = energy + seconds * ENERGY_REGEN_PER_SECOND
+    if restored >= max_energy:
+        # Энергия полная: дальше отсчитываем от текущего момента
+        return max_energy, now
+    return restored, anchor + seconds * 1000
+
+
+def settle_passive_income(score: int, income_per_period: int, anchor: Optional[int], now: int) -> Tuple[int, int]:
+    """Очки с учетом пассивного дохода на момент ``now`` и новый якорь"""
+    if anchor is None or anchor > now:
+        return score, now
+
+    periods = (now - anchor) // PASSIVE_INCOME_PERIOD_MS
+    if periods <= 0:
+        return score, anchor
+    return score + income_per_period * periods, anchor + periods * PASSIVE_INCOME_PERIOD_MS
@@ -0,0 +1,65 @@
+"""Объединение одновременных запросов к одному пользователю.
+
+Клиент часто шлет несколько запросов подряд (клики, пассивный доход,
+автокликер, колбэк Adsgram посреди сессии), и каждый из них загружает того
+же пользователя. ``SingleFlight`` превращает одновременные загрузки одного
+ключа в один запрос к базе, а ``KeyedLocks`` выстраивает в очередь записи
+одного пользователя, чтобы пересекающиеся чтение-изменение-запись не
+затирали друг друга.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """Один выполняющийся вызов на ключ; остальные вызывающие ждут его результат"""
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.stats = {"calls": 0, "shared": 0}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            self.stats["calls"] += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        else:
+            self.stats["shared"] += 1
+        # Отмена одного из ожидающих не должна прерывать общий запрос
+        return await asyncio.shield(task)
+
+
+class KeyedLocks:
+    """Блокировки по ключу; блокировка удаляется, когда ее никто не ждет"""
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._holders: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def locked(self, key: str) -> bool:
+        lock = self._locks.get(key)
+        return lock is not None and lock.locked()
+
+    @asynccontextmanager
+    async def lock(self, key: str) -> AsyncIterator[None]:
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._holders[key] = self._holders.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._holders[key] -= 1
+            if not self._holders[key]:
+                del self._holders[key]
+                del self._locks[key]
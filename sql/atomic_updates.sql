@@ -0,0 +1,288 @@
+-- Атомарные изменения пользователя одним запросом (вызываются через supabase.rpc)
+--
+-- Каждая функция меняет строку users одним UPDATE: параллельные вызовы
+-- блокируют строку и применяются по очереди, поэтому изменения не теряются.
+-- Функции возвращают измененные поля (jsonb) или NULL, если пользователя нет.
+--
+-- Предполагается, что achievements, daily_bonus и upgrades - колонки jsonb,
+-- а last_referral_task_completion - timestamptz.
+--
+-- Применение (после sql/referrals.sql): psql "$DATABASE_URL" -f sql/atomic_updates.sql
+-- Проверка под конкурентной нагрузкой: python benchmarks/rpc_concurrency.py
+
+create or replace function increment_score(p_user_id text, p_delta bigint)
+returns jsonb
+language sql
+as $$
+    update users
+       set score = coalesce(score, 0) + p_delta
+     where user_id = p_user_id
+    returning jsonb_build_object('score', score);
+$$;
+
+-- Реферал добавляется в таблицу связей (sql/referrals.sql), счетчик растет только для новой пары
+create or replace function append_referral(p_user_id text, p_referred_id text)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_count integer;
+begin
+    -- Блокируем строку реферера: вставка связи и счетчик меняются согласованно
+    select referral_count into v_count from users where user_id = p_user_id for update;
+    if not found then
+        return null;
+    end if;
+
+    insert into referrals (referrer_id, referred_id)
+    values (p_user_id, p_referred_id)
+    on conflict do nothing;
+
+    if not found then
+        return jsonb_build_object('referral_count', v_count, 'added', false);
+    end if;
+
+    update users
+       set referral_count = referral_count + 1
+     where user_id = p_user_id
+    returning referral_count into v_count;
+    return jsonb_build_object('referral_count', v_count, 'added', true);
+end;
+$$;
+
+-- Награда p_reward начисляется только вместе с новым достижением.
+-- Прежняя версия без p_reward удаляется, иначе вызов с двумя аргументами неоднозначен
+drop function if exists append_achievement(text, text);
+
+create or replace function append_achievement(p_user_id text, p_achievement_id text, p_reward bigint default 0)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_achievements jsonb;
+    v_score bigint;
+begin
+    update users
+       set achievements = coalesce(achievements, '[]'::jsonb) || to_jsonb(p_achievement_id),
+           score = coalesce(score, 0) + p_reward
+     where user_id = p_user_id
+       and not coalesce(achievements, '[]'::jsonb) ? p_achievement_id
+    returning achievements, score into v_achievements, v_score;
+
+    if found then
+        return jsonb_build_object('achievements', v_achievements, 'added', true, 'score', v_score);
+    end if;
+
+    select coalesce(achievements, '[]'::jsonb), coalesce(score, 0)
+      into v_achievements, v_score
+      from users
+     where user_id = p_user_id;
+    if not found then
+        return null;
+    end if;
+    return jsonb_build_object('achievements', v_achievements, 'added', false, 'score', v_score);
+end;
+$$;
+
+-- Покупка улучшения: списывает p_cost и добавляет улучшение, только если его еще нет
+-- и очков хватает (UPGRADES в main.py)
+create or replace function purchase_upgrade(p_user_id text, p_upgrade_id text, p_cost bigint)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_score bigint;
+    v_upgrades jsonb;
+begin
+    update users
+       set score = score - p_cost,
+           upgrades = coalesce(upgrades, '[]'::jsonb) || to_jsonb(p_upgrade_id)
+     where user_id = p_user_id
+       and coalesce(score, 0) >= p_cost
+       and not coalesce(upgrades, '[]'::jsonb) ? p_upgrade_id
+    returning score, upgrades into v_score, v_upgrades;
+
+    if found then
+        return jsonb_build_object('purchased', true, 'score', v_score, 'upgrades', v_upgrades);
+    end if;
+
+    select coalesce(score, 0), coalesce(upgrades, '[]'::jsonb)
+      into v_score, v_upgrades
+      from users
+     where user_id = p_user_id;
+    if not found then
+        return null;
+    end if;
+    return jsonb_build_object('purchased', false, 'score', v_score, 'upgrades', v_upgrades);
+end;
+$$;
+
+-- Награда за задание (NORMAL_TASKS и DAILY_TASKS в main.py): отметка о выполнении
+-- ставится вместе с начислением, поэтому награду нельзя получить дважды.
+-- Условия те же, что в apply_task_claim (stores/base.py)
+create or replace function claim_task_reward(
+    p_user_id text,
+    p_task_id text,
+    p_reward bigint,
+    p_referrals_required int,
+    p_referral_cooldown int
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_user users%rowtype;
+    v_claimed boolean;
+begin
+    select * into v_user from users where user_id = p_user_id for update;
+    if not found then
+        return null;
+    end if;
+
+    if p_task_id = 'wallet_task' then
+        v_claimed := coalesce(v_user.wallet_address, '') <> '' and not coalesce(v_user.wallet_task_completed, false);
+        if v_claimed then
+            v_user.wallet_task_completed := true;
+        end if;
+    elsif p_task_id = 'channel_subscription' then
+        v_claimed := not coalesce(v_user.channel_task_completed, false);
+        if v_claimed then
+            v_user.channel_task_completed := true;
+        end if;
+    elsif p_task_id = 'referral_task' then
+        v_claimed := coalesce(v_user.referral_count, 0) >= p_referrals_required
+            and (v_user.last_referral_task_completion is null
+                 or v_user.last_referral_task_completion <= now() - make_interval(secs => p_referral_cooldown));
+        if v_claimed then
+            v_user.last_referral_task_completion := now();
+        end if;
+    else
+        -- 22023 (invalid_parameter_value): PostgREST отвечает 400, приложение получает DataError
+        raise exception 'Unknown task: %', p_task_id using errcode = '22023';
+    end if;
+
+    if v_claimed then
+        update users
+           set score = coalesce(score, 0) + p_reward,
+               wallet_task_completed = v_user.wallet_task_completed,
+               channel_task_completed = v_user.channel_task_completed,
+               last_referral_task_completion = v_user.last_referral_task_completion
+         where user_id = p_user_id
+        returning score into v_user.score;
+    end if;
+
+    return jsonb_build_object(
+        'claimed', v_claimed,
+        'score', coalesce(v_user.score, 0),
+        'wallet_task_completed', coalesce(v_user.wallet_task_completed, false),
+        'channel_task_completed', coalesce(v_user.channel_task_completed, false),
+        'last_referral_task_completion', v_user.last_referral_task_completion
+    );
+end;
+$$;
+
+create or replace function record_ad_view(p_user_id text)
+returns jsonb
+language sql
+as $$
+    update users
+       set ads_watched = coalesce(ads_watched, 0) + 1,
+           last_ad_time = now()
+     where user_id = p_user_id
+    returning jsonb_build_object('ads_watched', ads_watched, 'last_ad_time', last_ad_time);
+$$;
+
+-- Награда за задание с рекламой: списывает p_required просмотров и начисляет p_reward,
+-- только если просмотров хватает (ADS_TASK_REQUIRED и ADS_TASK_REWARD в main.py)
+create or replace function claim_ad_reward(p_user_id text, p_required int, p_reward bigint)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_ads int;
+    v_score bigint;
+begin
+    update users
+       set ads_watched = ads_watched - p_required,
+           score = coalesce(score, 0) + p_reward
+     where user_id = p_user_id
+       and coalesce(ads_watched, 0) >= p_required
+    returning ads_watched, score into v_ads, v_score;
+
+    if found then
+        return jsonb_build_object('claimed', true, 'ads_watched', v_ads, 'score', v_score);
+    end if;
+
+    select coalesce(ads_watched, 0), coalesce(score, 0) into v_ads, v_score from users where user_id = p_user_id;
+    if not found then
+        return null;
+    end if;
+    return jsonb_build_object('claimed', false, 'ads_watched', v_ads, 'score', v_score);
+end;
+$$;
+
+-- p_rewards - награды по дням серии (DAILY_BONUSES в main.py)
+create or replace function claim_daily_bonus(p_user_id text, p_rewards bigint[])
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_bonus jsonb;
+    v_now timestamptz := now();
+    v_today date := (now() at time zone 'utc')::date;
+    v_last date;
+    v_streak int;
+    v_reward bigint;
+    v_score bigint;
+begin
+    -- Блокируем строку до конца транзакции: второй параллельный вызов увидит уже полученный бонус
+    select coalesce(daily_bonus, '{"last_claim": null, "streak": 0, "claimed_days": []}'::jsonb)
+      into v_bonus
+      from users
+     where user_id = p_user_id
+       for update;
+
+    if not found then
+        return jsonb_build_object('status', 'error', 'message', 'User not found');
+    end if;
+
+    v_last := (nullif(v_bonus->>'last_claim', '')::timestamptz at time zone 'utc')::date;
+    if v_last = v_today then
+        return jsonb_build_object('status', 'error', 'message', 'Daily bonus already claimed today');
+    end if;
+
+    -- Если серия прервана, начинаем заново
+    v_streak := coalesce((v_bonus->>'streak')::int, 0);
+    if v_streak = 0 or (v_last is not null and v_today - v_last > 1) then
+        v_streak := 1;
+    else
+        v_streak := v_streak + 1;
+    end if;
+    v_streak := least(v_streak, array_length(p_rewards, 1));
+    v_reward := p_rewards[v_streak];
+
+    v_bonus := jsonb_set(v_bonus, '{streak}', to_jsonb(v_streak));
+    v_bonus := jsonb_set(v_bonus, '{last_claim}', to_jsonb(v_now));
+    if not coalesce(v_bonus->'claimed_days', '[]'::jsonb) ? v_today::text then
+        v_bonus := jsonb_set(
+            v_bonus,
+            '{claimed_days}',
+            coalesce(v_bonus->'claimed_days', '[]'::jsonb) || to_jsonb(v_today::text)
+        );
+    end if;
+
+    update users
+       set score = coalesce(score, 0) + v_reward,
+           daily_bonus = v_bonus
+     where user_id = p_user_id
+    returning score into v_score;
+
+    return jsonb_build_object(
+        'status', 'success',
+        'reward', v_reward,
+        'streak', v_streak,
+        'daily_bonus', v_bonus,
+        'score', v_score
+    );
+end;
+$$;
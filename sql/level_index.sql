@@ -0,0 +1,32 @@
+-- Уровень игрока как индекс в таблице уровней вместо названия
+--
+-- Приложение записывает в users.level номер уровня (0 - "Новичок"), а
+-- названия на обоих языках отдает клиенту из /config. Существующие строки
+-- пересчитываются по очкам с теми же порогами, что и LEVELS в main.py.
+--
+-- Применение (до запуска новой версии приложения):
+--   psql "$DATABASE_URL" -f sql/level_index.sql
+
+alter table users alter column level drop default;
+
+alter table users
+    alter column level type smallint
+    using (
+        case
+            when coalesce(score, 0) >= 10000000 then 11
+            when coalesce(score, 0) >= 5000000 then 10
+            when coalesce(score, 0) >= 1000000 then 9
+            when coalesce(score, 0) >= 500000 then 8
+            when coalesce(score, 0) >= 200000 then 7
+            when coalesce(score, 0) >= 50000 then 6
+            when coalesce(score, 0) >= 10000 then 5
+            when coalesce(score, 0) >= 5000 then 4
+            when coalesce(score, 0) >= 2000 then 3
+            when coalesce(score, 0) >= 500 then 2
+            when coalesce(score, 0) >= 100 then 1
+            else 0
+        end
+    );
+
+alter table users alter column level set default 0;
+alter table users alter column level set not null;
@@ -0,0 +1,50 @@
+-- Рефералы как таблица связей вместо JSON-массива в строке пользователя
+--
+-- Каждая пара (referrer_id, referred_id) хранится один раз (первичный ключ),
+-- а число рефералов денормализовано в users.referral_count и поддерживается
+-- функцией append_referral (sql/atomic_updates.sql).
+--
+-- Порядок применения:
+--   psql "$DATABASE_URL" -f sql/referrals.sql
+--   psql "$DATABASE_URL" -f sql/atomic_updates.sql
+--   python tools/backfill_referrals.py      -- перенос существующих массивов
+--
+-- Колонка users.referrals после переноса больше не читается и не пишется
+-- приложением; ее можно удалить, когда перенос проверен.
+
+create table if not exists referrals (
+    referrer_id text not null references users (user_id) on delete cascade,
+    referred_id text not null,
+    created_at timestamptz not null default now(),
+    primary key (referrer_id, referred_id)
+);
+
+-- Постраничный вывод рефералов игрока в порядке приглашения
+create index if not exists referrals_referrer_created_idx
+    on referrals (referrer_id, created_at, referred_id);
+
+alter table users add column if not exists referral_count integer not null default 0;
+
+-- Пересчет счетчика по таблице связей (используется при переносе данных)
+create or replace function recount_referrals(p_user_ids text[])
+returns integer
+language plpgsql
+as $$
+declare
+    v_user_id text;
+    v_updated integer := 0;
+begin
+    foreach v_user_id in array p_user_ids loop
+        -- Та же блокировка строки, что и в append_referral: подсчет видит все
+        -- связи, добавленные до получения блокировки
+        perform 1 from users where user_id = v_user_id for update;
+        if found then
+            update users
+               set referral_count = (select count(*) from referrals where referrer_id = v_user_id)
+             where user_id = v_user_id;
+            v_updated := v_updated + 1;
+        end if;
+    end loop;
+    return v_updated;
+end;
+$$;
@@ -0,0 +1,258 @@
+"""Асинхронный клиент Supabase (PostgREST) поверх пула HTTP-соединений httpx.
+
+Повторяет цепочечный синтаксис supabase-py (``table(...).select(...).eq(...)``),
+но каждый ``execute()`` является корутиной и не блокирует цикл событий uvicorn.
+Все запросы воркера идут через один ``httpx.AsyncClient`` с keep-alive пулом,
+поэтому сотни запросов к Supabase могут выполняться одновременно.
+"""
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Параметры пула соединений по умолчанию (можно переопределить переменными окружения)
+DEFAULT_MAX_CONNECTIONS = 200
+DEFAULT_MAX_KEEPALIVE_CONNECTIONS = 50
+DEFAULT_TIMEOUT = 10.0
+
+# Ограничения одного пакетного запроса по умолчанию
+DEFAULT_CHUNK_ROWS = 500
+DEFAULT_CHUNK_BYTES = 1_000_000
+
+
+class SupabaseAPIError(Exception):
+    """Ошибка, возвращенная PostgREST API"""
+
+    def __init__(
+        self,
+        message: str,
+        status_code: Optional[int] = None,
+        details: Any = None,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+        # Через сколько секунд сервер разрешает повторить запрос (заголовок Retry-After)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Секунды из заголовка Retry-After (число или HTTP-дата); None, если заголовка нет или он неверный"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max(0.0, (moment - datetime.now(timezone.utc)).total_seconds())
+
+
+@dataclass
+class APIResponse:
+    """Ответ на запрос (аналог postgrest.APIResponse)"""
+    data: List[Dict[str, Any]]
+    count: Optional[int] = None
+
+
+class AsyncQueryBuilder:
+    """Построитель запроса к одной таблице"""
+
+    def __init__(self, client: "AsyncSupabaseClient", table: str):
+        self._client = client
+        self._table = table
+        self._method = "GET"
+        self._params: List[tuple] = []
+        self._headers: Dict[str, str] = {}
+        self._json: Any = None
+
+    def select(self, columns: str = "*") -> "AsyncQueryBuilder":
+        self._method = "GET"
+        self._params.append(("select", ",".join(c.strip() for c in columns.split(","))))
+        return self
+
+    def insert(self, data: Any) -> "AsyncQueryBuilder":
+        self._method = "POST"
+        self._json = data
+        self._headers["Prefer"] = "return=representation"
+        return self
+
+    def upsert(self, data: Any, on_conflict: str = "", ignore_duplicates: bool = False) -> "AsyncQueryBuilder":
+        self._method = "POST"
+        self._json = data
+        resolution = "ignore-duplicates" if ignore_duplicates else "merge-duplicates"
+        self._headers["Prefer"] = f"return=representation,resolution={resolution}"
+        if on_conflict:
+            self._params.append(("on_conflict", on_conflict))
+        return self
+
+    def update(self, data: Dict[str, Any]) -> "AsyncQueryBuilder":
+        self._method = "PATCH"
+        self._json = data
+        self._headers["Prefer"] = "return=representation"
+        return self
+
+    def delete(self) -> "AsyncQueryBuilder":
+        self._method = "DELETE"
+        self._headers["Prefer"] = "return=representation"
+        return self
+
+    def eq(self, column: str, value: Any) -> "AsyncQueryBuilder":
+        self._params.append((column, f"eq.{value}"))
+        return self
+
+    def gt(self, column: str, value: Any) -> "AsyncQueryBuilder":
+        self._params.append((column, f"gt.{value}"))
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "AsyncQueryBuilder":
+        term = f"{column}.{'desc' if desc else 'asc'}"
+        # Несколько вызовов order() складываются в одну сортировку по нескольким колонкам
+        for index, (name, value) in enumerate(self._params):
+            if name == "order":
+                self._params[index] = ("order", f"{value},{term}")
+                return self
+        self._params.append(("order", term))
+        return self
+
+    def limit(self, size: int) -> "AsyncQueryBuilder":
+        self._params.append(("limit", str(size)))
+        return self
+
+    def range(self, start: int, end: int) -> "AsyncQueryBuilder":
+        """Строки с номерами от start до end включительно"""
+        self._params.append(("offset", str(start)))
+        self._params.append(("limit", str(end - start + 1)))
+        return self
+
+    async def execute(self) -> APIResponse:
+        return await self._client.request(
+            self._method,
+            f"/rest/v1/{self._table}",
+            params=self._params,
+            json_body=self._json,
+            headers=self._headers,
+        )
+
+
+class AsyncSupabaseClient:
+    """Асинхронный клиент Supabase с общим пулом HTTP-соединений"""
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        max_keepalive_connections: int = DEFAULT_MAX_KEEPALIVE_CONNECTIONS,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        self.url = url.rstrip("/")
+        self.key = key
+        self._http = httpx.AsyncClient(
+            base_url=self.url,
+            headers={
+                "apikey": key,
+                "Authorization": f"Bearer {key}",
+                "Content-Type": "application/json",
+            },
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            timeout=timeout,
+        )
+
+    def table(self, name: str) -> AsyncQueryBuilder:
+        return AsyncQueryBuilder(self, name)
+
+    def rpc(self, name: str, params: Optional[Dict[str, Any]] = None) -> AsyncQueryBuilder:
+        """Вызов хранимой функции Postgres (POST /rest/v1/rpc/<name>)"""
+        builder = AsyncQueryBuilder(self, f"rpc/{name}")
+        builder._method = "POST"
+        builder._json = params or {}
+        return builder
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[List[tuple]] = None,
+        json_body: Any = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> APIResponse:
+        content = json.dumps(json_body) if json_body is not None else None
+        response = await self._http.request(method, path, params=params, content=content, headers=headers)
+
+        if response.status_code >= 400:
+            try:
+                details = response.json()
+            except ValueError:
+                details = response.text
+            raise SupabaseAPIError(
+                f"Supabase request failed with status {response.status_code}: {details}",
+                status_code=response.status_code,
+                details=details,
+                retry_after=parse_retry_after(response.headers.get("retry-after")),
+            )
+
+        if not response.content:
+            return APIResponse(data=[])
+
+        data = response.json()
+        if data is None:
+            # Функция вернула NULL
+            data = []
+        elif isinstance(data, dict):
+            data = [data]
+        return APIResponse(data=data)
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+
+def chunk_rows(
+    rows: List[Dict[str, Any]],
+    max_rows: int = DEFAULT_CHUNK_ROWS,
+    max_bytes: int = DEFAULT_CHUNK_BYTES,
+) -> Iterator[List[Dict[str, Any]]]:
+    """Делит строки на пакеты не больше max_rows строк и примерно max_bytes JSON.
+
+    Строка, которая сама больше max_bytes, отправляется отдельным пакетом.
+    PostgREST требует одинаковый набор колонок во всех строках запроса, поэтому
+    при смене набора колонок начинается новый пакет (чтобы пакеты были крупнее,
+    строки стоит заранее отсортировать по набору колонок).
+    """
+    chunk: List[Dict[str, Any]] = []
+    columns = None
+    size = 2
+    for row in rows:
+        row_size = len(json.dumps(row)) + 1
+        if chunk and (len(chunk) >= max_rows or size + row_size > max_bytes or row.keys() != columns):
+            yield chunk
+            chunk, size = [], 2
+        chunk.append(row)
+        columns = row.keys()
+        size += row_size
+    if chunk:
+        yield chunk
+
+
+def create_async_client(url: str, key: str, **kwargs) -> AsyncSupabaseClient:
+    """Создает асинхронный клиент Supabase"""
+    if not url.startswith(("http://", "https://")):
+        raise ValueError(f"Invalid Supabase URL: {url}")
+    if not key:
+        raise ValueError("Supabase key is required")
+    return AsyncSupabaseClient(url, key, **kwargs)
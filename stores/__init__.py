@@ -0,0 +1,91 @@
+"""Хранилища игроков: Supabase, SQLite и память процесса.
+
+Реализация выбирается переменной окружения ``STORAGE_BACKEND``
+(``supabase``, ``sqlite`` или ``memory``). Без нее используется Supabase,
+если заданы ``SUPABASE_URL`` и ``SUPABASE_KEY``, иначе локальный SQLite.
+"""
+import logging
+import os
+from typing import Mapping, Optional
+
+from stores.base import (
+    DAILY_BONUS_COLUMNS,
+    LEADERBOARD_COLUMNS,
+    PROFILE_COLUMNS,
+    REFERRAL_COUNT_COLUMNS,
+    REFERRAL_TASK_COOLDOWN,
+    REFERRAL_TASK_REQUIRED,
+    SESSION_COLUMNS,
+    TASK_COLUMNS,
+    USER_COLD_COLUMNS,
+    USER_COLUMNS,
+    USER_HOT_COLUMNS,
+    DataError,
+    StorageError,
+    UserStore,
+    apply_daily_bonus,
+    apply_task_claim,
+    check_columns,
+)
+from stores.memory import MemoryStore
+from stores.sqlite import SQLiteStore
+from stores.supabase import SupabaseStore
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("supabase", "sqlite", "memory")
+
+DEFAULT_SQLITE_PATH = "app.db"
+
+
+def create_store(backend: Optional[str] = None, env: Optional[Mapping[str, str]] = None) -> UserStore:
+    """Создает хранилище по имени или по переменным окружения"""
+    env = os.environ if env is None else env
+    url = env.get("SUPABASE_URL")
+    key = env.get("SUPABASE_KEY")
+    backend = (backend or env.get("STORAGE_BACKEND") or ("supabase" if url and key else "sqlite")).lower()
+
+    if backend == "supabase":
+        if not url or not key:
+            raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set for the supabase storage backend")
+        return SupabaseStore.from_url(
+            url,
+            key,
+            max_connections=int(env.get("SUPABASE_MAX_CONNECTIONS", 200)),
+            max_keepalive_connections=int(env.get("SUPABASE_MAX_KEEPALIVE", 50)),
+            timeout=float(env.get("SUPABASE_TIMEOUT", 10)),
+        )
+    if backend == "sqlite":
+        path = env.get("SQLITE_PATH", DEFAULT_SQLITE_PATH)
+        logger.info(f"Using SQLite storage at {path}")
+        return SQLiteStore(path)
+    if backend == "memory":
+        logger.warning("Using in-memory storage: data is lost on restart")
+        return MemoryStore()
+    raise ValueError(f"Unknown storage backend: {backend} (expected one of {', '.join(BACKENDS)})")
+
+
+__all__ = [
+    "BACKENDS",
+    "DAILY_BONUS_COLUMNS",
+    "DataError",
+    "LEADERBOARD_COLUMNS",
+    "MemoryStore",
+    "PROFILE_COLUMNS",
+    "REFERRAL_COUNT_COLUMNS",
+    "REFERRAL_TASK_COOLDOWN",
+    "REFERRAL_TASK_REQUIRED",
+    "SESSION_COLUMNS",
+    "SQLiteStore",
+    "StorageError",
+    "SupabaseStore",
+    "TASK_COLUMNS",
+    "USER_COLD_COLUMNS",
+    "USER_COLUMNS",
+    "USER_HOT_COLUMNS",
+    "UserStore",
+    "apply_daily_bonus",
+    "apply_task_claim",
+    "check_columns",
+    "create_store",
+]
@@ -0,0 +1,229 @@
+"""Интерфейс хранилища игроков.
+
+Приложение работает с данными только через методы ``UserStore``; реализации
+для Supabase, SQLite и памяти процесса взаимозаменяемы. Изменения счетчиков
+(очки, реклама, рефералы, достижения, задания, покупки улучшений,
+ежедневный бонус) выполняются хранилищем атомарно, без
+чтения-изменения-записи на стороне приложения.
+"""
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+# Горячие колонки users: короткие скаляры, которые нужны почти каждому запросу
+USER_HOT_COLUMNS = (
+    "user_id", "first_name", "last_name", "username", "photo_url", "score", "total_clicks", "level",
+    "wallet_address", "wallet_task_completed", "channel_task_completed", "energy", "last_energy_update",
+    "last_referral_task_completion", "ads_watched", "language", "last_passive_income_update",
+    "last_ad_time", "referral_count",
+)
+# Холодные колонки: JSON-поля, которые растут вместе с прогрессом игрока
+USER_COLD_COLUMNS = ("upgrades", "achievements", "daily_bonus")
+USER_COLUMNS = USER_HOT_COLUMNS + USER_COLD_COLUMNS
+
+# Наборы колонок по сценариям: читаем только то, что нужно вызывающему.
+# Сессии (клики, сохранения) нужны горячие колонки и улучшения (бонус за клик,
+# пассивный доход); достижения и ежедневный бонус дочитываются для ответа /user
+SESSION_COLUMNS = USER_HOT_COLUMNS + ("upgrades",)
+PROFILE_COLUMNS = ("achievements", "daily_bonus")
+LEADERBOARD_COLUMNS = ("user_id", "first_name", "last_name", "username", "photo_url", "score", "level")
+DAILY_BONUS_COLUMNS = ("user_id", "score", "daily_bonus")
+REFERRAL_COUNT_COLUMNS = ("user_id", "referral_count")
+# Колонки, по которым проверяются условия заданий (apply_task_claim)
+TASK_COLUMNS = (
+    "user_id", "score", "wallet_address", "wallet_task_completed", "channel_task_completed",
+    "referral_count", "last_referral_task_completion",
+)
+
+# Задание с рефералами: сколько приглашенных нужно и как часто можно получать награду
+REFERRAL_TASK_REQUIRED = 3
+REFERRAL_TASK_COOLDOWN = timedelta(hours=24)
+
+
+class StorageError(Exception):
+    """Ошибка хранилища"""
+
+
+class DataError(StorageError):
+    """Хранилище отклонило сами данные запроса: повтор не поможет"""
+
+
+def check_columns(columns: Sequence[str]) -> None:
+    """Проверяет, что все колонки есть в USER_COLUMNS"""
+    unknown = set(columns) - set(USER_COLUMNS)
+    if unknown or not columns:
+        raise DataError(f"Invalid columns for users: {sorted(unknown) or 'no columns requested'}")
+
+
+class UserStore(ABC):
+    """Хранилище пользователей, рейтинга, рефералов и достижений"""
+
+    name = "base"
+
+    # --- пользователи ---
+
+    @abstractmethod
+    async def get_user(self, user_id: str, columns: Sequence[str] = SESSION_COLUMNS) -> Optional[Dict[str, Any]]:
+        """Переданные колонки строки пользователя или None"""
+
+    @abstractmethod
+    async def upsert_users(self, rows: List[Dict[str, Any]]) -> None:
+        """Вставляет или обновляет строки; для существующих меняются только переданные колонки.
+
+        Остальные колонки новой строки получают значения по умолчанию таблицы
+        (очки, клики и счетчики - 0, списки - пустые).
+
+        Все строки одного вызова записываются одной операцией: при ошибке в
+        данных любой строки (DataError) не записывается ни одна. Хранилища на
+        PostgREST принимают в одном вызове только строки с одинаковым набором
+        колонок (см. storage.chunk_rows).
+        """
+
+    @abstractmethod
+    async def update_user(self, user_id: str, fields: Dict[str, Any]) -> None:
+        """Обновляет переданные колонки существующего пользователя"""
+
+    @abstractmethod
+    async def delete_user(self, user_id: str) -> None:
+        """Удаляет пользователя вместе с его рефералами"""
+
+    # --- рейтинг ---
+
+    @abstractmethod
+    async def list_users(self, after_user_id: str = "", limit: int = 1000) -> List[Dict[str, Any]]:
+        """Страница пользователей (колонки рейтинга) по возрастанию user_id после after_user_id"""
+
+    @abstractmethod
+    async def top_users(self, limit: int = 100) -> List[Dict[str, Any]]:
+        """Пользователи с наибольшим числом очков (колонки рейтинга)"""
+
+    # --- атомарные изменения; None, если пользователя нет ---
+
+    @abstractmethod
+    async def increment_score(self, user_id: str, delta: int) -> Optional[Dict[str, Any]]:
+        """{"score": новое значение}"""
+
+    @abstractmethod
+    async def record_ad_view(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """{"ads_watched": ..., "last_ad_time": ...}"""
+
+    @abstractmethod
+    async def claim_ad_reward(self, user_id: str, required: int, reward: int) -> Optional[Dict[str, Any]]:
+        """Списывает required просмотров рекламы и начисляет reward, если просмотров хватает.
+
+        {"claimed": bool, "ads_watched": ..., "score": ...}
+        """
+
+    @abstractmethod
+    async def claim_task_reward(self, user_id: str, task_id: str, reward: int) -> Optional[Dict[str, Any]]:
+        """Отмечает задание выполненным и начисляет reward, если условие выполнено (apply_task_claim).
+
+        {"claimed": bool, "score": ..., "wallet_task_completed": ..., "channel_task_completed": ...,
+        "last_referral_task_completion": ...}; неизвестное задание - DataError
+        """
+
+    @abstractmethod
+    async def purchase_upgrade(self, user_id: str, upgrade_id: str, cost: int) -> Optional[Dict[str, Any]]:
+        """Добавляет улучшение и списывает cost, если его еще нет и очков хватает.
+
+        {"purchased": bool, "score": ..., "upgrades": [...]}
+        """
+
+    @abstractmethod
+    async def claim_daily_bonus(self, user_id: str, rewards: List[int]) -> Dict[str, Any]:
+        """Результат в формате claim_daily_bonus() (status, reward, streak, daily_bonus, score)"""
+
+    # --- рефералы ---
+
+    @abstractmethod
+    async def append_referral(self, user_id: str, referred_id: str) -> Optional[Dict[str, Any]]:
+        """{"referral_count": ..., "added": bool}"""
+
+    @abstractmethod
+    async def list_referrals(self, user_id: str, limit: int, offset: int) -> List[Dict[str, Any]]:
+        """Страница рефералов в порядке приглашения: [{"referred_id", "created_at"}]"""
+
+    # --- достижения ---
+
+    @abstractmethod
+    async def get_achievements(self, user_id: str) -> Optional[List[str]]:
+        """Список достижений или None"""
+
+    @abstractmethod
+    async def append_achievement(self, user_id: str, achievement_id: str, reward: int = 0) -> Optional[Dict[str, Any]]:
+        """Добавляет достижение; reward начисляется только вместе с новым достижением.
+
+        {"achievements": [...], "added": bool, "score": ...}
+        """
+
+    async def close(self) -> None:
+        """Освобождает соединения"""
+
+
+def apply_daily_bonus(daily_bonus: Optional[Dict[str, Any]], rewards: List[int],
+                      now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Расчет ежедневного бонуса (то же, что функция claim_daily_bonus в sql/atomic_updates.sql).
+
+    Возвращает результат без поля score: его добавляет хранилище после начисления.
+    """
+    now = now or datetime.now(timezone.utc)
+    today = now.date()
+    daily_bonus = dict(daily_bonus or {'last_claim': None, 'streak': 0, 'claimed_days': []})
+
+    last_claim = daily_bonus.get('last_claim')
+    last_date = None
+    if last_claim:
+        last_date = datetime.fromisoformat(str(last_claim).replace('Z', '+00:00')).astimezone(timezone.utc).date()
+
+    if last_date == today:
+        return {"status": "error", "message": "Daily bonus already claimed today"}
+
+    # Если серия прервана, начинаем заново
+    streak = int(daily_bonus.get('streak') or 0)
+    if streak == 0 or (last_date is not None and (today - last_date).days > 1):
+        streak = 1
+    else:
+        streak += 1
+    streak = min(streak, len(rewards))
+
+    claimed_days = list(daily_bonus.get('claimed_days') or [])
+    if today.isoformat() not in claimed_days:
+        claimed_days.append(today.isoformat())
+
+    daily_bonus.update({'streak': streak, 'last_claim': now.isoformat(), 'claimed_days': claimed_days})
+    return {
+        "status": "success",
+        "reward": rewards[streak - 1],
+        "streak": streak,
+        "daily_bonus": daily_bonus,
+    }
+
+
+def apply_task_claim(task_id: str, row: Dict[str, Any], now: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """Колонки, которые отмечают задание выполненным, или None, если условие не выполнено.
+
+    То же, что функция claim_task_reward в sql/atomic_updates.sql; row - колонки TASK_COLUMNS.
+    """
+    now = now or datetime.now(timezone.utc)
+
+    if task_id == "wallet_task":
+        if not row.get("wallet_address") or row.get("wallet_task_completed"):
+            return None
+        return {"wallet_task_completed": True}
+
+    if task_id == "channel_subscription":
+        if row.get("channel_task_completed"):
+            return None
+        return {"channel_task_completed": True}
+
+    if task_id == "referral_task":
+        if (row.get("referral_count") or 0) < REFERRAL_TASK_REQUIRED:
+            return None
+        last_completion = row.get("last_referral_task_completion")
+        if last_completion:
+            last = datetime.fromisoformat(str(last_completion).replace('Z', '+00:00')).astimezone(timezone.utc)
+            if now - last < REFERRAL_TASK_COOLDOWN:
+                return None
+        return {"last_referral_task_completion": now.isoformat()}
+
+    raise DataError(f"Unknown task: {task_id}")
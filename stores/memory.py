@@ -0,0 +1,179 @@
+"""Хранилище в памяти процесса.
+
+Для локального запуска без сети, нагрузочных тестов и проверок. Данные
+пропадают при перезапуске. Методы не уступают управление циклу событий
+посреди изменения, поэтому каждое изменение атомарно.
+"""
+import copy
+import heapq
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+from stores.base import (
+    LEADERBOARD_COLUMNS,
+    SESSION_COLUMNS,
+    DataError,
+    UserStore,
+    apply_daily_bonus,
+    apply_task_claim,
+    check_columns,
+)
+
+# Значения новой строки для колонок, которых нет в upsert (как DEFAULT таблицы users в SQLite)
+NEW_ROW_DEFAULTS = {
+    "score": 0,
+    "total_clicks": 0,
+    "level": 0,
+    "wallet_address": "",
+    "wallet_task_completed": False,
+    "channel_task_completed": False,
+    "upgrades": [],
+    "ads_watched": 0,
+    "achievements": [],
+    "language": "ru",
+    "referral_count": 0,
+}
+
+
+class MemoryStore(UserStore):
+    """Словари в памяти вместо таблиц users и referrals"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._users: Dict[str, Dict[str, Any]] = {}
+        # referrer_id -> {referred_id: created_at} в порядке приглашения
+        self._referrals: Dict[str, Dict[str, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    async def get_user(self, user_id: str, columns: Sequence[str] = SESSION_COLUMNS) -> Optional[Dict[str, Any]]:
+        check_columns(columns)
+        row = self._users.get(str(user_id))
+        return copy.deepcopy({column: row.get(column) for column in columns}) if row is not None else None
+
+    async def upsert_users(self, rows: List[Dict[str, Any]]) -> None:
+        if any(not row.get("user_id") for row in rows):
+            raise DataError("user_id is required")
+        for row in rows:
+            user_id = str(row["user_id"])
+            current = self._users.setdefault(user_id, copy.deepcopy(NEW_ROW_DEFAULTS))
+            current.update(copy.deepcopy(row))
+            current["user_id"] = user_id
+
+    async def update_user(self, user_id: str, fields: Dict[str, Any]) -> None:
+        row = self._users.get(str(user_id))
+        if row is not None:
+            row.update(copy.deepcopy(fields))
+
+    async def delete_user(self, user_id: str) -> None:
+        self._users.pop(str(user_id), None)
+        self._referrals.pop(str(user_id), None)
+
+    @staticmethod
+    def _leaderboard_row(row: Dict[str, Any]) -> Dict[str, Any]:
+        return {column: row.get(column) for column in LEADERBOARD_COLUMNS}
+
+    async def list_users(self, after_user_id: str = "", limit: int = 1000) -> List[Dict[str, Any]]:
+        user_ids = sorted(user_id for user_id in self._users if user_id > after_user_id)[:limit]
+        return [self._leaderboard_row(self._users[user_id]) for user_id in user_ids]
+
+    async def top_users(self, limit: int = 100) -> List[Dict[str, Any]]:
+        rows = heapq.nlargest(limit, self._users.values(), key=lambda row: row.get("score") or 0)
+        return [self._leaderboard_row(row) for row in rows]
+
+    async def increment_score(self, user_id: str, delta: int) -> Optional[Dict[str, Any]]:
+        row = self._users.get(str(user_id))
+        if row is None:
+            return None
+        row["score"] = (row.get("score") or 0) + delta
+        return {"score": row["score"]}
+
+    async def record_ad_view(self, user_id: str) -> Optional[Dict[str, Any]]:
+        row = self._users.get(str(user_id))
+        if row is None:
+            return None
+        row["ads_watched"] = (row.get("ads_watched") or 0) + 1
+        row["last_ad_time"] = datetime.now(timezone.utc).isoformat()
+        return {"ads_watched": row["ads_watched"], "last_ad_time": row["last_ad_time"]}
+
+    async def claim_ad_reward(self, user_id: str, required: int, reward: int) -> Optional[Dict[str, Any]]:
+        row = self._users.get(str(user_id))
+        if row is None:
+            return None
+        claimed = (row.get("ads_watched") or 0) >= required
+        if claimed:
+            row["ads_watched"] = row["ads_watched"] - required
+            row["score"] = (row.get("score") or 0) + reward
+        return {"claimed": claimed, "ads_watched": row.get("ads_watched") or 0, "score": row.get("score") or 0}
+
+    async def claim_task_reward(self, user_id: str, task_id: str, reward: int) -> Optional[Dict[str, Any]]:
+        row = self._users.get(str(user_id))
+        if row is None:
+            return None
+        changes = apply_task_claim(task_id, row)
+        if changes is not None:
+            row.update(changes)
+            row["score"] = (row.get("score") or 0) + reward
+        return {
+            "claimed": changes is not None,
+            "score": row.get("score") or 0,
+            "wallet_task_completed": bool(row.get("wallet_task_completed")),
+            "channel_task_completed": bool(row.get("channel_task_completed")),
+            "last_referral_task_completion": row.get("last_referral_task_completion"),
+        }
+
+    async def purchase_upgrade(self, user_id: str, upgrade_id: str, cost: int) -> Optional[Dict[str, Any]]:
+        row = self._users.get(str(user_id))
+        if row is None:
+            return None
+        upgrades = list(row.get("upgrades") or [])
+        purchased = upgrade_id not in upgrades and (row.get("score") or 0) >= cost
+        if purchased:
+            upgrades.append(upgrade_id)
+            row["upgrades"] = upgrades
+            row["score"] = row["score"] - cost
+        return {"purchased": purchased, "score": row.get("score") or 0, "upgrades": list(upgrades)}
+
+    async def claim_daily_bonus(self, user_id: str, rewards: List[int]) -> Dict[str, Any]:
+        row = self._users.get(str(user_id))
+        if row is None:
+            return {"status": "error", "message": "User not found"}
+        result = apply_daily_bonus(row.get("daily_bonus"), rewards)
+        if result["status"] == "success":
+            row["score"] = (row.get("score") or 0) + result["reward"]
+            row["daily_bonus"] = result["daily_bonus"]
+            result["score"] = row["score"]
+        return copy.deepcopy(result)
+
+    async def append_referral(self, user_id: str, referred_id: str) -> Optional[Dict[str, Any]]:
+        row = self._users.get(str(user_id))
+        if row is None:
+            return None
+        referrals = self._referrals.setdefault(str(user_id), {})
+        added = referred_id not in referrals
+        if added:
+            referrals[referred_id] = datetime.now(timezone.utc).isoformat()
+            row["referral_count"] = row.get("referral_count", 0) + 1
+        return {"referral_count": row["referral_count"], "added": added}
+
+    async def list_referrals(self, user_id: str, limit: int, offset: int) -> List[Dict[str, Any]]:
+        referrals = list(self._referrals.get(str(user_id), {}).items())[offset:offset + limit]
+        return [{"referred_id": referred_id, "created_at": created_at} for referred_id, created_at in referrals]
+
+    async def get_achievements(self, user_id: str) -> Optional[List[str]]:
+        row = self._users.get(str(user_id))
+        return None if row is None else list(row.get("achievements") or [])
+
+    async def append_achievement(self, user_id: str, achievement_id: str, reward: int = 0) -> Optional[Dict[str, Any]]:
+        row = self._users.get(str(user_id))
+        if row is None:
+            return None
+        achievements = list(row.get("achievements") or [])
+        added = achievement_id not in achievements
+        if added:
+            achievements.append(achievement_id)
+            row["achievements"] = achievements
+            row["score"] = (row.get("score") or 0) + reward
+        return {"achievements": list(achievements), "added": added, "score": row.get("score") or 0}
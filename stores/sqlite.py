@@ -0,0 +1,374 @@
+"""Хранилище в локальном файле SQLite (режим WAL).
+
+Подходит для небольших инсталляций на одной машине и для локального запуска
+без сети. Все запросы выполняются в одном выделенном потоке с одним
+соединением, так что цикл событий не блокируется, а изменения одного
+процесса идут по очереди. Изменяющие операции открываются через
+``BEGIN IMMEDIATE``, поэтому остаются атомарными и при нескольких процессах
+(воркерах uvicorn) над одним файлом.
+"""
+import asyncio
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from stores.base import (
+    DAILY_BONUS_COLUMNS,
+    LEADERBOARD_COLUMNS,
+    SESSION_COLUMNS,
+    TASK_COLUMNS,
+    USER_COLD_COLUMNS,
+    DataError,
+    UserStore,
+    apply_daily_bonus,
+    apply_task_claim,
+    check_columns,
+)
+
+# Колонки таблицы users и их типы в SQLite
+COLUMN_TYPES = {
+    "user_id": "TEXT PRIMARY KEY",
+    "first_name": "TEXT NOT NULL DEFAULT ''",
+    "last_name": "TEXT NOT NULL DEFAULT ''",
+    "username": "TEXT NOT NULL DEFAULT ''",
+    "photo_url": "TEXT NOT NULL DEFAULT ''",
+    "score": "INTEGER NOT NULL DEFAULT 0",
+    "total_clicks": "INTEGER NOT NULL DEFAULT 0",
+    "level": "INTEGER NOT NULL DEFAULT 0",
+    "wallet_address": "TEXT NOT NULL DEFAULT ''",
+    "wallet_task_completed": "INTEGER NOT NULL DEFAULT 0",
+    "channel_task_completed": "INTEGER NOT NULL DEFAULT 0",
+    "energy": "INTEGER",
+    "last_energy_update": "TEXT",
+    "last_referral_task_completion": "TEXT",
+    "upgrades": "TEXT NOT NULL DEFAULT '[]'",
+    "ads_watched": "INTEGER NOT NULL DEFAULT 0",
+    "achievements": "TEXT NOT NULL DEFAULT '[]'",
+    "daily_bonus": "TEXT",
+    "language": "TEXT NOT NULL DEFAULT 'ru'",
+    "last_passive_income_update": "TEXT",
+    "last_ad_time": "TEXT",
+    "referral_count": "INTEGER NOT NULL DEFAULT 0",
+}
+
+# Колонки, которые хранятся как JSON-текст, и логические колонки (0/1)
+JSON_COLUMNS = set(USER_COLD_COLUMNS)
+BOOL_COLUMNS = {"wallet_task_completed", "channel_task_completed"}
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS users (
+    {", ".join(f"{name} {definition}" for name, definition in COLUMN_TYPES.items())}
+);
+CREATE INDEX IF NOT EXISTS users_score_idx ON users (score DESC);
+CREATE TABLE IF NOT EXISTS referrals (
+    referrer_id TEXT NOT NULL REFERENCES users (user_id) ON DELETE CASCADE,
+    referred_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    PRIMARY KEY (referrer_id, referred_id)
+);
+CREATE INDEX IF NOT EXISTS referrals_referrer_created_idx ON referrals (referrer_id, created_at, referred_id);
+"""
+
+# Ошибки самих данных: нарушение ограничений (IntegrityError, в том числе
+# несовпадение типа) и значения, которые нельзя привязать к параметру запроса
+# (ProgrammingError, в старых версиях Python - InterfaceError). Остальные
+# ошибки, включая OperationalError (блокировка, занятый или полный диск,
+# ошибка ввода-вывода), считаются временными и могут быть повторены
+DATA_ERRORS = (sqlite3.IntegrityError, sqlite3.ProgrammingError, sqlite3.InterfaceError, TypeError, ValueError)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _encode(column: str, value: Any) -> Any:
+    if column in JSON_COLUMNS:
+        return None if value is None else json.dumps(value, ensure_ascii=False)
+    if column in BOOL_COLUMNS:
+        return int(bool(value))
+    return value
+
+
+def _decode(row: sqlite3.Row) -> Dict[str, Any]:
+    data = dict(row)
+    for column in JSON_COLUMNS & data.keys():
+        if data[column] is not None:
+            data[column] = json.loads(data[column])
+    for column in BOOL_COLUMNS & data.keys():
+        data[column] = bool(data[column])
+    return data
+
+
+class SQLiteStore(UserStore):
+    """Таблицы users и referrals в файле SQLite"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        # Один поток - одно соединение: sqlite3 не любит соединения, общие для потоков
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-store")
+        self._conn: Optional[sqlite3.Connection] = None
+        self._executor.submit(self._connect).result()
+
+    def _connect(self) -> None:
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+
+    async def _run(self, func: Callable, *args) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _write(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Выполняет изменения в одной транзакции"""
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(conn)
+        except DATA_ERRORS as e:
+            conn.execute("ROLLBACK")
+            raise DataError(str(e)) from e
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _fetch_one(self, sql: str, params: tuple = ()) -> Optional[Dict[str, Any]]:
+        row = self._conn.execute(sql, params).fetchone()
+        return _decode(row) if row is not None else None
+
+    def _fetch_all(self, sql: str, params: tuple = ()) -> List[Dict[str, Any]]:
+        return [_decode(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    # --- пользователи ---
+
+    async def get_user(self, user_id: str, columns: Sequence[str] = SESSION_COLUMNS) -> Optional[Dict[str, Any]]:
+        check_columns(columns)
+        return await self._run(
+            self._fetch_one, f"SELECT {', '.join(columns)} FROM users WHERE user_id = ?", (str(user_id),)
+        )
+
+    async def upsert_users(self, rows: List[Dict[str, Any]]) -> None:
+        def upsert(conn: sqlite3.Connection) -> None:
+            groups: Dict[tuple, List[Dict[str, Any]]] = {}
+            for row in rows:
+                groups.setdefault(tuple(sorted(row)), []).append(row)
+            for columns, group in groups.items():
+                unknown = set(columns) - COLUMN_TYPES.keys()
+                if unknown or "user_id" not in columns:
+                    raise ValueError(f"Invalid columns for users: {sorted(unknown) or 'user_id is required'}")
+                updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != "user_id") or "user_id = user_id"
+                conn.executemany(
+                    f"INSERT INTO users ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                    f"ON CONFLICT(user_id) DO UPDATE SET {updates}",
+                    [tuple(_encode(c, row[c]) for c in columns) for row in group],
+                )
+
+        await self._run(self._write, upsert)
+
+    async def update_user(self, user_id: str, fields: Dict[str, Any]) -> None:
+        def update(conn: sqlite3.Connection) -> None:
+            unknown = fields.keys() - COLUMN_TYPES.keys()
+            if unknown:
+                raise ValueError(f"Invalid columns for users: {sorted(unknown)}")
+            if fields:
+                conn.execute(
+                    f"UPDATE users SET {', '.join(f'{c} = ?' for c in fields)} WHERE user_id = ?",
+                    (*(_encode(c, v) for c, v in fields.items()), str(user_id)),
+                )
+
+        await self._run(self._write, update)
+
+    async def delete_user(self, user_id: str) -> None:
+        await self._run(self._write, lambda conn: conn.execute("DELETE FROM users WHERE user_id = ?", (str(user_id),)))
+
+    # --- рейтинг ---
+
+    async def list_users(self, after_user_id: str = "", limit: int = 1000) -> List[Dict[str, Any]]:
+        return await self._run(
+            self._fetch_all,
+            f"SELECT {', '.join(LEADERBOARD_COLUMNS)} FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+            (after_user_id, limit),
+        )
+
+    async def top_users(self, limit: int = 100) -> List[Dict[str, Any]]:
+        return await self._run(
+            self._fetch_all,
+            f"SELECT {', '.join(LEADERBOARD_COLUMNS)} FROM users ORDER BY score DESC LIMIT ?",
+            (limit,),
+        )
+
+    # --- атомарные изменения ---
+
+    async def increment_score(self, user_id: str, delta: int) -> Optional[Dict[str, Any]]:
+        def increment(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            row = conn.execute(
+                "UPDATE users SET score = score + ? WHERE user_id = ? RETURNING score", (delta, str(user_id))
+            ).fetchone()
+            return dict(row) if row is not None else None
+
+        return await self._run(self._write, increment)
+
+    async def record_ad_view(self, user_id: str) -> Optional[Dict[str, Any]]:
+        def record(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            row = conn.execute(
+                "UPDATE users SET ads_watched = ads_watched + 1, last_ad_time = ? "
+                "WHERE user_id = ? RETURNING ads_watched, last_ad_time",
+                (_now(), str(user_id)),
+            ).fetchone()
+            return dict(row) if row is not None else None
+
+        return await self._run(self._write, record)
+
+    async def claim_ad_reward(self, user_id: str, required: int, reward: int) -> Optional[Dict[str, Any]]:
+        def claim(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            row = conn.execute(
+                "UPDATE users SET ads_watched = ads_watched - ?, score = score + ? "
+                "WHERE user_id = ? AND ads_watched >= ? RETURNING ads_watched, score",
+                (required, reward, str(user_id), required),
+            ).fetchone()
+            if row is not None:
+                return {"claimed": True, **dict(row)}
+            row = conn.execute("SELECT ads_watched, score FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+            return {"claimed": False, **dict(row)} if row is not None else None
+
+        return await self._run(self._write, claim)
+
+    async def claim_task_reward(self, user_id: str, task_id: str, reward: int) -> Optional[Dict[str, Any]]:
+        def claim(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            row = conn.execute(
+                f"SELECT {', '.join(TASK_COLUMNS)} FROM users WHERE user_id = ?", (str(user_id),)
+            ).fetchone()
+            if row is None:
+                return None
+
+            data = _decode(row)
+            changes = apply_task_claim(task_id, data)
+            if changes is not None:
+                data.update(changes)
+                data["score"] += reward
+                fields = {**changes, "score": data["score"]}
+                conn.execute(
+                    f"UPDATE users SET {', '.join(f'{c} = ?' for c in fields)} WHERE user_id = ?",
+                    (*(_encode(c, v) for c, v in fields.items()), str(user_id)),
+                )
+            return {
+                "claimed": changes is not None,
+                "score": data["score"],
+                "wallet_task_completed": data["wallet_task_completed"],
+                "channel_task_completed": data["channel_task_completed"],
+                "last_referral_task_completion": data["last_referral_task_completion"],
+            }
+
+        return await self._run(self._write, claim)
+
+    async def purchase_upgrade(self, user_id: str, upgrade_id: str, cost: int) -> Optional[Dict[str, Any]]:
+        def purchase(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            row = conn.execute("SELECT score, upgrades FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+            if row is None:
+                return None
+
+            upgrades = json.loads(row["upgrades"] or "[]")
+            purchased = upgrade_id not in upgrades and row["score"] >= cost
+            score = row["score"]
+            if purchased:
+                upgrades.append(upgrade_id)
+                score -= cost
+                conn.execute(
+                    "UPDATE users SET score = ?, upgrades = ? WHERE user_id = ?",
+                    (score, _encode("upgrades", upgrades), str(user_id)),
+                )
+            return {"purchased": purchased, "score": score, "upgrades": upgrades}
+
+        return await self._run(self._write, purchase)
+
+    async def claim_daily_bonus(self, user_id: str, rewards: List[int]) -> Dict[str, Any]:
+        def claim(conn: sqlite3.Connection) -> Dict[str, Any]:
+            row = conn.execute(
+                f"SELECT {', '.join(DAILY_BONUS_COLUMNS)} FROM users WHERE user_id = ?", (str(user_id),)
+            ).fetchone()
+            if row is None:
+                return {"status": "error", "message": "User not found"}
+
+            daily_bonus = json.loads(row["daily_bonus"]) if row["daily_bonus"] else None
+            result = apply_daily_bonus(daily_bonus, rewards)
+            if result["status"] == "success":
+                result["score"] = row["score"] + result["reward"]
+                conn.execute(
+                    "UPDATE users SET score = ?, daily_bonus = ? WHERE user_id = ?",
+                    (result["score"], _encode("daily_bonus", result["daily_bonus"]), str(user_id)),
+                )
+            return result
+
+        return await self._run(self._write, claim)
+
+    # --- рефералы ---
+
+    async def append_referral(self, user_id: str, referred_id: str) -> Optional[Dict[str, Any]]:
+        def append(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            row = conn.execute("SELECT referral_count FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+            if row is None:
+                return None
+            inserted = conn.execute(
+                "INSERT INTO referrals (referrer_id, referred_id, created_at) VALUES (?, ?, ?) ON CONFLICT DO NOTHING",
+                (str(user_id), referred_id, _now()),
+            ).rowcount
+            if not inserted:
+                return {"referral_count": row["referral_count"], "added": False}
+            count = conn.execute(
+                "UPDATE users SET referral_count = referral_count + 1 WHERE user_id = ? RETURNING referral_count",
+                (str(user_id),),
+            ).fetchone()["referral_count"]
+            return {"referral_count": count, "added": True}
+
+        return await self._run(self._write, append)
+
+    async def list_referrals(self, user_id: str, limit: int, offset: int) -> List[Dict[str, Any]]:
+        return await self._run(
+            self._fetch_all,
+            "SELECT referred_id, created_at FROM referrals WHERE referrer_id = ? "
+            "ORDER BY created_at, referred_id LIMIT ? OFFSET ?",
+            (str(user_id), limit, offset),
+        )
+
+    # --- достижения ---
+
+    async def get_achievements(self, user_id: str) -> Optional[List[str]]:
+        row = await self._run(self._fetch_one, "SELECT achievements FROM users WHERE user_id = ?", (str(user_id),))
+        return None if row is None else (row["achievements"] or [])
+
+    async def append_achievement(self, user_id: str, achievement_id: str, reward: int = 0) -> Optional[Dict[str, Any]]:
+        def append(conn: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            row = conn.execute("SELECT achievements, score FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+            if row is None:
+                return None
+            achievements = json.loads(row["achievements"] or "[]")
+            added = achievement_id not in achievements
+            score = row["score"]
+            if added:
+                achievements.append(achievement_id)
+                score += reward
+                conn.execute(
+                    "UPDATE users SET achievements = ?, score = ? WHERE user_id = ?",
+                    (_encode("achievements", achievements), score, str(user_id)),
+                )
+            return {"achievements": achievements, "added": added, "score": score}
+
+        return await self._run(self._write, append)
+
+    async def close(self) -> None:
+        def close() -> None:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+        await self._run(close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,143 @@
+"""Хранилище в Supabase (PostgREST).
+
+Атомарные изменения выполняются хранимыми функциями из sql/atomic_updates.sql
+и sql/referrals.sql, поэтому их нужно применить к базе перед запуском.
+"""
+from typing import Any, Dict, List, Optional, Sequence
+
+from storage import AsyncSupabaseClient, SupabaseAPIError, create_async_client
+from stores.base import (
+    LEADERBOARD_COLUMNS,
+    REFERRAL_TASK_COOLDOWN,
+    REFERRAL_TASK_REQUIRED,
+    SESSION_COLUMNS,
+    DataError,
+    UserStore,
+    check_columns,
+)
+
+
+# Ответы 4xx, которые говорят о нагрузке, а не о данных: таймаут запроса (408)
+# и превышение лимита запросов (429). 409 у PostgREST - нарушение уникальности
+# или внешнего ключа, то есть ошибка в данных
+TRANSIENT_STATUS_CODES = {408, 429}
+
+
+def _translate(error: SupabaseAPIError) -> Exception:
+    # Остальные 4xx - ошибка в самих данных; 5xx, 408 и 429 могут пройти при повторе
+    # (после Retry-After, если сервер его прислал: error.retry_after)
+    status_code = error.status_code
+    if status_code is not None and 400 <= status_code < 500 and status_code not in TRANSIENT_STATUS_CODES:
+        return DataError(str(error))
+    return error
+
+
+class SupabaseStore(UserStore):
+    """Хранилище поверх асинхронного клиента PostgREST"""
+
+    name = "supabase"
+
+    def __init__(self, client: AsyncSupabaseClient):
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url: str, key: str, **kwargs) -> "SupabaseStore":
+        return cls(create_async_client(url, key, **kwargs))
+
+    async def _execute(self, builder) -> List[Any]:
+        try:
+            return (await builder.execute()).data
+        except SupabaseAPIError as e:
+            raise _translate(e) from e
+
+    async def _first(self, builder) -> Optional[Any]:
+        data = await self._execute(builder)
+        return data[0] if data else None
+
+    async def get_user(self, user_id: str, columns: Sequence[str] = SESSION_COLUMNS) -> Optional[Dict[str, Any]]:
+        check_columns(columns)
+        return await self._first(self.client.table("users").select(", ".join(columns)).eq("user_id", user_id))
+
+    async def upsert_users(self, rows: List[Dict[str, Any]]) -> None:
+        # Один запрос, чтобы пакет записывался целиком или не записывался вовсе.
+        # PostgREST требует одинаковый набор колонок во всех строках запроса:
+        # смешанные пакеты делит chunk_rows
+        if not rows:
+            return
+        if any(row.keys() != rows[0].keys() for row in rows):
+            raise DataError("All rows of one upsert must have the same columns")
+        await self._execute(self.client.table("users").upsert(rows, on_conflict="user_id"))
+
+    async def update_user(self, user_id: str, fields: Dict[str, Any]) -> None:
+        await self._execute(self.client.table("users").update(fields).eq("user_id", user_id))
+
+    async def delete_user(self, user_id: str) -> None:
+        await self._execute(self.client.table("users").delete().eq("user_id", user_id))
+
+    async def list_users(self, after_user_id: str = "", limit: int = 1000) -> List[Dict[str, Any]]:
+        return await self._execute(
+            self.client.table("users").select(", ".join(LEADERBOARD_COLUMNS))
+            .gt("user_id", after_user_id).order("user_id").limit(limit)
+        )
+
+    async def top_users(self, limit: int = 100) -> List[Dict[str, Any]]:
+        return await self._execute(
+            self.client.table("users").select(", ".join(LEADERBOARD_COLUMNS)).order("score", desc=True).limit(limit)
+        )
+
+    async def increment_score(self, user_id: str, delta: int) -> Optional[Dict[str, Any]]:
+        return await self._first(self.client.rpc("increment_score", {"p_user_id": user_id, "p_delta": delta}))
+
+    async def record_ad_view(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return await self._first(self.client.rpc("record_ad_view", {"p_user_id": user_id}))
+
+    async def claim_ad_reward(self, user_id: str, required: int, reward: int) -> Optional[Dict[str, Any]]:
+        return await self._first(
+            self.client.rpc("claim_ad_reward", {"p_user_id": user_id, "p_required": required, "p_reward": reward})
+        )
+
+    async def claim_task_reward(self, user_id: str, task_id: str, reward: int) -> Optional[Dict[str, Any]]:
+        return await self._first(
+            self.client.rpc("claim_task_reward", {
+                "p_user_id": user_id,
+                "p_task_id": task_id,
+                "p_reward": reward,
+                "p_referrals_required": REFERRAL_TASK_REQUIRED,
+                "p_referral_cooldown": int(REFERRAL_TASK_COOLDOWN.total_seconds()),
+            })
+        )
+
+    async def purchase_upgrade(self, user_id: str, upgrade_id: str, cost: int) -> Optional[Dict[str, Any]]:
+        return await self._first(
+            self.client.rpc("purchase_upgrade", {"p_user_id": user_id, "p_upgrade_id": upgrade_id, "p_cost": cost})
+        )
+
+    async def claim_daily_bonus(self, user_id: str, rewards: List[int]) -> Dict[str, Any]:
+        result = await self._first(self.client.rpc("claim_daily_bonus", {"p_user_id": user_id, "p_rewards": rewards}))
+        return result or {"status": "error", "message": "Failed to update user data"}
+
+    async def append_referral(self, user_id: str, referred_id: str) -> Optional[Dict[str, Any]]:
+        return await self._first(
+            self.client.rpc("append_referral", {"p_user_id": user_id, "p_referred_id": referred_id})
+        )
+
+    async def list_referrals(self, user_id: str, limit: int, offset: int) -> List[Dict[str, Any]]:
+        return await self._execute(
+            self.client.table("referrals").select("referred_id, created_at").eq("referrer_id", user_id)
+            .order("created_at").order("referred_id").range(offset, offset + limit - 1)
+        )
+
+    async def get_achievements(self, user_id: str) -> Optional[List[str]]:
+        row = await self._first(self.client.table("users").select("achievements").eq("user_id", user_id))
+        return None if row is None else (row.get("achievements") or [])
+
+    async def append_achievement(self, user_id: str, achievement_id: str, reward: int = 0) -> Optional[Dict[str, Any]]:
+        return await self._first(
+            self.client.rpc(
+                "append_achievement",
+                {"p_user_id": user_id, "p_achievement_id": achievement_id, "p_reward": reward},
+            )
+        )
+
+    async def close(self) -> None:
+        await self.client.aclose()
@@ -0,0 +1,68 @@
+"""Общие фикстуры: хранилища в памяти и в SQLite и приложение поверх них"""
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# main выбирает хранилище при импорте: без сети и без файла app.db в рабочем каталоге
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from circuit_breaker import CircuitBreaker, RetryBudget  # noqa: E402
+from leaderboard import Leaderboard  # noqa: E402
+from stores import MemoryStore, SQLiteStore  # noqa: E402
+from user_cache import UserCache  # noqa: E402
+from write_buffer import WriteBehindBuffer  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+async def store(request, tmp_path):
+    store = MemoryStore() if request.param == "memory" else SQLiteStore(str(tmp_path / "app.db"))
+    yield store
+    await store.close()
+
+
+@pytest.fixture
+def app(store, monkeypatch):
+    """Модуль main поверх хранилища теста, с чистыми кэшем, буфером, размыкателем и бюджетом повторов.
+
+    Буфер не запускается: тест сбрасывает его сам (write_buffer.flush)
+    """
+    import main
+
+    monkeypatch.setattr(main, "store", store)
+    monkeypatch.setattr(main, "user_cache", UserCache(max_size=1000, ttl=300))
+    monkeypatch.setattr(main, "leaderboard", Leaderboard())
+    monkeypatch.setattr(main, "write_buffer", WriteBehindBuffer(main.upsert_users_batch, flush_interval=60, max_pending=2))
+    monkeypatch.setattr(main, "storage_breaker", CircuitBreaker(failure_ratio=0.5, window=4, min_calls=2, recovery_timeout=60))
+    monkeypatch.setattr(main, "retry_budget", RetryBudget(ratio=0.1, min_per_second=0, capacity=10))
+    # Повторы без пауз, чтобы тесты не ждали
+    monkeypatch.setattr(main, "storage_backoff", lambda retry_state: 0)
+    return main
+
+
+@pytest.fixture
+def fail_method(monkeypatch):
+    """Подменяет метод хранилища: пока state["down"], он падает с error; state["calls"] - число вызовов"""
+    return lambda obj, name, error=ConnectionError("storage is down"): _fail_method(monkeypatch, obj, name, error)
+
+
+def _fail_method(monkeypatch, obj, name: str, error: Exception) -> dict:
+    original = getattr(obj, name)
+    state = {"down": True, "calls": 0}
+
+    async def method(*args, **kwargs):
+        state["calls"] += 1
+        if state["down"]:
+            raise error
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(obj, name, method)
+    return state
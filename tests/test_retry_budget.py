@@ -0,0 +1,76 @@
+"""Учёт бюджета повторов в execute_storage_query: токен тратится только на повтор, который действительно будет"""
+import pytest
+
+from circuit_breaker import CircuitBreaker, RetryBudget
+from stores import DataError
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def app(app, monkeypatch):
+    # Размыкатель не должен вмешиваться в число попыток
+    monkeypatch.setattr(app, "storage_breaker", CircuitBreaker(min_calls=100))
+    return app
+
+
+async def test_idempotent_query_spends_only_real_retries(app, fail_method):
+    state = fail_method(app.store, "get_user")
+
+    with pytest.raises(ConnectionError):
+        await app.execute_storage_query(lambda: app.store.get_user("u1"))
+
+    assert state["calls"] == app.STORAGE_RETRY_ATTEMPTS
+    assert app.retry_budget.stats == {"retries": app.STORAGE_RETRY_ATTEMPTS - 1, "exhausted": 0}
+
+
+async def test_non_idempotent_query_is_not_retried(app, fail_method):
+    state = fail_method(app.store, "increment_score")
+
+    with pytest.raises(ConnectionError):
+        await app.execute_storage_query(lambda: app.store.increment_score("u1", 10), idempotent=False)
+
+    assert state["calls"] == 1
+    assert app.retry_budget.stats == {"retries": 0, "exhausted": 0}
+
+
+async def test_data_error_is_not_retried(app, fail_method):
+    state = fail_method(app.store, "get_user", DataError("invalid input"))
+
+    with pytest.raises(DataError):
+        await app.execute_storage_query(lambda: app.store.get_user("u1"))
+
+    assert state["calls"] == 1
+    assert app.retry_budget.stats == {"retries": 0, "exhausted": 0}
+
+
+async def test_retry_after_recovery_returns_result(app, fail_method, monkeypatch):
+    await app.store.upsert_users([{"user_id": "u1", "first_name": "Test"}])
+    state = fail_method(app.store, "get_user")
+    original = app.store.get_user
+
+    async def recover_after_first_call(*args, **kwargs):
+        try:
+            return await original(*args, **kwargs)
+        finally:
+            state["down"] = False
+
+    monkeypatch.setattr(app.store, "get_user", recover_after_first_call)
+
+    row = await app.execute_storage_query(lambda: app.store.get_user("u1", ("user_id",)))
+
+    assert row == {"user_id": "u1"}
+    assert state["calls"] == 2
+    assert app.retry_budget.stats == {"retries": 1, "exhausted": 0}
+
+
+async def test_exhausted_budget_stops_retries(app, fail_method, monkeypatch):
+    monkeypatch.setattr(app, "retry_budget", RetryBudget(ratio=0, min_per_second=0, capacity=1))
+    state = fail_method(app.store, "get_user")
+
+    with pytest.raises(ConnectionError):
+        await app.execute_storage_query(lambda: app.store.get_user("u1"))
+
+    # Один повтор из бюджета, затем отказ без третьей попытки
+    assert state["calls"] == 2
+    assert app.retry_budget.stats == {"retries": 1, "exhausted": 1}
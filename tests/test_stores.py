@@ -0,0 +1,132 @@
+"""Атомарные изменения хранилищ: награды и покупки проходят ровно один раз"""
+import pytest
+
+from stores import DataError
+
+pytestmark = pytest.mark.anyio
+
+DAILY_REWARDS = [100, 200, 300, 400, 500, 600, 1000]
+
+
+async def create_user(store, user_id: str = "u1", **fields):
+    await store.upsert_users([{"user_id": user_id, "first_name": "Test", **fields}])
+
+
+async def test_new_row_gets_defaults_for_missing_columns(store):
+    await store.upsert_users([{"user_id": "u1", "first_name": "Test"}])
+
+    row = await store.get_user("u1", ("user_id", "score", "total_clicks", "ads_watched", "upgrades", "achievements"))
+    assert row == {"user_id": "u1", "score": 0, "total_clicks": 0, "ads_watched": 0, "upgrades": [], "achievements": []}
+
+
+async def test_profile_upsert_keeps_counters(store):
+    await create_user(store, score=700)
+
+    await store.upsert_users([{"user_id": "u1", "first_name": "Renamed"}])
+
+    assert await store.get_user("u1", ("first_name", "score")) == {"first_name": "Renamed", "score": 700}
+
+
+async def test_claim_ad_reward_is_paid_once_per_required_views(store):
+    await create_user(store)
+    for _ in range(15):
+        await store.record_ad_view("u1")
+
+    first = await store.claim_ad_reward("u1", 10, 5000)
+    second = await store.claim_ad_reward("u1", 10, 5000)
+
+    assert first == {"claimed": True, "ads_watched": 5, "score": 5000}
+    assert second == {"claimed": False, "ads_watched": 5, "score": 5000}
+
+
+async def test_claim_ad_reward_missing_user(store):
+    assert await store.claim_ad_reward("nobody", 10, 5000) is None
+
+
+async def test_claim_daily_bonus_is_paid_once_per_day(store):
+    await create_user(store)
+
+    first = await store.claim_daily_bonus("u1", DAILY_REWARDS)
+    second = await store.claim_daily_bonus("u1", DAILY_REWARDS)
+
+    assert first["status"] == "success"
+    assert first["reward"] == 100 and first["score"] == 100
+    assert second == {"status": "error", "message": "Daily bonus already claimed today"}
+    assert (await store.get_user("u1", ("score",)))["score"] == 100
+
+
+async def test_append_achievement_credits_reward_once(store):
+    await create_user(store)
+
+    first = await store.append_achievement("u1", "first_click", 100)
+    second = await store.append_achievement("u1", "first_click", 100)
+
+    assert first == {"achievements": ["first_click"], "added": True, "score": 100}
+    assert second == {"achievements": ["first_click"], "added": False, "score": 100}
+
+
+async def test_purchase_upgrade_checks_score_and_charges_once(store):
+    await create_user(store, score=150)
+
+    assert (await store.purchase_upgrade("u1", "upgrade2", 500))["purchased"] is False
+    first = await store.purchase_upgrade("u1", "upgrade1", 100)
+    second = await store.purchase_upgrade("u1", "upgrade1", 100)
+
+    assert first == {"purchased": True, "score": 50, "upgrades": ["upgrade1"]}
+    assert second == {"purchased": False, "score": 50, "upgrades": ["upgrade1"]}
+
+
+async def test_claim_task_reward_is_paid_once(store):
+    await create_user(store)
+
+    first = await store.claim_task_reward("u1", "channel_subscription", 2000)
+    second = await store.claim_task_reward("u1", "channel_subscription", 2000)
+
+    assert first["claimed"] is True and first["score"] == 2000 and first["channel_task_completed"] is True
+    assert second["claimed"] is False and second["score"] == 2000
+
+
+async def test_wallet_task_needs_wallet_address(store):
+    await create_user(store)
+    assert (await store.claim_task_reward("u1", "wallet_task", 1000))["claimed"] is False
+
+    await store.update_user("u1", {"wallet_address": "EQ-test"})
+    result = await store.claim_task_reward("u1", "wallet_task", 1000)
+
+    assert result["claimed"] is True and result["wallet_task_completed"] is True and result["score"] == 1000
+
+
+async def test_referral_task_needs_referrals_and_cooldown(store):
+    await create_user(store)
+    for i in range(2):
+        await store.append_referral("u1", f"friend-{i}")
+    assert (await store.claim_task_reward("u1", "referral_task", 5000))["claimed"] is False
+
+    await store.append_referral("u1", "friend-2")
+    first = await store.claim_task_reward("u1", "referral_task", 5000)
+    second = await store.claim_task_reward("u1", "referral_task", 5000)
+
+    assert first["claimed"] is True and first["last_referral_task_completion"]
+    assert second["claimed"] is False and second["score"] == 5000
+
+
+async def test_unknown_task_is_data_error(store):
+    await create_user(store)
+
+    with pytest.raises(DataError):
+        await store.claim_task_reward("u1", "no_such_task", 1)
+
+
+async def test_app_claims_are_idempotent(app):
+    await app.save_user({"id": "u1", "first_name": "Test"})
+    for _ in range(10):
+        await app.store.record_ad_view("u1")
+
+    assert (await app.claim_ad_reward("u1"))["status"] == "success"
+    assert (await app.claim_ad_reward("u1"))["message"] == "Not enough ads watched"
+    assert (await app.claim_daily_bonus("u1"))["status"] == "success"
+    assert (await app.claim_daily_bonus("u1"))["message"] == "Daily bonus already claimed today"
+
+    user = await app.load_user("u1")
+    assert user.score == app.ADS_TASK_REWARD + DAILY_REWARDS[0]
+    assert user.level == app.LEVEL_TABLE.index(user.score)
@@ -0,0 +1,121 @@
+"""Отложенная запись при недоступном хранилище: что попадает в буфер и что остается после восстановления"""
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from write_buffer import WriteBehindBuffer, WriteBufferFull
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_cached_user(app, user_id: str) -> None:
+    assert await app.save_user({"id": user_id, "first_name": "Test"})
+    # Обновление откладывается только для пользователя, который уже есть в кэше
+    assert await app.load_user(user_id) is not None
+
+
+def recover(app, monkeypatch, state: dict) -> None:
+    state["down"] = False
+    monkeypatch.setattr(app, "storage_breaker", CircuitBreaker())
+
+
+async def test_failed_create_is_not_buffered(app, fail_method, monkeypatch):
+    state = fail_method(app.store, "upsert_users")
+
+    # Повторы размыкают цепь, и эндпоинт ответит 503 с Retry-After
+    with pytest.raises(CircuitOpenError):
+        await app.save_user({"id": "u1", "first_name": "Test"})
+    assert len(app.write_buffer) == 0
+    assert app.user_cache.get("u1") is None
+
+    recover(app, monkeypatch, state)
+    await app.write_buffer.flush()
+
+    assert await app.store.get_user("u1") is None
+
+
+async def test_open_circuit_rejects_create(app, fail_method, monkeypatch):
+    breaker = CircuitBreaker(min_calls=1, recovery_timeout=60)
+    breaker.record_failure()
+    monkeypatch.setattr(app, "storage_breaker", breaker)
+    state = fail_method(app.store, "upsert_users")
+
+    with pytest.raises(CircuitOpenError):
+        await app.save_user({"id": "u1", "first_name": "Test"})
+
+    assert state["calls"] == 0
+    assert len(app.write_buffer) == 0
+
+
+async def test_buffered_update_survives_outage(app, fail_method, monkeypatch):
+    await create_cached_user(app, "u1")
+    await app.store.increment_score("u1", 500)
+    await app.store.append_achievement("u1", "first_click")
+    state = fail_method(app.store, "upsert_users")
+
+    assert await app.save_user({"id": "u1", "first_name": "Renamed"})
+    await app.write_buffer.flush()
+
+    # Неудавшийся сброс возвращает запись в буфер
+    assert app.write_buffer.get_pending("u1")["first_name"] == "Renamed"
+    assert app.write_buffer.stats["rows_retried"] == 1
+
+    recover(app, monkeypatch, state)
+    await app.write_buffer.flush()
+
+    assert len(app.write_buffer) == 0
+    row = await app.store.get_user("u1", ("first_name", "score", "achievements"))
+    assert row == {"first_name": "Renamed", "score": 500, "achievements": ["first_click"]}
+
+
+async def test_full_buffer_rejects_new_users_during_outage(app, fail_method, monkeypatch):
+    for user_id in ("u1", "u2", "u3"):
+        await create_cached_user(app, user_id)
+    state = fail_method(app.store, "upsert_users")
+    buffer = app.write_buffer
+
+    await app.save_user({"id": "u1", "first_name": "One"})
+    await app.save_user({"id": "u2", "first_name": "Two"})
+
+    with pytest.raises(WriteBufferFull):
+        await app.save_user({"id": "u3", "first_name": "Three"})
+    assert buffer.stats["rejected"] == 1
+    assert len(buffer) == buffer.max_pending
+    # Отклоненная запись не остается в кэше как сохраненная
+    assert app.user_cache.get("u3")["first_name"] == "Test"
+
+    # Изменения уже отложенного пользователя объединяются и места не требуют
+    await app.save_user({"id": "u1", "first_name": "One again"})
+    assert buffer.stats["coalesced"] == 1
+
+    recover(app, monkeypatch, state)
+    assert await app.save_user({"id": "u3", "first_name": "Three"})
+    await buffer.flush()
+
+    names = [(await app.store.get_user(user_id, ("first_name",)))["first_name"] for user_id in ("u1", "u2", "u3")]
+    assert names == ["One again", "Two", "Three"]
+
+
+async def test_buffer_limit_without_app(store, fail_method):
+    state = fail_method(store, "upsert_users")
+
+    async def flush_rows(rows):
+        try:
+            await store.upsert_users(rows)
+        except ConnectionError:
+            return [row["user_id"] for row in rows]
+        return []
+
+    buffer = WriteBehindBuffer(flush_rows, flush_interval=5, max_pending=1)
+    await buffer.put({"user_id": "u1", "first_name": "One"})
+
+    with pytest.raises(WriteBufferFull) as error:
+        await buffer.put({"user_id": "u2", "first_name": "Two"})
+    assert error.value.retry_after == 5
+    assert buffer.stats["rejected"] == 1
+
+    state["down"] = False
+    await buffer.put({"user_id": "u2", "first_name": "Two"})
+    await buffer.flush()
+
+    assert await store.get_user("u1", ("first_name",)) == {"first_name": "One"}
+    assert await store.get_user("u2", ("first_name",)) == {"first_name": "Two"}
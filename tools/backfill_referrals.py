@@ -0,0 +1,104 @@
+"""Перенос рефералов из JSON-массивов users.referrals в таблицу referrals.
+
+Проходит по пользователям порциями (по возрастанию user_id), добавляет связи
+(referrer_id, referred_id) с пропуском уже существующих и пересчитывает
+users.referral_count по таблице связей. Запуск безопасно повторять и
+продолжать с места остановки (``--start-after``), в том числе пока приложение
+работает и добавляет новых рефералов.
+
+Перед запуском примените sql/referrals.sql и sql/atomic_updates.sql:
+
+    python tools/backfill_referrals.py --dry-run
+    python tools/backfill_referrals.py --batch-size 500
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dotenv import load_dotenv  # noqa: E402
+
+from storage import AsyncSupabaseClient, create_async_client  # noqa: E402
+
+# Сколько связей отправлять одним запросом
+EDGE_CHUNK_SIZE = 1000
+
+
+def collect_edges(rows: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """Связи из массивов рефералов (без дубликатов и ссылок на себя)"""
+    edges = []
+    for row in rows:
+        referrer_id = str(row["user_id"])
+        referrals = row.get("referrals")
+        if not isinstance(referrals, list):
+            continue
+        for referred_id in dict.fromkeys(str(r) for r in referrals if r is not None):
+            if referred_id and referred_id != referrer_id:
+                edges.append({"referrer_id": referrer_id, "referred_id": referred_id})
+    return edges
+
+
+async def backfill(client: AsyncSupabaseClient, batch_size: int, start_after: str, dry_run: bool) -> None:
+    last_id = start_after
+    users_seen = 0
+    edges_sent = 0
+    started = time.perf_counter()
+
+    while True:
+        rows = (await client.table("users").select("user_id, referrals").gt("user_id", last_id).order(
+            "user_id"
+        ).limit(batch_size).execute()).data
+        if not rows:
+            break
+
+        edges = collect_edges(rows)
+        referrer_ids = sorted({edge["referrer_id"] for edge in edges})
+
+        if not dry_run and edges:
+            for start in range(0, len(edges), EDGE_CHUNK_SIZE):
+                chunk = edges[start:start + EDGE_CHUNK_SIZE]
+                await client.table("referrals").upsert(
+                    chunk, on_conflict="referrer_id,referred_id", ignore_duplicates=True
+                ).execute()
+            await client.rpc("recount_referrals", {"p_user_ids": referrer_ids}).execute()
+
+        users_seen += len(rows)
+        edges_sent += len(edges)
+        last_id = str(rows[-1]["user_id"])
+        print(f"users: {users_seen}, edges: {edges_sent}, referrers in batch: {len(referrer_ids)}, last user_id: {last_id}")
+
+        if len(rows) < batch_size:
+            break
+
+    elapsed = time.perf_counter() - started
+    mode = " (dry run, nothing written)" if dry_run else ""
+    print(f"done in {elapsed:.1f}s: {users_seen} users, {edges_sent} edges{mode}")
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.environ.get("SUPABASE_URL", ""))
+    parser.add_argument("--key", default=os.environ.get("SUPABASE_KEY", ""))
+    parser.add_argument("--batch-size", type=int, default=500, help="пользователей за один проход")
+    parser.add_argument("--start-after", default="", help="продолжить после этого user_id")
+    parser.add_argument("--dry-run", action="store_true", help="только посчитать связи")
+    args = parser.parse_args()
+
+    async def run():
+        client = create_async_client(args.url, args.key)
+        try:
+            await backfill(client, args.batch_size, args.start_after, args.dry_run)
+        finally:
+            await client.aclose()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Миниатюры картинок улучшений: спрайт в AVIF, WebP и PNG.
+
+Исходные static/upgrade*.png весят больше 6 МБ (upgrade9.png - 2,3 МБ), а в
+окне улучшений показываются кружками 60x60 CSS-пикселей. Скрипт вырезает из
+каждой картинки центральный квадрат (как ``background-size: cover``),
+уменьшает до размера плитки и складывает все плитки в один ряд - спрайт.
+Спрайт строится для плотностей экрана 1x/2x/3x (60, 120 и 180 пикселей) в
+трех форматах; сервер отдает лучший из них по заголовку Accept (/img/...),
+а клиент получает порядок плиток из /config.
+
+Результат - файлы static/thumbs/upgrades-<размер>.<хэш>.<формат> и
+static/thumbs/manifest.json. Их нужно пересобрать и закоммитить после
+изменения картинок:
+
+    pip install pillow
+    python tools/build_thumbnails.py
+"""
+import argparse
+import hashlib
+import io
+import json
+import re
+import sys
+from pathlib import Path
+from typing import Dict, List, Sequence
+
+from PIL import Image, ImageOps
+
+STATIC_DIR = Path(__file__).resolve().parent.parent / "static"
+
+# Размер плитки в CSS-пикселях (.upgrade-image) и плотности экрана
+TILE_SIZE = 60
+DENSITIES = (1, 2, 3)
+
+# Форматы от лучшего к запасному: (расширение, сжимать палитру из 256 цветов, настройки).
+# На этой графике палитра без потерь дает WebP и PNG меньше, чем WebP с потерями
+FORMATS = {
+    "image/avif": ("avif", False, {"quality": 55, "speed": 4}),
+    "image/webp": ("webp", True, {"lossless": True, "quality": 100, "method": 6}),
+    "image/png": ("png", True, {"optimize": True}),
+}
+FALLBACK_FORMAT = "image/png"
+
+
+def natural_key(path: Path) -> List:
+    """upgrade2 раньше upgrade10"""
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", path.stem)]
+
+
+def build_sprite(images: Sequence[Image.Image], tile: int) -> Image.Image:
+    """Плитки tile x tile в один ряд, центральный квадрат каждой картинки"""
+    sprite = Image.new("RGBA", (tile * len(images), tile), (0, 0, 0, 0))
+    for index, image in enumerate(images):
+        sprite.paste(ImageOps.fit(image, (tile, tile), Image.LANCZOS), (index * tile, 0))
+    return sprite
+
+
+def encode(image: Image.Image, format_name: str, options: Dict) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format=format_name, **options)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pattern", default="upgrade*.png", help="исходные картинки в static/")
+    parser.add_argument("--name", default="upgrades", help="имя спрайта")
+    args = parser.parse_args()
+
+    sources = sorted(STATIC_DIR.glob(args.pattern), key=natural_key)
+    if not sources:
+        sys.exit(f"No images match static/{args.pattern}")
+    images = [Image.open(path).convert("RGBA") for path in sources]
+
+    output_dir = STATIC_DIR / "thumbs"
+    output_dir.mkdir(exist_ok=True)
+    for old_file in output_dir.glob(f"{args.name}-*"):
+        old_file.unlink()
+
+    manifest_images: Dict[str, Dict[str, str]] = {}
+    sizes = [TILE_SIZE * density for density in DENSITIES]
+    version = hashlib.blake2b(digest_size=6)
+    source_bytes = sum(path.stat().st_size for path in sources)
+    for size in sizes:
+        sprite = build_sprite(images, size)
+        palette_sprite = sprite.quantize(256, method=Image.Quantize.FASTOCTREE)
+        encoded = {media_type: encode(palette_sprite if palette else sprite, format_name, options)
+                   for media_type, (format_name, palette, options) in FORMATS.items()}
+        fallback_size = len(encoded[FALLBACK_FORMAT])
+        variants = {}
+        for media_type, content in encoded.items():
+            # Формат, который не легче запасного PNG, отдавать незачем
+            if media_type != FALLBACK_FORMAT and len(content) >= fallback_size:
+                print(f"{args.name}-{size} {media_type}: {len(content)} bytes, not smaller than PNG, skipped")
+                continue
+            format_name = FORMATS[media_type][0]
+            digest = hashlib.blake2b(content, digest_size=6).hexdigest()
+            version.update(content)
+            file_name = f"{args.name}-{size}.{digest}.{format_name}"
+            (output_dir / file_name).write_bytes(content)
+            variants[media_type] = f"thumbs/{file_name}"
+            print(f"{file_name:<40}{len(content):>10} bytes")
+        manifest_images[f"{args.name}-{size}"] = variants
+
+    manifest = {
+        "version": version.hexdigest(),
+        "sprites": {args.name: {"tile": TILE_SIZE, "sizes": sizes, "ids": [path.stem for path in sources]}},
+        "images": manifest_images,
+    }
+    (output_dir / "manifest.json").write_text(json.dumps(manifest, indent=2) + "\n")
+    print(f"{len(sources)} source images, {source_bytes} bytes -> static/thumbs/manifest.json")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Каталог улучшений, скомпилированный в таблицы.
+
+Раньше бонус за клик и пассивный доход считались перебором каталога для
+каждого купленного улучшения (``next(u for u in UPGRADES if ...)``), то есть
+за O(купленные x каталог) на каждое чтение пользователя. ``UpgradeTable``
+при старте строит словарь id -> номер бита и таблицы эффектов; набор
+купленных улучшений кодируется битовой маской, а суммы эффектов для всех
+масок считаются заранее (каждая маска - это маска без младшего бита плюс
+эффект этого бита), так что итог для игрока - одно обращение к списку.
+"""
+from typing import Any, Dict, Iterable, List, Mapping, Sequence, Tuple
+
+# Больше улучшений - суммы считаются по маске без общей таблицы
+MAX_TABLE_BITS = 16
+
+
+class UpgradeTable:
+    """Эффекты улучшений по битовым маскам"""
+
+    def __init__(self, catalog: Sequence[Mapping[str, Any]]):
+        self.ids: List[str] = [upgrade["id"] for upgrade in catalog]
+        self.bits: Dict[str, int] = {upgrade_id: 1 << i for i, upgrade_id in enumerate(self.ids)}
+        self.click_bonus: List[int] = [upgrade["effect"].get("clickBonus", 0) for upgrade in catalog]
+        self.passive_income: List[int] = [upgrade["effect"].get("passiveIncome", 0) for upgrade in catalog]
+
+        self._totals: List[Tuple[int, int]] = []
+        if len(self.ids) <= MAX_TABLE_BITS:
+            self._totals = [(0, 0)] * (1 << len(self.ids))
+            for mask in range(1, len(self._totals)):
+                lowest = (mask & -mask).bit_length() - 1
+                click, income = self._totals[mask & (mask - 1)]
+                self._totals[mask] = (click + self.click_bonus[lowest], income + self.passive_income[lowest])
+
+    def mask(self, upgrades: Iterable[str]) -> int:
+        """Маска купленных улучшений; неизвестные id и повторы не учитываются"""
+        bits = self.bits
+        mask = 0
+        for upgrade_id in upgrades:
+            mask |= bits.get(upgrade_id, 0)
+        return mask
+
+    def upgrades(self, mask: int) -> List[str]:
+        """Список id по маске (в порядке каталога)"""
+        return [upgrade_id for i, upgrade_id in enumerate(self.ids) if mask >> i & 1]
+
+    def totals(self, mask: int) -> Tuple[int, int]:
+        """(бонус за клик, пассивный доход за период) для набора улучшений"""
+        if self._totals:
+            return self._totals[mask]
+        click = income = 0
+        while mask:
+            lowest = (mask & -mask).bit_length() - 1
+            click += self.click_bonus[lowest]
+            income += self.passive_income[lowest]
+            mask &= mask - 1
+        return click, income
@@ -0,0 +1,112 @@
+"""Кэш записей пользователей в памяти процесса (LRU + TTL).
+
+Хранит строки таблицы ``users`` в том виде, в котором они лежат в базе.
+``load_user`` читает из кэша и обращается к Supabase только при промахе,
+``save_user`` обновляет кэш сквозной записью (write-through), поэтому
+повторные чтения активного игрока не доходят до базы.
+
+Просроченные записи не удаляются сразу, а остаются до вытеснения: пока
+хранилище недоступно, ``get_stale`` отдает последнюю известную версию.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class UserCache:
+    """Ограниченный по размеру кэш с вытеснением LRU и временем жизни записей"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Возвращает копию записи или None при промахе"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, record = entry
+        if expires_at <= self._clock():
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return dict(record)
+
+    def get_stale(self, key: str) -> Optional[Dict[str, Any]]:
+        """Возвращает копию записи, даже просроченной, или None"""
+        entry = self._entries.get(key)
+        return dict(entry[1]) if entry is not None else None
+
+    def put(self, key: str, record: Dict[str, Any], merge: bool = True) -> None:
+        """Сквозная запись: обновляет поля существующей записи или добавляет новую"""
+        if not self.enabled:
+            return
+        entry = self._entries.get(key)
+        if merge and entry is not None:
+            record = {**entry[1], **record}
+        self._store(key, record)
+
+    def update(self, key: str, fields: Dict[str, Any]) -> None:
+        """Обновляет поля записи, только если она уже есть в кэше"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        if entry[0] <= self._clock():
+            # Не продлеваем просроченную запись частичным обновлением
+            del self._entries[key]
+            return
+        self._store(key, {**entry[1], **fields})
+
+    def add(self, key: str, record: Dict[str, Any]) -> None:
+        """Добавляет запись, прочитанную из базы, если в кэше нет более свежей"""
+        if not self.enabled:
+            return
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > self._clock():
+            return
+        self._store(key, dict(record))
+
+    def invalidate(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _store(self, key: str, record: Dict[str, Any]) -> None:
+        self._entries[key] = (self._clock() + self.ttl, record)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
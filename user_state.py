@@ -0,0 +1,207 @@
+"""Компактное состояние пользователя в памяти.
+
+Раньше каждый запрос собирал словарь из ~25 ключей в ``load_user``, второй
+(``db_data``) в ``save_user`` и третий (``response_data``) в эндпоинте,
+каждый раз заново вызывая ``datetime.now().isoformat()`` для значений по
+умолчанию. ``UserState`` хранит поля в ``__slots__``, время - целыми
+миллисекундами эпохи, а зависимые значения (уровень, бонус за клик,
+пассивный доход) считает один раз и пересчитывает, только когда очки
+выходят за диапазон текущего уровня или меняются улучшения.
+
+Улучшения хранятся еще и битовой маской: суммы их эффектов берутся из
+таблицы ``UpgradeTable`` одним обращением и отдаются клиенту готовыми,
+чтобы он не пересчитывал их на каждый клик.
+
+Словарь собирается только на выходе: строка для базы (``to_row``) строится
+заранее подготовленным ``attrgetter``, ответ клиенту (``to_response``) -
+скомпилированным один раз ``RecordEncoder``; оба по фиксированным спискам
+полей.
+"""
+from operator import attrgetter
+from typing import Any, Dict, List, Mapping, Optional, Sequence
+
+from json_codec import RecordEncoder
+from levels import LevelTable
+from upgrades import UpgradeTable
+from settlement import format_epoch_ms, now_ms, settle_energy, settle_passive_income, to_epoch_ms
+
+# Колонки users, которые записывает приложение (referral_count ведет хранилище)
+ROW_COLUMNS = (
+    "user_id", "first_name", "last_name", "username", "photo_url", "score", "total_clicks", "level",
+    "wallet_address", "wallet_task_completed", "channel_task_completed", "energy", "last_energy_update",
+    "last_referral_task_completion", "upgrades", "ads_watched", "achievements", "daily_bonus", "language",
+    "last_passive_income_update", "last_ad_time",
+)
+
+# Поля ответа клиенту: (ключ в JSON, атрибут)
+RESPONSE_FIELDS = (
+    ("id", "user_id"), ("first_name", "first_name"), ("last_name", "last_name"), ("username", "username"),
+    ("photo_url", "photo_url"), ("score", "score"), ("total_clicks", "total_clicks"), ("level", "level"),
+    ("wallet_address", "wallet_address"), ("wallet_task_completed", "wallet_task_completed"),
+    ("channel_task_completed", "channel_task_completed"), ("referral_count", "referral_count"),
+    ("last_referral_task_completion", "last_referral_task_completion"), ("energy", "energy"),
+    ("last_energy_update", "last_energy_update"), ("upgrades", "upgrades"), ("ads_watched", "ads_watched"),
+    ("achievements", "achievements"), ("daily_bonus", "daily_bonus"), ("active_boosts", "active_boosts"),
+    ("skins", "skins"), ("active_skin", "active_skin"), ("auto_clickers", "auto_clickers"),
+    ("language", "language"), ("last_passive_income_update", "last_passive_income_update"),
+    ("last_ad_time", "last_ad_time"), ("click_bonus", "click_bonus"), ("passive_income", "passive_income"),
+)
+
+_row_values = attrgetter(*ROW_COLUMNS)
+RESPONSE_ENCODER = RecordEncoder(RESPONSE_FIELDS)
+_column_getters = {column: attrgetter(column) for column in ROW_COLUMNS + ("referral_count",)}
+
+
+class UserState:
+    """Состояние пользователя: поля в __slots__, время в миллисекундах эпохи"""
+
+    __slots__ = (
+        "user_id", "first_name", "last_name", "username", "photo_url", "score", "total_clicks",
+        "wallet_address", "wallet_task_completed", "channel_task_completed", "referral_count",
+        "energy", "ads_watched", "achievements", "daily_bonus", "language",
+        "skins", "active_skin", "auto_clickers", "active_boosts",
+        "last_energy_update_ms", "last_passive_income_update_ms", "last_ad_time_ms",
+        "last_referral_task_completion_ms",
+        "_upgrades", "_upgrades_mask", "_level", "_level_floor", "_level_ceiling", "_click_bonus", "_passive_income",
+    )
+
+    # Правила игры задаются в main.py через configure()
+    max_energy = 250
+    _level_table = LevelTable([{"score": 0, "name": ""}])
+    _upgrade_table = UpgradeTable([])
+
+    @classmethod
+    def configure(cls, max_energy: int, level_table: LevelTable, upgrade_table: UpgradeTable) -> None:
+        cls.max_energy = max_energy
+        cls._level_table = level_table
+        cls._upgrade_table = upgrade_table
+
+    @classmethod
+    def from_row(cls, row: Mapping[str, Any], now: Optional[int] = None) -> "UserState":
+        """Состояние из строки базы или данных клиента (id или user_id); недостающие поля - по умолчанию"""
+        now = now_ms() if now is None else now
+        get = row.get
+        state = cls.__new__(cls)
+
+        state.user_id = str(get("id", get("user_id", "")))
+        state.first_name = get("first_name") or ""
+        state.last_name = get("last_name") or ""
+        state.username = get("username") or ""
+        state.photo_url = get("photo_url") or ""
+        state.score = int(get("score") or 0)
+        state.total_clicks = int(get("total_clicks") or 0)
+        state.wallet_address = get("wallet_address") or ""
+        state.wallet_task_completed = bool(get("wallet_task_completed", False))
+        state.channel_task_completed = bool(get("channel_task_completed", False))
+        referral_count = get("referral_count")
+        state.referral_count = referral_count if isinstance(referral_count, int) else 0
+        state.ads_watched = int(get("ads_watched") or 0)
+        achievements = get("achievements")
+        state.achievements = achievements if isinstance(achievements, list) else []
+        state.daily_bonus = get("daily_bonus") or {"last_claim": None, "streak": 0, "claimed_days": []}
+        state.language = get("language") or "ru"
+        # Поля, которых нет в базе: живут только в памяти
+        state.skins = get("skins") or []
+        state.active_skin = get("active_skin") or "default"
+        state.auto_clickers = get("auto_clickers") or 0
+        state.active_boosts = get("active_boosts") or []
+
+        # Якоря без времени отсчитываются от текущего момента
+        energy = get("energy")
+        state.energy = cls.max_energy if energy is None else int(energy)
+        energy_anchor = to_epoch_ms(get("last_energy_update"))
+        state.last_energy_update_ms = now if energy_anchor is None else energy_anchor
+        income_anchor = to_epoch_ms(get("last_passive_income_update"))
+        state.last_passive_income_update_ms = now if income_anchor is None else income_anchor
+        last_ad_time = to_epoch_ms(get("last_ad_time"))
+        state.last_ad_time_ms = now if last_ad_time is None else last_ad_time
+        state.last_referral_task_completion_ms = to_epoch_ms(get("last_referral_task_completion"))
+
+        upgrades = get("upgrades")
+        state._upgrades = upgrades if isinstance(upgrades, list) else []
+        state._upgrades_mask = None
+        state._level = 0
+        state._level_floor = state._level_ceiling = 0
+        return state
+
+    # --- зависимые значения: считаются по требованию и кэшируются ---
+
+    @property
+    def upgrades(self) -> List[str]:
+        return self._upgrades
+
+    @upgrades.setter
+    def upgrades(self, value: List[str]) -> None:
+        self._upgrades = value
+        self._upgrades_mask = None
+
+    def _compile_upgrades(self) -> None:
+        self._upgrades_mask = self._upgrade_table.mask(self._upgrades)
+        self._click_bonus, self._passive_income = self._upgrade_table.totals(self._upgrades_mask)
+
+    @property
+    def upgrades_mask(self) -> int:
+        """Битовая маска купленных улучшений (номера битов - порядок каталога)"""
+        if self._upgrades_mask is None:
+            self._compile_upgrades()
+        return self._upgrades_mask
+
+    @property
+    def level(self) -> int:
+        """Индекс уровня; таблица порогов нужна только при переходе через порог"""
+        if not self._level_floor <= self.score < self._level_ceiling:
+            self._level = self._level_table.index(self.score)
+            self._level_floor, self._level_ceiling = self._level_table.bounds(self._level)
+        return self._level
+
+    @property
+    def click_bonus(self) -> int:
+        if self._upgrades_mask is None:
+            self._compile_upgrades()
+        return self._click_bonus
+
+    @property
+    def passive_income(self) -> int:
+        if self._upgrades_mask is None:
+            self._compile_upgrades()
+        return self._passive_income
+
+    # --- время в ISO для базы и клиента ---
+
+    @property
+    def last_energy_update(self) -> str:
+        return format_epoch_ms(self.last_energy_update_ms)
+
+    @property
+    def last_passive_income_update(self) -> str:
+        return format_epoch_ms(self.last_passive_income_update_ms)
+
+    @property
+    def last_ad_time(self) -> str:
+        return format_epoch_ms(self.last_ad_time_ms)
+
+    @property
+    def last_referral_task_completion(self) -> Optional[str]:
+        return format_epoch_ms(self.last_referral_task_completion_ms)
+
+    # --- расчет и сериализация ---
+
+    def settle(self, now: Optional[int] = None) -> None:
+        """Начисляет восстановленную энергию и пассивный доход на момент now"""
+        now = now_ms() if now is None else now
+        self.energy, self.last_energy_update_ms = settle_energy(
+            self.energy, self.last_energy_update_ms, self.max_energy, now
+        )
+        self.score, self.last_passive_income_update_ms = settle_passive_income(
+            self.score, self.passive_income, self.last_passive_income_update_ms, now
+        )
+
+    def to_row(self, columns: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+        """Строка для базы: все записываемые колонки или только переданные"""
+        if columns is None:
+            return dict(zip(ROW_COLUMNS, _row_values(self)))
+        return {column: _column_getters[column](self) for column in columns}
+
+    def to_response(self) -> Dict[str, Any]:
+        """Данные пользователя для клиента"""
+        return RESPONSE_ENCODER.to_dict(self)
@@ -0,0 +1,171 @@
+"""Буфер отложенной записи (write-behind) для состояния пользователей.
+
+Клиент сохраняет состояние после каждого клика. Вместо upsert на каждый запрос
+изменения накапливаются в памяти по ``user_id`` (последняя запись побеждает
+для каждого поля) и периодически сбрасываются в базу пакетным upsert.
+
+Объем данных, которые могут быть потеряны при аварийном завершении процесса,
+ограничен двумя параметрами:
+
+* ``flush_interval`` - не более чем за этот интервал записи находятся только в памяти;
+* ``max_pending`` - не более стольких пользователей могут иметь несохраненные
+  изменения; при достижении лимита запись нового пользователя ждет
+  синхронного сброса, а если сброс не освободил места (база недоступна),
+  отклоняется исключением ``WriteBufferFull``.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Функция записи получает все строки сброса, сама делит их на пакеты и
+# возвращает ключи строк, которые нужно вернуть в буфер и повторить
+FlushFunc = Callable[[List[Dict[str, Any]]], Awaitable[Optional[Iterable[str]]]]
+
+
+class WriteBufferFull(Exception):
+    """Буфер заполнен, и сброс не освободил места: запись отклонена"""
+
+    def __init__(self, pending: int, retry_after: float):
+        super().__init__(f"Write-behind buffer is full ({pending} users pending)")
+        # Через сколько секунд можно повторить запись (следующий фоновый сброс)
+        self.retry_after = retry_after
+
+
+class WriteBehindBuffer:
+    """Накопитель изменений с периодическим пакетным сбросом"""
+
+    def __init__(
+        self,
+        flush_func: FlushFunc,
+        key: str = "user_id",
+        flush_interval: float = 1.0,
+        max_batch: int = 500,
+        max_pending: int = 5000,
+    ):
+        self._flush_func = flush_func
+        self._key = key
+        self.flush_interval = flush_interval
+        # Сколько пользователей накопить, чтобы сбросить буфер раньше интервала
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+
+        self._dirty: Dict[str, Dict[str, Any]] = {}
+        self._inflight: Dict[str, Dict[str, Any]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.stats = {
+            "writes": 0,
+            "coalesced": 0,
+            "flushes": 0,
+            "rows_flushed": 0,
+            "rows_retried": 0,
+            "flush_errors": 0,
+            "rejected": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.flush_interval > 0
+
+    def __len__(self) -> int:
+        return len(self._dirty)
+
+    async def put(self, record: Dict[str, Any]) -> None:
+        """Добавляет изменения пользователя в буфер; WriteBufferFull, если места нет"""
+        key = str(record[self._key])
+
+        if key not in self._dirty and len(self._dirty) >= self.max_pending:
+            # Ограничиваем объем несохраненных данных: ждем сброса. Неудавшиеся
+            # записи возвращаются в буфер, поэтому при недоступной базе места не
+            # станет, и новая запись отклоняется, а не копится без предела
+            await self.flush()
+            if key not in self._dirty and len(self._dirty) >= self.max_pending:
+                self.stats["rejected"] += 1
+                raise WriteBufferFull(len(self._dirty), self.flush_interval)
+
+        self.stats["writes"] += 1
+        current = self._dirty.get(key)
+        if current is None:
+            self._dirty[key] = dict(record)
+        else:
+            current.update(record)
+            self.stats["coalesced"] += 1
+
+        if len(self._dirty) >= self.max_batch:
+            self._wakeup.set()
+
+    def get_pending(self, key: str) -> Optional[Dict[str, Any]]:
+        """Возвращает изменения пользователя, которые еще не записаны в базу"""
+        inflight = self._inflight.get(key)
+        dirty = self._dirty.get(key)
+        if inflight is None and dirty is None:
+            return None
+        return {**(inflight or {}), **(dirty or {})}
+
+    async def flush(self) -> int:
+        """Сбрасывает все накопленные изменения в базу"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+            batch, self._dirty = self._dirty, {}
+            return await self._write(batch)
+
+    async def flush_key(self, key: str) -> None:
+        """Сбрасывает изменения одного пользователя (перед прямым изменением строки в базе)"""
+        async with self._flush_lock:
+            record = self._dirty.pop(str(key), None)
+            if record is None:
+                return
+            await self._write({str(key): record})
+
+    async def _write(self, batch: Dict[str, Dict[str, Any]]) -> int:
+        self._inflight = batch
+        rows = list(batch.values())
+        try:
+            retry_keys = {str(key) for key in (await self._flush_func(rows) or ())}
+            self.stats["flushes"] += 1
+        except Exception as e:
+            self.stats["flush_errors"] += 1
+            logger.error(f"Write-behind flush of {len(rows)} rows failed: {e}")
+            retry_keys = set(batch)
+        finally:
+            self._inflight = {}
+
+        # Возвращаем неудавшиеся записи в буфер, не затирая более новые изменения
+        retry_keys &= batch.keys()
+        for key in retry_keys:
+            self._dirty[key] = {**batch[key], **self._dirty.get(key, {})}
+        self.stats["rows_retried"] += len(retry_keys)
+        self.stats["rows_flushed"] += len(rows) - len(retry_keys)
+        return len(rows) - len(retry_keys)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        # Примитивы синхронизации привязываются к текущему циклу событий
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        if self.enabled and self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновый сброс и записывает все оставшиеся изменения"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()